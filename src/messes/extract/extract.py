@@ -16,7 +16,9 @@ Extract data from Excel workbooks, csv files, and JSON files.
     -v, --version                       - show the version.
     --silent                            - print no warning messages.
     --output <filename_json>            - output json filename.
+    --output-format <format>            - format of the --output file, "pretty", "compact", or "ndjson" with one record per line [default: pretty].
     --compare <filename_json>           - compare extracted metadata to given JSONized metadata.
+    --compare-diff <filename>           - with --compare, also write the differences as JSON, or as NDJSON if the filename ends in .ndjson or .jsonl.
     --modify <source>                   - modification directives worksheet name, regular expression, csv/json filename, or 
                                           xlsx_filename:[worksheet_name|regular_expression] or 
                                           google_sheets_url[:worksheet_name|regular_expression] 
@@ -34,6 +36,13 @@ Extract data from Excel workbooks, csv files, and JSON files.
     --delete <metadata_section>...      - delete a section of the JSONized metadata. Section format is tableKey or tableKey,IDKey or tableKey,IDKey,fieldName. These can be regular expressions.
     --keep <metadata_tables>            - only keep the selected tables.  Delete the rest.  Table format is tableKey,tableKey,... The tableKey can be a regular expression.
     --file-cleaning <remove_regex>      - a string or regular expression to remove characters in input files, removes unicode and \r characters by default, enter "None" to disable [default: _x([0-9a-fA-F]{4})_|\r].
+    --jobs <count>                      - number of worker processes used to extract the metadata sources. The sources are still merged in the order given [default: 1].
+    --all-sheets                        - extract every worksheet matching a regular expression worksheet name instead of only the first. 
+                                          The worksheets are merged in workbook order, read in worker processes with --jobs, 
+                                          and the time spent on each worksheet is printed.
+    --no-cache                          - do not read or write the on-disk cache of extracted sheets.
+    --xlsx-reader <reader>              - how xlsx/xlsm workbooks are read, "pandas" or "stream". "stream" reads the worksheet XML directly, 
+                                          which is faster and uses less memory, and falls back to pandas for sheets it can't read [default: pandas].
 
 Show Options:
   tables    - show tables in the extracted metadata.
@@ -71,14 +80,31 @@ import sys
 import re
 import collections
 import pathlib
-from typing import TextIO
+from typing import TextIO, Iterator
 import json
 import urllib.error
+import io
+import contextlib
+import concurrent.futures
+import time
+import itertools
+import hashlib
+import pickle
+import tempfile
+import zipfile
+import posixpath
+from xml.etree import ElementTree
 
 import pandas
+import numpy
 import docopt
 import jellyfish
 
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
 try:
     from messes.extract import cythonized_tagSheet
 except ImportError:
@@ -86,16 +112,36 @@ except ImportError:
 from messes import __version__
 
 silent = False
+extractionCache = None
+jobs = 1
+xlsxReader = "pandas"
 
 def main() :
     args = docopt.docopt(__doc__, version = __version__)
     
+    global silent, extractionCache, jobs, xlsxReader
     if args["--silent"]:
-        global silent
         silent = True
+    
+    if not args["--no-cache"]:
+        extractionCache = ExtractionCache(ExtractionCache.defaultDirectory())
         
     if args["--file-cleaning"] == "None":
         args["--file-cleaning"] = None
+    
+    if not args["--jobs"].isdigit() or int(args["--jobs"]) < 1:
+        print("Error: The value for --jobs must be a positive integer.", file=sys.stderr)
+        sys.exit()
+    jobs = int(args["--jobs"])
+    
+    if args["--output-format"] not in ["pretty", "compact", "ndjson"]:
+        print("Error: The value for --output-format must be \"pretty\", \"compact\", or \"ndjson\".", file=sys.stderr)
+        sys.exit()
+    
+    if args["--xlsx-reader"] not in ["pandas", "stream"]:
+        print("Error: The value for --xlsx-reader must be \"pandas\" or \"stream\".", file=sys.stderr)
+        sys.exit()
+    xlsxReader = args["--xlsx-reader"]
         
     
     tagParser = TagParser()
@@ -111,8 +157,14 @@ def main() :
     else:
         automateDefaulted = True
 
-    for metadataSource in args["<metadata_source>"]:
-        tagParser.readMetadata(metadataSource, args["--automate"], automateDefaulted, args["--modify"], modifyDefaulted, args["--file-cleaning"], args["--save-export"])
+    readMetadataArgs = [(metadataSource, args["--automate"], automateDefaulted, args["--modify"], modifyDefaulted, args["--file-cleaning"], args["--save-export"], 
+                         args["--all-sheets"]) for metadataSource in args["<metadata_source>"]]
+    if jobs > 1 and len(readMetadataArgs) > 1:
+        tagParser.readMetadataInParallel(readMetadataArgs, jobs)
+    else:
+        for arguments in readMetadataArgs:
+            tagParser.readMetadata(*arguments)
+    metadataSource = args["<metadata_source>"][-1]
 
     ## --end-modify is needed so that the merged metadata files can all be modified after being merged together.
     ## Without this each metadatasource only gets its own modification.
@@ -148,6 +200,7 @@ def main() :
 
         modificationDirectives = tagParser.readDirectives(modificationFilePath, modificationSheetName, "modification", args["--file-cleaning"])
         tagParser.modify(modificationDirectives)
+        TagParser.evictWorkbooks()
 
     if getattr(tagParser, "unusedModifications", None) != None and not silent:
         for (tableKey, fieldKey, comparisonType, modificationID) in tagParser.unusedModifications:
@@ -191,10 +244,13 @@ def main() :
             print("Unknown sub option for \"--show\" option: \"" + args["--show"] + "\"", file=sys.stderr)
 
     if args["--output"]: # save to JSON
-        if pathlib.Path(args["--output"]).suffix != ".json":
+        if args["--output-format"] == "ndjson":
+            if pathlib.Path(args["--output"]).suffix not in [".ndjson", ".jsonl"]:
+                args["--output"] = args["--output"] + ".ndjson"
+        elif pathlib.Path(args["--output"]).suffix != ".json":
             args["--output"] = args["--output"] + ".json"
         with open(args["--output"],'w') as jsonFile :
-            jsonFile.write(json.dumps(tagParser.extraction, sort_keys=True, indent=2, separators=(',', ': ')))
+            writeExtraction(tagParser.extraction, jsonFile, args["--output-format"])
 
     if args["--compare"]:
         comparePath = pathlib.Path(args["--compare"])
@@ -205,8 +261,11 @@ def main() :
                 with open(comparePath, 'r') as jsonFile:
                     otherMetadata = json.load(jsonFile)
                     print("Comparison", file=sys.stdout)
-                    if not tagParser.compare(otherMetadata, file=sys.stdout):
-                        print("No differences detected.", file=sys.stdout)
+                    with contextlib.ExitStack() as stack:
+                        diffFile = stack.enter_context(open(args["--compare-diff"], "w")) if args["--compare-diff"] else None
+                        diffFormat = "ndjson" if args["--compare-diff"] and pathlib.Path(args["--compare-diff"]).suffix in (".ndjson", ".jsonl") else "json"
+                        if not tagParser.compare(otherMetadata, file=sys.stdout, diffFile=diffFile, diffFormat=diffFormat):
+                            print("No differences detected.", file=sys.stdout)
         else:
             print("Error: The provided file for comparison does not exist.", file=sys.stderr)
 
@@ -227,6 +286,99 @@ def main() :
             print("There are no directives to save.",file=sys.stderr)
 
 
+def _initializeWorker():
+    """Forget the workbooks a forked worker process inherited from the parent process.
+    
+    The inherited workbooks share their open files, and so their file offsets, with the parent process and the 
+    other workers, so reading from them in several processes at once corrupts the reads. Each worker opens its own.
+    """
+    TagParser.workbookCache = {}
+
+
+def _readMetadataInWorker(readMetadataArgs: tuple, isSilent: bool, cache: ExtractionCache|None, reader: str, methodName: str = "readMetadata") -> dict:
+    """Run TagParser.readMetadata for one metadata source on a fresh TagParser in a worker process.
+    
+    Exceptions other than SystemExit are raised in the parent process by the executor.
+    
+    Args:
+        readMetadataArgs: the arguments to pass to readMetadata.
+        isSilent: the value of the module level silent variable in the parent process.
+        cache: the value of the module level extractionCache variable in the parent process.
+        reader: the value of the module level xlsxReader variable in the parent process.
+        methodName: the TagParser method to run instead of readMetadata, "_readSheet" to read one sheet of a workbook.
+        
+    Returns:
+        A dict with the "stdout" and "stderr" output printed while reading and either the "state" of the TagParser 
+        attributes to merge in the parent process, or the "exit" code if the method exited after printing an error.
+    """
+    global silent, extractionCache, jobs, xlsxReader
+    silent = isSilent
+    extractionCache = cache
+    xlsxReader = reader
+    ## Worker processes don't start their own worker processes.
+    jobs = 1
+    
+    tagParser = TagParser()
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            getattr(tagParser, methodName)(*readMetadataArgs)
+    except SystemExit as err:
+        return {"stdout" : stdout.getvalue(), "stderr" : stderr.getvalue(), "exit" : err.code}
+    
+    state = {attribute : getattr(tagParser, attribute) for attribute in TagParser.sourceStateAttributes if hasattr(tagParser, attribute)}
+    return {"stdout" : stdout.getvalue(), "stderr" : stderr.getvalue(), "state" : state}
+
+
+def writeExtraction(extraction: dict, file: TextIO, outputFormat: str = "pretty"):
+    """Writes extracted metadata to file as JSON a record at a time, without building the whole JSON string first.
+    
+    Args:
+        extraction: the extracted metadata, a dictionary of tables that are dictionaries of records.
+        file: the IO to write to.
+        outputFormat: "pretty" for the same output as json.dumps(extraction, sort_keys=True, indent=2, separators=(',', ': ')), 
+                      "compact" for the same output as json.dumps(extraction, sort_keys=True, separators=(',', ':')), 
+                      or "ndjson" for a line of {"table" : tableKey, "id" : idKey, "record" : record} for each record, in sorted order. 
+                      Tables without records have no lines in ndjson, and a table that isn't a dictionary is written as 
+                      a line of {"table" : tableKey, "value" : table}.
+    """
+    if outputFormat == "ndjson":
+        for tableKey, table in sorted(extraction.items()):
+            if not isinstance(table, dict):
+                file.write(json.dumps({"table" : tableKey, "value" : table}, sort_keys=True, separators=(',', ':')) + "\n")
+                continue
+            for idKey, record in sorted(table.items()):
+                file.write(json.dumps({"table" : tableKey, "id" : idKey, "record" : record}, sort_keys=True, separators=(',', ':')) + "\n")
+        return
+    
+    if outputFormat == "compact":
+        dumpOptions = {"sort_keys" : True, "separators" : (',', ':')}
+        newline, indentation, keySeparator = "", "", ":"
+    else:
+        dumpOptions = {"sort_keys" : True, "indent" : 2, "separators" : (',', ': ')}
+        newline, indentation, keySeparator = "\n", "  ", ": "
+    
+    if not extraction:
+        file.write("{}")
+        return
+    
+    ## Each table and record is written as json.dumps would write it, with its lines indented to its nesting level.
+    file.write("{")
+    for tableIndex, (tableKey, table) in enumerate(sorted(extraction.items())):
+        file.write(("," if tableIndex else "") + newline + indentation + json.dumps(tableKey) + keySeparator)
+        if not isinstance(table, dict) or not table:
+            file.write(json.dumps(table, **dumpOptions).replace("\n", newline + indentation))
+            continue
+        
+        file.write("{")
+        for recordIndex, (idKey, record) in enumerate(sorted(table.items())):
+            file.write(("," if recordIndex else "") + newline + indentation * 2 + json.dumps(idKey) + keySeparator + 
+                       json.dumps(record, **dumpOptions).replace("\n", newline + indentation * 2))
+        file.write(newline + indentation + "}")
+    file.write(newline + "}")
+
+
 def xstr(s: str|None) -> str :
     """Returns str(s) or "" if s is None.
 
@@ -284,6 +436,28 @@ class Evaluator(object) :
             self.requiredFields.extend(self.fieldTests.keys())
 
         self.code = compile("".join(finalTokenList), self.evalString, "eval")
+        self.matchedFieldsCache = {}
+
+    def __reduce__(self) -> tuple:
+        """Pickles the evaluator by its arguments, since compiled code cannot be pickled."""
+        return (Evaluator, (self.evalString, self.useFieldTests, self.listAsString))
+
+    def _resolveFieldTests(self, record: dict) -> dict:
+        """Returns the fields of the record that match each field test.
+        
+        Records in a table usually have the same fields, so the matches are cached by the record's field names.
+        
+        Args:
+            record: record from TagParser.extraction.
+            
+        Returns:
+            A dict of the fields matching each field test, keyed by the field name used in the code.
+        """
+        recordFields = tuple(record)
+        if (matchedFields := self.matchedFieldsCache.get(recordFields)) is None:
+            matchedFields = { fieldName : [field for field in recordFields if re.search(fieldTest,field)] for fieldName, fieldTest in self.fieldTests.items() }
+            self.matchedFieldsCache[recordFields] = matchedFields
+        return matchedFields
 
     def evaluate(self, record: dict) -> str|list:
         """Return eval results for the given record.
@@ -296,7 +470,7 @@ class Evaluator(object) :
         """
         restricted = { field.replace("%","_PERCENT_") : record[field] for field in self.requiredFields }
         if self.useFieldTests and self.fieldTests:
-            restricted.update({  [(fieldName, value) for field, value in record.items() if re.search(fieldTest,field)][0] for fieldName, fieldTest in self.fieldTests.items() })
+            restricted.update({ fieldName : record[fields[0]] for fieldName, fields in self._resolveFieldTests(record).items() })
 
         value = eval(self.code,restricted)
         if type(value) == list:
@@ -305,7 +479,7 @@ class Evaluator(object) :
             else:
                 return value
         else:
-            return xstr(eval(self.code,restricted))
+            return xstr(value)
 
     def hasRequiredFields(self, record: dict) -> bool:
         """Returns whether the record has all required fields.
@@ -317,7 +491,7 @@ class Evaluator(object) :
             True if the record has all required fiels, False otherwise.
         """
         return all(field in record for field in self.requiredFields) and ( not self.useFieldTests or not self.fieldTests or \
-               all([ len([(fieldName, value) for field, value in record.items() if re.search(fieldTest,field)]) == 1 for fieldName, fieldTest in self.fieldTests.items() ]) )
+               all(len(fields) == 1 for fields in self._resolveFieldTests(record).values()) )
 
     @staticmethod
     def isEvalString(evalString: str) -> re.Match|None:
@@ -341,23 +515,23 @@ class Operand(object) :
         """
         self.value = value
     
-    def __call__(self, record: dict, row: pandas.core.series.Series) :
+    def __call__(self, record: dict, row: tuple|numpy.ndarray) :
         """Passes, exists to be overridden.
 
         Args:
             record: record from TagParser.extraction.
-            row: pandas Series that is a row from metadata being parsed.
+            row: tuple or object ndarray that is a row from metadata being parsed.
         """
         pass
     
 class LiteralOperand(Operand) :
     """Represents string literal operands."""
-    def __call__(self, record: dict, row: pandas.core.series.Series) -> str:
+    def __call__(self, record: dict, row: tuple|numpy.ndarray) -> str:
         """Returns string value.
 
         Args:
             record: record from TagParser.extraction.
-            row: pandas Series that is a row from metadata being parsed.
+            row: tuple or object ndarray that is a row from metadata being parsed.
             
         Returns:
             String value of the operand.
@@ -366,12 +540,12 @@ class LiteralOperand(Operand) :
 
 class VariableOperand(Operand) :
     """Represents #table.record%attribute variable operands."""
-    def __call__(self, record: dict, row: pandas.core.series.Series) -> str:
+    def __call__(self, record: dict, row: tuple|numpy.ndarray) -> str:
         """Returns record field value.
 
         Args:
             record: record from TagParser.extraction.
-            row: pandas Series that is a row from metadata being parsed.
+            row: tuple or object ndarray that is a row from metadata being parsed.
             
         Returns:
             The value of the record's field where field is the operand's value.
@@ -380,17 +554,17 @@ class VariableOperand(Operand) :
 
 class ColumnOperand(Operand) :
     """Represents specific worksheet cells in a given column as operands."""
-    def __call__(self, record: dict, row: pandas.core.series.Series) -> str:
+    def __call__(self, record: dict, row: tuple|numpy.ndarray) -> str:
         """Rerurns column value in the given row.
 
         Args:
             record: record from TagParser.extraction.
-            row: pandas Series that is a row from metadata being parsed.
+            row: tuple or object ndarray that is a row from metadata being parsed.
             
         Returns:
-            xstr(row.iloc[self.value]).strip() of a column in the row. The column returned is the index based on the operand's value.
+            xstr(row[self.value]).strip() of a column in the row. The column returned is the index based on the operand's value.
         """
-        return xstr(row.iloc[self.value]).strip()
+        return xstr(row[self.value]).strip()
 
 class FieldMaker(object) :
     """Creates objects that convert specific information from a worksheet row into a field via concatenation of a list of operands."""
@@ -403,12 +577,12 @@ class FieldMaker(object) :
         self.field = field
         self.operands = []
 
-    def create(self, record: dict, row: pandas.core.series.Series) -> str:
+    def create(self, record: dict, row: tuple|numpy.ndarray) -> str:
         """Creates field-value and adds to record using row and record.
 
         Args:
             record: record from TagParser.extraction.
-            row: pandas Series that is a row from metadata being parsed.
+            row: tuple or object ndarray that is a row from metadata being parsed.
             
         Returns:
             Value created by applying all operands in self.operands and written into record[self.field].
@@ -435,12 +609,12 @@ class FieldMaker(object) :
 class ListFieldMaker(FieldMaker) :
     """Creates objects that convert specific information from a worksheet row into a list field via appending of a list of operands."""
 
-    def create(self, record: dict, row: pandas.core.series.Series) -> list:
+    def create(self, record: dict, row: tuple|numpy.ndarray) -> list:
         """Creates field-value and adds to record using PARAMETERS row and record.
 
         Args:
             record: record from TagParser.extraction.
-            row: pandas Series that is a row from metadata being parsed.
+            row: tuple or object ndarray that is a row from metadata being parsed.
             
         Returns:
             Value created by applying all operands in self.operands and written into record[self.field].
@@ -448,11 +622,12 @@ class ListFieldMaker(FieldMaker) :
         value = []
         for operand in self.operands :
             if isinstance(operand, ColumnOperand) : # split column operands into separate values.
+                operandValue = operand(record, row)
                 ## If the list field contains semicolons use it to split instead of commas.
-                if re.match(r".*;.*", operand(record, row)):
-                    value.extend(operand(record, row).strip(";").split(";"))
+                if re.match(r".*;.*", operandValue):
+                    value.extend(operandValue.strip(";").split(";"))
                 else:
-                    value.extend(operand(record, row).strip(",").split(","))
+                    value.extend(operandValue.strip(",").split(","))
             else :
                 value.append(operand(record, row))
 
@@ -483,6 +658,9 @@ class RecordMaker(object) :
         """Initializer"""
         self.table = ""
         self.fieldMakers = []
+        ## (field, slot) pairs set by TagParser._resolveTracking for the current tracking state.
+        self.trackedFieldSlots = []
+        self.addedFieldSlots = []
 
     @staticmethod
     def child(example: RecordMaker, table: str, parentIDIndex: int) -> RecordMaker:
@@ -507,11 +685,27 @@ class RecordMaker(object) :
         
         return child
 
-    def create(self, row: pandas.core.series.Series) -> tuple[str,dict]:
+    def clone(self) -> RecordMaker:
+        """Returns clone with copies of fieldMakers and of their operand lists.
+
+        Changing the clone's FieldMakers, or adding operands to them, does not change self. The operands 
+        themselves are shared, since they are never changed after they are created.
+
+        Returns:
+            A copy of self, without the tracking slots set by TagParser._resolveTracking.
+        """
+        clone = RecordMaker()
+        clone.table = self.table
+        clone.fieldMakers = [ copy.copy(fieldMaker) for fieldMaker in self.fieldMakers ]
+        for fieldMaker in clone.fieldMakers:
+            fieldMaker.operands = fieldMaker.operands.copy()
+        return clone
+
+    def create(self, row: tuple|numpy.ndarray) -> tuple[str,dict]:
         """Returns record created from given row.
 
         Args:
-            row: pandas Series that is a row from metadata being parsed.
+            row: tuple or object ndarray that is a row from metadata being parsed.
             
         Returns:
             The table string and created record in a tuple.
@@ -681,6 +875,157 @@ class RecordMaker(object) :
                 return fieldMaker
     
 
+class ModificationPlan(object):
+    """Modification directives compiled once for TagParser.modify and reused for any number of modify calls.
+    
+    The plan is not changed by modify, so the same plan can be applied to every metadata source, shared between 
+    TagParser objects, and pickled to send to worker processes. The plan keeps its own copy of the directives, 
+    so changing the caller's directives afterwards shows up as a difference from the plan's directives instead 
+    of silently changing them.
+    """
+    
+    def __init__(self, modificationDirectives: dict):
+        """
+        Args:
+            modificationDirectives: the modification directives as read by TagParser.readDirectives.
+        """
+        self._modificationDirectives = copy.deepcopy(modificationDirectives)
+        compiledDirectives = copy.deepcopy(modificationDirectives) # Must make deepcopy since regex objects being embedded.
+        
+        regexObjects = {}
+        for tableDict in compiledDirectives.values():
+            for fieldDict in tableDict.values():
+                # Compile regex objects for comparison.
+                for regex_type in ["regex-first", "regex-first-nowarn", "regex-unique", "regex-all"]:
+                    if regex_type in fieldDict:
+                        regexObjects.update({ regexString : re.compile(re.match(TagParser.reDetector, regexString)[1]) for regexString in  fieldDict[regex_type].keys()})
+                
+                for comparisonTypeDict in fieldDict.values():
+                    for fieldValueDict in comparisonTypeDict.values():
+                        # Compile regex objects for regex substitution directives.
+                        if "regex" in fieldValueDict:
+                            fieldValueDict["regex"] = { newField : [ re.match(TagParser.reDetector, regexPair[0])[1], re.match(TagParser.reDetector, regexPair[1])[1] ]
+                                                        for newField,regexPair in fieldValueDict["regex"].items() }
+                        
+                        # Create Evaluator objects for assign directives with "eval(...)" values.
+                        if "assign" in fieldValueDict:
+                            for newField in fieldValueDict["assign"].keys():
+                                if isinstance(fieldValueDict["assign"][newField], str) and (reMatch := Evaluator.isEvalString(fieldValueDict["assign"][newField])):
+                                    fieldValueDict["assign"][newField] = Evaluator(reMatch.group(1))
+        
+        self._compiledDirectives = compiledDirectives
+        self._regexObjects = regexObjects
+    
+    @property
+    def modificationDirectives(self) -> dict:
+        """The modification directives the plan was compiled from."""
+        return self._modificationDirectives
+    
+    @property
+    def compiledDirectives(self) -> dict:
+        """The modification directives with regexes compiled and eval assignments turned into Evaluator objects."""
+        return self._compiledDirectives
+    
+    @property
+    def regexObjects(self) -> dict:
+        """Compiled regular expressions for the regex comparison types, keyed by the directive's regex string."""
+        return self._regexObjects
+
+
+
+class RegexMatcher(object):
+    """Finds which of a set of regular expressions match a value, remembering the answer for each distinct value."""
+    
+    def __init__(self, regexObjects: dict):
+        """
+        Args:
+            regexObjects: mapping of regex IDs to compiled regular expressions.
+        """
+        self.regexObjects = regexObjects
+        self.matches = {}
+    
+    def __call__(self, value: str) -> frozenset:
+        """Returns the set of regex IDs whose regular expression re.search finds in value.
+        
+        Args:
+            value: the value to test.
+        """
+        if value not in self.matches:
+            self.matches[value] = frozenset(regexID for regexID, regexObject in self.regexObjects.items() if re.search(regexObject, value))
+        return self.matches[value]
+
+
+
+class LevenshteinIndex(object):
+    """Index of distinct strings for finding the strings nearest to a query by levenshtein distance.
+    
+    Every character that one string has more of than the other must be inserted, deleted, or substituted, so the 
+    larger of the two counts of unmatched characters is a lower bound on the levenshtein distance. The bounds to every 
+    indexed string are computed at once from a matrix of character counts, and the exact distance is only computed 
+    in order of increasing bound until the bound is greater than the smallest distance found.
+    """
+    
+    def __init__(self, items: list[str]):
+        """
+        Args:
+            items: the distinct strings to index.
+        """
+        self.items = items
+        self.characterColumns = {}
+        for item in items:
+            for character in item:
+                self.characterColumns.setdefault(character, len(self.characterColumns))
+        self.characterCounts = numpy.zeros((len(items), len(self.characterColumns)), dtype=numpy.int32)
+        for row, item in enumerate(items):
+            for character, count in collections.Counter(item).items():
+                self.characterCounts[row, self.characterColumns[character]] = count
+    
+    def nearest(self, query: str) -> tuple[int|None,list[str]]:
+        """Returns the smallest levenshtein distance from query to the indexed items and every item at that distance.
+        
+        Args:
+            query: the string to search for.
+            
+        Returns:
+            (distance, items), or (None, []) if there are no items.
+        """
+        queryCounts = numpy.zeros(len(self.characterColumns), dtype=numpy.int32)
+        unindexedCount = 0
+        for character, count in collections.Counter(query).items():
+            if character in self.characterColumns:
+                queryCounts[self.characterColumns[character]] = count
+            else:
+                unindexedCount += count
+        differences = self.characterCounts - queryCounts
+        bounds = numpy.maximum(numpy.clip(differences, 0, None).sum(axis=1), numpy.clip(-differences, 0, None).sum(axis=1) + unindexedCount)
+        
+        bestDistance = None
+        bestItems = []
+        for row in numpy.argsort(bounds, kind="stable"):
+            if bestDistance is not None and bounds[row] > bestDistance:
+                break
+            distance = jellyfish.levenshtein_distance(query, self.items[row])
+            if bestDistance is None or distance < bestDistance:
+                bestDistance = distance
+                bestItems = []
+            if distance == bestDistance:
+                bestItems.append(self.items[row])
+        return bestDistance, bestItems
+
+
+
+def _findNearestValues(values: list[str], queries: list[str]) -> list[tuple[int|None,list[str]]]:
+    """Returns LevenshteinIndex(values).nearest(query) for each query, used to search in worker processes.
+    
+    Args:
+        values: the distinct strings to search.
+        queries: the strings to search for.
+    """
+    index = LevenshteinIndex(values)
+    return [index.nearest(query) for query in queries]
+
+
+
 class TagParserError(Exception):
     """Exception class for errors thrown by TagParser."""
     def __init__(self, message: str, fileName: str, sheetName: str, rowIndex: int, columnIndex: int, endMessage: str =""):
@@ -724,6 +1069,470 @@ class TagParserError(Exception):
         return repr(self.value)
 
     
+class _TeeWriter(object):
+    """Writes everything written to it to a stream and also keeps a copy."""
+    
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self.copy = io.StringIO()
+    
+    def write(self, string: str) -> int:
+        self.copy.write(string)
+        return self.stream.write(string)
+    
+    def flush(self):
+        self.stream.flush()
+
+
+
+class ExtractionCache(object):
+    """On-disk cache of the extraction parseSheet produces for a sheet and of the directives readDirectives parses from a sheet.
+    
+    Extraction entries are keyed by a hash of the sheet contents, the automation and modification directives, the #track state 
+    at the start of the sheet, the MESSES version, and the extraction code, so a changed sheet, directive, or code never hits 
+    a stale entry. Directive entries are keyed by a hash of the directive sheet contents, the MESSES version, the extraction 
+    code, and the format of the pickled directives. Least recently used entries are deleted when the total size of the 
+    cache goes over maxSize bytes.
+    """
+    
+    ## Digest of the extract module and tagSheet module files, computed by codeDigest the first time it is needed.
+    extractionCodeDigest = None
+    ## Version of the format of pickled directive entries, which hold objects of classes other modules define, 
+    ## like compiled regular expressions. Increase it when what readDirectives stores changes.
+    directivesFormatVersion = 1
+    
+    def __init__(self, directory: str|pathlib.Path, maxSize: int = 256 * 1024 * 1024):
+        """
+        Args:
+            directory: the directory to keep cache entries in, created when the first entry is stored.
+            maxSize: the maximum total size of the cache entries in bytes.
+        """
+        self.directory = pathlib.Path(directory)
+        self.maxSize = maxSize
+    
+    @staticmethod
+    def defaultDirectory() -> pathlib.Path:
+        """Returns the messes/extract directory under XDG_CACHE_HOME, or under ~/.cache if that is not set."""
+        cacheHome = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        return pathlib.Path(cacheHome, "messes", "extract")
+    
+    @staticmethod
+    def codeDigest() -> str:
+        """Returns the SHA-256 hex digest of the files the extract module and the tagSheet module were loaded from.
+        
+        The version alone doesn't change when the code is edited in a development install, so the code itself is part 
+        of every key. A file that can't be read contributes its path instead.
+        """
+        if ExtractionCache.extractionCodeDigest is None:
+            digest = hashlib.sha256()
+            for path in [__file__, cythonized_tagSheet.__file__]:
+                try:
+                    with open(path, "rb") as codeFile:
+                        digest.update(codeFile.read())
+                except OSError:
+                    digest.update(str(path).encode("utf-8"))
+            ExtractionCache.extractionCodeDigest = digest.hexdigest()
+        return ExtractionCache.extractionCodeDigest
+    
+    @staticmethod
+    def key(fileName: str, sheetName: str, worksheet: pandas.core.frame.DataFrame, automationDirectives: list|None, 
+            modificationDirectives: dict|None, trackingState: tuple, isSilent: bool) -> str:
+        """Returns the hex digest identifying a sheet's extraction.
+        
+        Args:
+            fileName: name of the file the sheet was loaded from, it appears in messages.
+            sheetName: name of the sheet, it appears in messages.
+            worksheet: the sheet as returned by loadSheet.
+            automationDirectives: the automation directives the sheet is tagged with.
+            modificationDirectives: the modification directives for the sheet's source.
+            trackingState: the #track state of the TagParser before the sheet is parsed.
+            isSilent: whether warnings are printed, which changes the stored messages.
+            
+        Returns:
+            The SHA-256 hex digest of all of the inputs.
+        """
+        toJSON = lambda value: sorted(value) if isinstance(value, set) else str(value)
+        settings = json.dumps([__version__, ExtractionCache.codeDigest(), cythonized_tagSheet.__name__, str(fileName), str(sheetName), list(worksheet.shape), 
+                               automationDirectives, modificationDirectives, trackingState, isSilent], sort_keys=True, default=toJSON)
+        digest = hashlib.sha256(settings.encode("utf-8"))
+        digest.update(pandas.util.hash_pandas_object(worksheet, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    
+    @staticmethod
+    def directivesKey(fileName: str, sheetName: str, worksheet: pandas.core.frame.DataFrame, directiveType: str, isSilent: bool) -> str:
+        """Returns the hex digest identifying the directives parsed from a directive sheet.
+        
+        Args:
+            fileName: name of the file the sheet was loaded from, it appears in messages.
+            sheetName: name of the sheet, it appears in messages.
+            worksheet: the sheet as returned by loadSheet.
+            directiveType: either "modification" or "automation".
+            isSilent: whether warnings are printed, which changes the stored messages.
+            
+        Returns:
+            The SHA-256 hex digest of all of the inputs.
+        """
+        settings = json.dumps(["directives", ExtractionCache.directivesFormatVersion, __version__, ExtractionCache.codeDigest(), directiveType, 
+                               str(fileName), str(sheetName), list(worksheet.shape), isSilent])
+        digest = hashlib.sha256(settings.encode("utf-8"))
+        digest.update(pandas.util.hash_pandas_object(worksheet, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    
+    def load(self, key: str) -> dict|None:
+        """Returns the entry stored under key, or None if there is not one or it can't be unpickled.
+        
+        An entry pickled by a different version of a library, whose classes or modules have moved or been 
+        renamed, raises AttributeError or ImportError when it is unpickled, so it is treated as a miss too.
+        
+        Args:
+            key: a digest from ExtractionCache.key.
+        """
+        path = self.directory / (key + ".pickle")
+        try:
+            with open(path, "rb") as entryFile:
+                entry = pickle.load(entryFile)
+            os.utime(path)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        return entry
+    
+    def store(self, key: str, entry: dict):
+        """Store entry under key and evict least recently used entries if the cache is too large.
+        
+        Failing to write to the cache directory is not an error, the entry is just not stored.
+        
+        Args:
+            key: a digest from ExtractionCache.key.
+            entry: the picklable entry to store.
+        """
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as entryFile:
+                pickle.dump(entry, entryFile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(entryFile.name, self.directory / (key + ".pickle"))
+            self.evict()
+        except OSError:
+            pass
+    
+    def evict(self):
+        """Delete least recently used entries until the total size of the cache is at most self.maxSize."""
+        entries = []
+        for path in self.directory.glob("*.pickle"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        
+        totalSize = sum(entry[1] for entry in entries)
+        for modificationTime, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if totalSize <= self.maxSize:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            totalSize -= size
+
+
+
+class XlsxStreamReader(object):
+    """Reads xlsx/xlsm worksheets by streaming their XML straight out of the zip file.
+    
+    Each sheet is read with ElementTree.iterparse one row at a time, producing the same rows that pandas.read_excel 
+    gets from openpyxl, but as strings and without building a cell object for every cell. Sheets with date formatted 
+    or ISO date cells, and sheets that can't be parsed, are read with pandas instead.
+    """
+    
+    mainNamespace = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    relationshipNamespace = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+    officeRelationshipNamespace = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+    
+    ## Builtin number formats that are dates or times. More ids than openpyxl treats as dates are listed, 
+    ## which only means those sheets are read by pandas.
+    builtinDateFormatIDs = frozenset(itertools.chain(range(14, 23), range(27, 37), range(45, 48), range(50, 59)))
+    dateFormatStripper = re.compile(r'".*?"|\[(?!hh?\]|mm?\]|ss?\])[^\]]*\]')
+    dateFormatDetector = re.compile(r"(?<![_\\])[dmhysDMHYS]")
+    
+    def __init__(self, fileName: str):
+        """
+        Args:
+            fileName: path to an xlsx or xlsm file.
+            
+        Raises:
+            zipfile.BadZipFile: If fileName is not a zip file.
+            KeyError: If the workbook is missing from the zip file.
+            xml.etree.ElementTree.ParseError: If the workbook XML is malformed.
+        """
+        self.fileName = fileName
+        self.archive = zipfile.ZipFile(fileName)
+        self.sharedStrings = None
+        self.dateStyles = None
+        self.pandasWorkbook = None
+        
+        try:
+            workbookPath = "xl/workbook.xml"
+            for relationship in self._readRelationships("_rels/.rels").values():
+                if relationship[0].endswith("/officeDocument"):
+                    workbookPath = relationship[1].lstrip("/")
+            workbookDirectory = posixpath.dirname(workbookPath)
+            relationships = self._readRelationships(posixpath.join(workbookDirectory, "_rels", posixpath.basename(workbookPath) + ".rels"))
+            
+            self.sharedStringsPath = None
+            self.stylesPath = None
+            for relationshipType, target in relationships.values():
+                if relationshipType.endswith("/sharedStrings"):
+                    self.sharedStringsPath = self._resolveTarget(workbookDirectory, target)
+                elif relationshipType.endswith("/styles"):
+                    self.stylesPath = self._resolveTarget(workbookDirectory, target)
+            
+            ## Named sheet_names like pandas.ExcelFile.sheet_names so loadSheet can use either one. Chartsheets are left out like pandas does.
+            self.sheet_names = []
+            self.sheetPaths = {}
+            workbookRoot = ElementTree.fromstring(self.archive.read(workbookPath))
+            for sheet in workbookRoot.iter(XlsxStreamReader.mainNamespace + "sheet"):
+                relationship = relationships.get(sheet.get(XlsxStreamReader.officeRelationshipNamespace + "id"))
+                if relationship is None or not relationship[0].endswith("/worksheet"):
+                    continue
+                sheetPath = self._resolveTarget(workbookDirectory, relationship[1])
+                if sheetPath not in self.archive.NameToInfo:
+                    continue
+                self.sheet_names.append(sheet.get("name"))
+                self.sheetPaths[sheet.get("name")] = sheetPath
+        except:
+            self.archive.close()
+            raise
+    
+    def _readRelationships(self, path: str) -> dict:
+        """Returns the relationships in the .rels file at path as {Id : (Type, Target)}, or {} if there is no such file."""
+        if path not in self.archive.NameToInfo:
+            return {}
+        root = ElementTree.fromstring(self.archive.read(path))
+        return {relationship.get("Id") : (relationship.get("Type", ""), relationship.get("Target", "")) 
+                for relationship in root.iter(XlsxStreamReader.relationshipNamespace + "Relationship")}
+    
+    @staticmethod
+    def _resolveTarget(directory: str, target: str) -> str:
+        """Returns the path in the zip file of a relationship target, which is relative to directory unless it starts with /."""
+        if target.startswith("/"):
+            return target[1:]
+        return posixpath.normpath(posixpath.join(directory, target))
+    
+    @staticmethod
+    def _text(element: ElementTree.Element) -> str:
+        """Returns the text of a shared or inline string element, joining the runs of rich text and leaving out phonetic text."""
+        t = XlsxStreamReader.mainNamespace + "t"
+        if len(element) == 1 and element[0].tag == t:
+            return element[0].text or ""
+        
+        snippets = []
+        plain = element.find(t)
+        if plain is not None and plain.text is not None:
+            snippets.append(plain.text)
+        for run in element.iterfind(XlsxStreamReader.mainNamespace + "r"):
+            text = run.findtext(t)
+            if text:
+                snippets.append(text)
+        return "".join(snippets)
+    
+    def _loadSharedStrings(self):
+        """Reads the shared strings table into self.sharedStrings."""
+        self.sharedStrings = []
+        if self.sharedStringsPath is None or self.sharedStringsPath not in self.archive.NameToInfo:
+            return
+        
+        si = XlsxStreamReader.mainNamespace + "si"
+        with self.archive.open(self.sharedStringsPath) as xmlFile:
+            for _, element in ElementTree.iterparse(xmlFile):
+                if element.tag == si:
+                    self.sharedStrings.append(XlsxStreamReader._text(element).replace("x005F_", ""))
+                    element.clear()
+    
+    @staticmethod
+    def _isDateFormat(formatCode: str|None) -> bool:
+        """Returns True if the number format code formats numbers as dates or times."""
+        if formatCode is None:
+            return False
+        formatCode = XlsxStreamReader.dateFormatStripper.sub("", formatCode.split(";")[0])
+        return XlsxStreamReader.dateFormatDetector.search(formatCode) is not None
+    
+    def _loadDateStyles(self):
+        """Collects the indexes of the cell styles with date or time number formats into self.dateStyles."""
+        self.dateStyles = set()
+        if self.stylesPath is None or self.stylesPath not in self.archive.NameToInfo:
+            return
+        
+        root = ElementTree.fromstring(self.archive.read(self.stylesPath))
+        customFormats = {}
+        numFmts = root.find(XlsxStreamReader.mainNamespace + "numFmts")
+        if numFmts is not None:
+            for numFmt in numFmts.iterfind(XlsxStreamReader.mainNamespace + "numFmt"):
+                customFormats[int(numFmt.get("numFmtId"))] = numFmt.get("formatCode")
+        
+        cellXfs = root.find(XlsxStreamReader.mainNamespace + "cellXfs")
+        if cellXfs is None:
+            return
+        for index, xf in enumerate(cellXfs.iterfind(XlsxStreamReader.mainNamespace + "xf")):
+            numFmtId = int(xf.get("numFmtId", 0))
+            if numFmtId in customFormats:
+                if XlsxStreamReader._isDateFormat(customFormats[numFmtId]):
+                    self.dateStyles.add(index)
+            elif numFmtId in XlsxStreamReader.builtinDateFormatIDs:
+                self.dateStyles.add(index)
+    
+    @staticmethod
+    def _columnNumber(columnLetters: str) -> int:
+        """Returns the 1 based column number of the column letters of a cell reference, like "AB" in "AB12".
+        
+        Raises:
+            ValueError: If columnLetters isn't all letters.
+        """
+        if not columnLetters.isalpha():
+            raise ValueError("Invalid column letters \"" + columnLetters + "\".")
+        number = 0
+        for letter in columnLetters.upper():
+            number = number * 26 + ord(letter) - 64
+        return number
+    
+    def _streamSheetData(self, sheetName: str) -> list[list[str]]|None:
+        """Returns the rows of a sheet as lists of strings, or None if the sheet has cells that must be read by pandas.
+        
+        Rows and cells missing from the XML are filled in with empty strings, trailing empty cells and rows are dropped, 
+        and rows are padded to the same length, exactly as pandas does with the rows openpyxl reads.
+        """
+        if self.sharedStrings is None:
+            self._loadSharedStrings()
+        if self.dateStyles is None:
+            self._loadDateStyles()
+        sharedStrings = self.sharedStrings
+        dateStyles = self.dateStyles
+        
+        rowTag = XlsxStreamReader.mainNamespace + "row"
+        valueTag = XlsxStreamReader.mainNamespace + "v"
+        inlineStringTag = XlsxStreamReader.mainNamespace + "is"
+        ## Cell references repeat the same few column letters on every row, so their column numbers are looked up once.
+        columnNumbers = {}
+        
+        data = []
+        lastRowWithData = -1
+        rowCounter = 0
+        nextRowNumber = 1
+        with self.archive.open(self.sheetPaths[sheetName]) as xmlFile:
+            for _, element in ElementTree.iterparse(xmlFile):
+                if element.tag != rowTag:
+                    continue
+                
+                rowNumber = element.get("r")
+                if rowNumber is None:
+                    rowCounter += 1
+                else:
+                    try:
+                        rowCounter = int(rowNumber)
+                    except ValueError:
+                        rowCounter = float(rowNumber)
+                        if not rowCounter.is_integer():
+                            raise
+                        rowCounter = int(rowCounter)
+                
+                ## Rows missing from the XML are empty, and a row number that was already passed is skipped.
+                if rowCounter > nextRowNumber:
+                    data.extend([] for _ in range(rowCounter - nextRowNumber))
+                    nextRowNumber = rowCounter
+                if rowCounter < nextRowNumber:
+                    element.clear()
+                    continue
+                
+                cells = []
+                columnCounter = 0
+                for cell in element:
+                    cellReference = cell.get("r")
+                    if cellReference:
+                        columnLetters = cellReference.rstrip("0123456789")
+                        columnCounter = columnNumbers.get(columnLetters)
+                        if columnCounter is None:
+                            columnCounter = columnNumbers[columnLetters] = XlsxStreamReader._columnNumber(columnLetters)
+                    else:
+                        columnCounter += 1
+                    
+                    dataType = cell.get("t", "n")
+                    if dataType == "inlineStr":
+                        inlineString = cell.find(inlineStringTag)
+                        value = None if inlineString is None else XlsxStreamReader._text(inlineString)
+                    else:
+                        value = cell.findtext(valueTag) or None
+                        if value is None:
+                            pass
+                        elif dataType == "n":
+                            if dateStyles and int(cell.get("s") or 0) in dateStyles:
+                                return None
+                            number = float(value) if "." in value or "E" in value or "e" in value else int(value)
+                            integer = int(number)
+                            value = str(integer) if integer == number else str(float(number))
+                        elif dataType == "s":
+                            value = sharedStrings[int(value)]
+                        elif dataType == "b":
+                            value = str(bool(int(value)))
+                        elif dataType == "e":
+                            value = "nan"
+                        elif dataType == "d":
+                            return None
+                    cells.append((columnCounter, "" if value is None else value))
+                element.clear()
+                
+                row = []
+                if cells:
+                    row = [""] * cells[-1][0]
+                    for column, value in cells:
+                        if column <= len(row):
+                            row[column - 1] = value
+                    while row and row[-1] == "":
+                        row.pop()
+                if row:
+                    lastRowWithData = len(data)
+                data.append(row)
+                nextRowNumber += 1
+        
+        data = data[:lastRowWithData + 1]
+        if data:
+            maxWidth = max(len(row) for row in data)
+            for row in data:
+                if len(row) < maxWidth:
+                    row.extend([""] * (maxWidth - len(row)))
+        return data
+    
+    def readSheetData(self, sheetName: str) -> list[list]|None:
+        """Returns the rows of a sheet, read by pandas if the sheet can't be streamed.
+        
+        Args:
+            sheetName: name of the sheet to read.
+            
+        Returns:
+            The rows of the sheet, all the same length, to be handed to pandas' TextParser, or None if the sheet 
+            can't be streamed and the installed pandas can't return the rows of a sheet.
+        """
+        try:
+            data = self._streamSheetData(sheetName)
+        except (KeyError, IndexError, ValueError, OverflowError, ElementTree.ParseError, zipfile.BadZipFile):
+            data = None
+        
+        if data is None:
+            data = TagParser._readRawExcelSheet(self.openPandasWorkbook(), sheetName)
+        return data
+    
+    def openPandasWorkbook(self) -> pandas.ExcelFile:
+        """Returns the workbook opened with pandas, opening it the first time it is needed."""
+        if self.pandasWorkbook is None:
+            self.pandasWorkbook = pandas.ExcelFile(self.fileName)
+        return self.pandasWorkbook
+    
+    def close(self):
+        """Closes the zip file and the pandas workbook used for sheets that couldn't be streamed."""
+        self.archive.close()
+        if self.pandasWorkbook is not None:
+            self.pandasWorkbook.close()
+
+
+
 class TagParser(object):
     """Creates parser objects that convert tagged .xlsx worksheets into nested dictionary structures for metadata capture."""
     
@@ -732,11 +1541,42 @@ class TagParser(object):
         self.tablesAndFieldsToTrack = {}
         self.tableRecordsToAddTo = {}
         self.trackedFieldsDict = {}
+        ## Index of record id to (tableKey, record) built by _idIndex, and the extraction it was built from.
+        self.idIndex = None
+        self.idIndexExtraction = None
+        ## Lists made by _addRecord while merging duplicate records in the sheet being parsed, keyed by (table, id, field).
+        self.fieldAccumulators = {}
+        ## The tracked field keys of trackedFieldsDict and their values while rows are parsed, indexed by slot.
+        self.trackedSlotKeys = []
+        self.trackedValues = []
+        ## Seconds spent loading, tagging, and parsing each sheet read by _readSheet, in the order read.
+        self.sheetTimings = []
 
     reDetector = re.compile(r"r[\"'](.*)[\"']$")        
+    
+    ## Opened Excel workbooks shared by every loadSheet call, keyed by (resolved path or URL, modification time).
+    workbookCache = {}
+    
+    ## RecordMakers parsed from header rows, keyed by the header row's cell strings, in least to most recently used order, 
+    ## the number of header rows kept, and how often the cache was used.
+    headerRowCache = collections.OrderedDict()
+    headerRowCacheSize = 1024
+    headerRowCacheHits = 0
+    headerRowCacheMisses = 0
+    
+    ## The --file-cleaning regular expressions compiled by _compileRemoveRegex, keyed by the removeRegex string.
+    removeRegexCache = {}
+    
+    ## Exact modification directives find their records through a value index once the number of directives 
+    ## times the number of records in the table is over this.
+    exactMatchIndexThreshold = 1000
+    
+    ## Attributes that readMetadata leaves on the TagParser and that must be carried back from worker processes.
+    sourceStateAttributes = ["extraction", "automationDirectives", "modificationDirectives", "usedModifications", 
+                             "tablesAndFieldsToTrack", "tableRecordsToAddTo", "trackedFieldsDict", "sheetTimings"]
 
     @staticmethod
-    def _isEmptyRow(row: pandas.core.series.Series) -> bool:
+    def _isEmptyRow(row: tuple|numpy.ndarray) -> bool:
         """Returns True if row is empty.
 
         Args:
@@ -971,9 +1811,9 @@ class TagParser(object):
                 
             # track and untrack tags
             elif (reMatch := re.match(TagParser.trackingFieldDetector, token)) :
-                tag = reMatch[1]
+                tag = reMatch[2]
                 if len(tokens) < 2 or tokens[0] != "=":
-                    raise TagParserError(f"Incorrectly formatted {tag} tag, \"=\" must follow \"{tag}\" and \"table.field\" or \"table.field%attribute\" must follow \"=\"", self.fileName, self.sheetName, self.rowIndex, self.columnIndex)
+                    raise TagParserError(f"Incorrectly formatted {tag} tag, \"=\" must follow \"track\" and \"table.field\" or \"table.field%attribute\" must follow \"=\"", self.fileName, self.sheetName, self.rowIndex, self.columnIndex)
                 ## Munch the =.
                 tokens.pop(0)
                 nextToken = tokens.pop(0)
@@ -1142,26 +1982,42 @@ class TagParser(object):
         return childWithoutID, crecordFound
 
 
-    def _parseHeaderRow(self, row: pandas.core.series.Series) -> list[RecordMaker]:
+    def _parseHeaderRow(self, row: tuple|numpy.ndarray) -> list[RecordMaker]:
         """Parses header row and returns a list of RecordMakers.
         
         Args:
             row: header row from metadata file.
             
+        Header rows without tracking tags are parsed once and cached in TagParser.headerRowCache by their cell 
+        strings, and later parses of the same header row return clones of the cached RecordMakers. Only the 
+        TagParser.headerRowCacheSize most recently used header rows are kept. TagParser.headerRowCacheHits and 
+        TagParser.headerRowCacheMisses count the lookups for profiling.
+        
         Returns:
             A list of RecordMakers to be used to create records.
             
         Raises:
             TagParserError: Will raise an error if a child record does not have an id.
         """
+        cellStrings = tuple(xstr(cell).strip() for cell in row)
+        ## Tracking tags change the tracking state as they are parsed, so only header rows without them are cached.
+        isCacheable = not any("%track" in cellString or "%untrack" in cellString for cellString in cellStrings)
+        if isCacheable and cellStrings in TagParser.headerRowCache:
+            TagParser.headerRowCacheHits += 1
+            TagParser.headerRowCache.move_to_end(cellStrings)
+            recordMakers, self.lastTable, self.lastField = TagParser.headerRowCache[cellStrings]
+            recordMakers = [ recordMaker.clone() for recordMaker in recordMakers ]
+            self._resolveTracking(recordMakers)
+            return recordMakers
+        
         self.lastTable = ""
         self.lastField = ""
         
         recordMakers = [ RecordMaker(), RecordMaker() ]
         childWithoutID = False
         crecordFound = False
-        for self.columnIndex in range(0, len(row)) :
-            cellString = xstr(row.iloc[self.columnIndex]).strip()
+        for self.columnIndex in range(0, len(cellStrings)) :
+            cellString = cellStrings[self.columnIndex]
             if re.match('[*]?#', cellString) :
                 childWithoutID, crecordFound = self._parseHeaderCell(recordMakers, cellString, childWithoutID) 
         
@@ -1175,10 +2031,54 @@ class TagParser(object):
         # It must be removed, so that it won't cause issues later.
         if crecordFound:
             recordMakers.pop(0)
+        
+        if isCacheable:
+            TagParser.headerRowCacheMisses += 1
+            TagParser.headerRowCache[cellStrings] = ([ recordMaker.clone() for recordMaker in recordMakers ], self.lastTable, self.lastField)
+            if len(TagParser.headerRowCache) > TagParser.headerRowCacheSize:
+                TagParser.headerRowCache.popitem(last=False)
+        self._resolveTracking(recordMakers)
         return recordMakers
 
+    def _resolveTracking(self, recordMakers: list[RecordMaker]):
+        """Sets the tracking actions of each RecordMaker from the current tracking state.
+        
+        Each tracked "table.field" key in self.trackedFieldsDict is given a slot in self.trackedValues, so rows 
+        are parsed with index operations instead of building keys. A RecordMaker's trackedFieldSlots are the 
+        fields of its table whose values are tracked, and its addedFieldSlots are the tracked fields that are 
+        copied into its records. The values are written back to self.trackedFieldsDict by _storeTrackedValues.
+        
+        Args:
+            recordMakers: RecordMakers created from parsing a header row.
+        """
+        self.trackedSlotKeys = list(self.trackedFieldsDict)
+        self.trackedValues = list(self.trackedFieldsDict.values())
+        slots = { key : slot for slot, key in enumerate(self.trackedSlotKeys) }
+        for recordMaker in recordMakers:
+            table = recordMaker.table
+            trackedFields = list(self.tablesAndFieldsToTrack.get(table, ()))
+            fieldsToAdd = list(self.tableRecordsToAddTo.get(table, ()))
+            for key in [ table + "." + field for field in trackedFields ] + fieldsToAdd:
+                if key not in slots:
+                    slots[key] = len(self.trackedSlotKeys)
+                    self.trackedSlotKeys.append(key)
+                    self.trackedValues.append("")
+            recordMaker.trackedFieldSlots = [ (field, slots[table + "." + field]) for field in trackedFields ]
+            recordMaker.addedFieldSlots = [ (fieldToAdd, slots[fieldToAdd]) for fieldToAdd in fieldsToAdd ]
+
+    def _storeTrackedValues(self):
+        """Writes the tracked values that were set while parsing rows back to self.trackedFieldsDict."""
+        self.trackedFieldsDict.update(zip(self.trackedSlotKeys, self.trackedValues))
+
+    @staticmethod
+    def clearHeaderRowCache():
+        """Empties TagParser.headerRowCache and resets its hit and miss counters."""
+        TagParser.headerRowCache = collections.OrderedDict()
+        TagParser.headerRowCacheHits = 0
+        TagParser.headerRowCacheMisses = 0
+
     
-    def _parseRow(self, recordMakers: list[RecordMaker], row: pandas.core.series.Series):
+    def _parseRow(self, recordMakers: list[RecordMaker], row: tuple|numpy.ndarray):
         """Create new records and add them to the nested extraction dictionary.
         
         Loop through the RecordMakers in recordMaker and add records to self.extraction 
@@ -1188,6 +2088,7 @@ class TagParser(object):
             recordMakers: RecordMakers created from parsing a header row.
             row: row of data from a metadata file.
         """
+        trackedValues = self.trackedValues
         for recordMaker in recordMakers :
             if not recordMaker.hasValidID():
                 return
@@ -1196,113 +2097,589 @@ class TagParser(object):
                 self.extraction[table] = {}
 
             ## Keep track of ids in specified tables.
-            if table in self.tablesAndFieldsToTrack:
-                for field in self.tablesAndFieldsToTrack[table]:
-                    if field in record:
-                        self.trackedFieldsDict[table + "." + field] = record[field]
+            for field, slot in recordMaker.trackedFieldSlots:
+                if field in record:
+                    trackedValues[slot] = record[field]
                         
             ## Copy tracked fields into records if applicable.
-            if table in self.tableRecordsToAddTo:
-                for fieldToAdd in self.tableRecordsToAddTo[table]:
-                    if not fieldToAdd in record and self.trackedFieldsDict[fieldToAdd] != "":
-                        record[fieldToAdd] = self.trackedFieldsDict[fieldToAdd]
-                    elif fieldToAdd in record:
-                        self.trackedFieldsDict[fieldToAdd] = record[fieldToAdd]
+            for fieldToAdd, slot in recordMaker.addedFieldSlots:
+                if not fieldToAdd in record and trackedValues[slot] != "":
+                    record[fieldToAdd] = trackedValues[slot]
+                elif fieldToAdd in record:
+                    trackedValues[slot] = record[fieldToAdd]
+            
+            
+            self._addRecord(table, record)
+
+    def _addRecord(self, table: str, record: dict):
+        """Add a record to the table in self.extraction, merging it into an existing record with the same id.
+        
+        Args:
+            table: the table to add the record to.
+            record: the record created from a row.
+        """
+        if not record["id"] in self.extraction[table] :
+            self.extraction[table][record["id"]] = record
+        else :
+            existingRecord = self.extraction[table][record["id"]]
+            for key in record :
+                if key == "id" :
+                    pass
+                ## For when the same record is on multiple tables in the tabular file.
+                elif not key in existingRecord :
+                    existingRecord[key] = record[key]
+                elif isinstance(existingRecord[key], list) :
+                    ## A list can be shared with other records, so it is copied once and then extended in place.
+                    accumulatorKey = (table, record["id"], key)
+                    accumulator = self.fieldAccumulators.get(accumulatorKey)
+                    if accumulator is not existingRecord[key]:
+                        accumulator = list(existingRecord[key])
+                        self.fieldAccumulators[accumulatorKey] = accumulator
+                        existingRecord[key] = accumulator
+                    if isinstance(record[key], list):
+                        accumulator.extend(record[key])
+                    else:
+                        accumulator.append(record[key])
+                elif existingRecord[key] != record[key] :
+                    accumulator = [ existingRecord[key], record[key] ]
+                    self.fieldAccumulators[(table, record["id"], key)] = accumulator
+                    existingRecord[key] = accumulator
+
+    def _parseRows(self, recordMakers: list[RecordMaker], rows: numpy.ndarray):
+        """Create new records from every row of a tag group and add them to the nested extraction dictionary.
+        
+        Every row of a tag group is made into records by the same RecordMakers, so each field is built for all 
+        of the rows at once, column by column, and then the fields are zipped into records. Tracking actions and 
+        #table.field operands depend on the records made from earlier rows or fields, so tag groups that use 
+        them are parsed a row at a time with _parseRow instead.
+        
+        Args:
+            recordMakers: RecordMakers created from parsing a header row.
+            rows: the rows of the tag group as a 2 dimensional object ndarray.
+        """
+        validRecordMakers = TagParser._validRecordMakers(recordMakers)
+        if not TagParser._canParseColumnwise(validRecordMakers):
+            for row in rows:
+                self._parseRow(recordMakers, row)
+            self._storeTrackedValues()
+            return
+        
+        if len(rows) == 0 or not validRecordMakers:
+            return
+        
+        columnIndexes = { operand.value for recordMaker in validRecordMakers for fieldMaker in recordMaker.fieldMakers for operand in fieldMaker.operands if isinstance(operand, ColumnOperand) }
+        strippedColumns = {}
+        for columnIndex in columnIndexes:
+            column = rows[:, columnIndex].tolist()
+            try:
+                strippedColumns[columnIndex] = list(map(str.strip, column))
+            except TypeError:
+                strippedColumns[columnIndex] = [xstr(value).strip() for value in column]
+        
+        recordsByRecordMaker = []
+        for recordMaker in validRecordMakers:
+            fieldColumns = [TagParser._buildFieldColumn(fieldMaker, strippedColumns, len(rows)) for fieldMaker in recordMaker.fieldMakers]
+            fields = [fieldMaker.field for fieldMaker in recordMaker.fieldMakers]
+            ## Records are made as they are added, so only the records that are kept are in memory at once.
+            recordsByRecordMaker.append(TagParser._zipRecords(fields, fieldColumns))
+        
+        tables = [recordMaker.table for recordMaker in validRecordMakers]
+        for table in tables:
+            if not table in self.extraction :
+                self.extraction[table] = {}
+        for rowRecords in zip(*recordsByRecordMaker):
+            for table, record in zip(tables, rowRecords):
+                self._addRecord(table, record)
+
+    @staticmethod
+    def _validRecordMakers(recordMakers: list[RecordMaker]) -> list[RecordMaker]:
+        """Returns the RecordMakers before the first one without a valid id, which are the ones _parseRow makes records with.
+        
+        Args:
+            recordMakers: RecordMakers created from parsing a header row.
+        """
+        validRecordMakers = []
+        for recordMaker in recordMakers :
+            if not recordMaker.hasValidID():
+                break
+            validRecordMakers.append(recordMaker)
+        return validRecordMakers
+
+    @staticmethod
+    def _canParseColumnwise(validRecordMakers: list[RecordMaker]) -> bool:
+        """Returns whether the rows of a tag group can be made into records column by column.
+        
+        Args:
+            validRecordMakers: the RecordMakers with valid ids created from parsing a header row.
+            
+        Returns:
+            False if a RecordMaker has tracking actions or a field that can't be built column by column, True otherwise.
+        """
+        return not any(recordMaker.trackedFieldSlots or recordMaker.addedFieldSlots for recordMaker in validRecordMakers) and \
+               all(TagParser._canBuildColumnwise(recordMaker) for recordMaker in validRecordMakers)
+
+    @staticmethod
+    def _zipRecords(fields: list[str], fieldColumns: list[list]) -> Iterator[dict]:
+        """Yields the record for each row made from the values of its fields.
+        
+        Args:
+            fields: the field names of the records.
+            fieldColumns: the values of each field for every row.
+        """
+        for values in zip(*fieldColumns):
+            yield dict(zip(fields, values))
+
+    @staticmethod
+    def _canBuildColumnwise(recordMaker: RecordMaker) -> bool:
+        """Returns whether every field of the RecordMaker can be built column by column.
+        
+        Args:
+            recordMaker: RecordMaker created from parsing a header row.
+            
+        Returns:
+            False if a field uses a #table.field operand or a list field is made by more than one ListFieldMaker, True otherwise.
+        """
+        fields = [fieldMaker.field for fieldMaker in recordMaker.fieldMakers]
+        return all(type(fieldMaker) in (FieldMaker, ListFieldMaker) and 
+                   all(type(operand) in (LiteralOperand, ColumnOperand) for operand in fieldMaker.operands) and 
+                   (type(fieldMaker) == FieldMaker or fields.count(fieldMaker.field) == 1)
+                   for fieldMaker in recordMaker.fieldMakers)
+
+    @staticmethod
+    def _buildFieldColumn(fieldMaker: FieldMaker|ListFieldMaker, strippedColumns: dict, numberOfRows: int) -> list:
+        """Returns the values the FieldMaker creates for every row of a tag group.
+        
+        Args:
+            fieldMaker: a FieldMaker or ListFieldMaker with only literal and column operands.
+            strippedColumns: the stripped cell strings of the tag group's columns, keyed by column index.
+            numberOfRows: the number of rows in the tag group.
+            
+        Returns:
+            The value of the field for each row, a new list for each row if fieldMaker is a ListFieldMaker.
+        """
+        if type(fieldMaker) == ListFieldMaker:
+            operandColumns = []
+            for operand in fieldMaker.operands:
+                if isinstance(operand, ColumnOperand):
+                    ## If the list field contains semicolons use it to split instead of commas.
+                    ## A semicolon before the first newline is what re.match(r".*;.*", value) finds in ListFieldMaker.create.
+                    operandColumns.append([ value.strip(";").split(";") if ";" in value.partition("\n")[0] else value.strip(",").split(",") for value in strippedColumns[operand.value] ])
+                else:
+                    operandColumns.append(itertools.repeat([operand.value], numberOfRows))
+            if len(operandColumns) == 1 and isinstance(fieldMaker.operands[0], ColumnOperand):
+                return operandColumns[0]
+            return [ list(itertools.chain.from_iterable(values)) for values in zip(*operandColumns) ] if operandColumns else [ [] for index in range(numberOfRows) ]
+        
+        operandColumns = [ strippedColumns[operand.value] if isinstance(operand, ColumnOperand) else itertools.repeat(operand.value, numberOfRows) for operand in fieldMaker.operands ]
+        if len(operandColumns) == 1 and isinstance(fieldMaker.operands[0], ColumnOperand):
+            return operandColumns[0]
+        return [ "".join(values) for values in zip(*operandColumns) ] if operandColumns else [""] * numberOfRows
+
+
+    def parseSheet(self, fileName: str, sheetName: str, worksheet: pandas.core.frame.DataFrame):
+        """Extracts useful metadata from the worksheet and puts it in the extraction dictionary.
+        
+        Args:
+            fileName: name of the file, used for error messages.
+            sheetName: name of the Excel sheet, used for error messages.
+            worksheet: the data from the file name and sheet name.
+        """
+        self.lastTable = ""
+        self.lastField = ""
+        self.columnIndex = -1
+        self.rowIndex = -1
+        self.fileName = fileName
+        self.sheetName = sheetName
+
+        
+        ## Rows are parsed as object ndarrays, since building a pandas Series for every row costs more than parsing it.
+        rows = worksheet.to_numpy(dtype=object)
+        ignoreRows = TagParser._matchFirstColumn(rows, r"\s*#ignore\s*")
+        self.idIndex = None
+        self.fieldAccumulators = {}
+        headerRowIndexes, endOfTagGroupIndexes = TagParser._findTagGroups(worksheet)
+        ## Consecutive tag groups under the same header row that has no tracking tags and whose records use no tracking 
+        ## neither read nor change the tracking state, and their rows are still parsed in order, so their header row is 
+        ## parsed once and their rows are gathered into one segment that is parsed column by column when a different 
+        ## tag group or the sheet ends.
+        segmentHeader, segmentRecordMakers, segmentRows = None, None, []
+        
+        for headerRowIndex, endOfTagGroupIndex in zip(headerRowIndexes, endOfTagGroupIndexes):
+            self.rowIndex = headerRowIndex
+            header = tuple(rows[headerRowIndex])
+            isSegmentHeader = header == segmentHeader
+            recordMakers = segmentRecordMakers if isSegmentHeader else self._parseHeaderRow(rows[headerRowIndex])
+            # for recordmaker in recordMakers:
+            #     for fieldmaker in recordmaker.fieldMakers:
+            #         print(fieldmaker.field)
+            #         print(fieldmaker.operands)
+            # print()
+            ## If there is not validID print a message unless there are no fieldMakers, then assume it is a control flow header row. 
+            ## For example a row that just turns tracking on or off.
+            if not recordMakers[-1].hasValidID() and recordMakers[-1].fieldMakers and not silent:
+                print("Warning: The header row at index " + str(headerRowIndex) + " in the compiled export sheet does not have an \"id\" tag, so it will not be in the JSON output.", file=sys.stderr)
+            groupRows = rows[headerRowIndex+1:endOfTagGroupIndex]
+            ignoredInGroup = ignoreRows[headerRowIndex+1:endOfTagGroupIndex]
+            if ignoredInGroup.any():
+                groupRows = groupRows[~ignoredInGroup]
+            
+            isTransposed = '#transpose' in rows[headerRowIndex][0]
+            if isSegmentHeader and len(groupRows) > 0 and not isTransposed:
+                segmentRows.append(groupRows)
+                continue
+            self._parseSegment(segmentRecordMakers, segmentRows)
+            segmentHeader, segmentRecordMakers, segmentRows = None, None, []
+            
+            ## If there was a header, but no rows underneath we want to add an empty table.
+            if len(groupRows) == 0:
+                if not recordMakers[0].table in self.extraction :
+                    self.extraction[recordMakers[0].table] = {}
+            
+            # TODO test transpoe tags again after changes to cythonized_tagSheet.
+            if isTransposed:
+                workingDF = worksheet.iloc[headerRowIndex+1:endOfTagGroupIndex, :]
+                if ignoredInGroup.any():
+                    workingDF = workingDF[~ignoredInGroup]
+                print(workingDF.transpose())
+                print()
+                workingDF = workingDF.transpose().iloc[2:, :]
+                print(workingDF)
+                print()
+                workingDF.insert(0, '#tags', '')
+                emptyWorkingRows = (workingDF=="").all(axis=1)
+                workingDF = workingDF.drop(workingDF.loc[emptyWorkingRows, :].index)
+                print(workingDF)
+                print()
+                groupRows = workingDF.to_numpy(dtype=object)
+            
+            validRecordMakers = TagParser._validRecordMakers(recordMakers)
+            if len(groupRows) > 0 and not isTransposed and validRecordMakers and TagParser._canParseColumnwise(validRecordMakers) and \
+               not any("%track" in xstr(cell) or "%untrack" in xstr(cell) for cell in header):
+                segmentHeader, segmentRecordMakers, segmentRows = header, recordMakers, [groupRows]
+            else:
+                self._parseRows(recordMakers, groupRows)
+        
+        self._parseSegment(segmentRecordMakers, segmentRows)
+        
+        ## The merged lists are finished, so later sheets and modifications copy them before changing them.
+        self.fieldAccumulators = {}
+        self.rowIndex = -1
+
+    def _parseSegment(self, recordMakers: list[RecordMaker]|None, segmentRows: list[numpy.ndarray]):
+        """Parses the rows of consecutive tag groups under the same header row as one tag group.
+        
+        Args:
+            recordMakers: RecordMakers created from parsing the first header row of the segment, None if there is no segment.
+            segmentRows: the rows of each tag group in the segment.
+        """
+        if recordMakers is None:
+            return
+        self._parseRows(recordMakers, segmentRows[0] if len(segmentRows) == 1 else numpy.concatenate(segmentRows))
+
+    @staticmethod
+    def _matchFirstColumn(rows: numpy.ndarray, pattern: str) -> numpy.ndarray:
+        """Returns which rows have a first cell that re.match finds pattern in.
+        
+        Args:
+            rows: the worksheet as a 2 dimensional object ndarray.
+            pattern: the regular expression to match.
+            
+        Returns:
+            A boolean ndarray with an element for each row.
+        """
+        pattern = re.compile(pattern)
+        return numpy.fromiter((isinstance(cell, str) and pattern.match(cell) is not None for cell in rows[:, 0]), dtype=bool, count=rows.shape[0])
+
+    @staticmethod
+    def _findTagGroups(worksheet: pandas.core.frame.DataFrame) -> tuple[list[int],list[int]]:
+        """Finds the header row and the end of each tag group in the worksheet.
+        
+        A tag group starts at a #tags row and ends at the next empty or #tags row, or at the end of the worksheet.
+        
+        Args:
+            worksheet: the tagged worksheet.
+            
+        Returns:
+            The positions of the header rows and the positions just past the end of their tag groups.
+        """
+        rows = worksheet.to_numpy(dtype=object)
+        tagRows = TagParser._matchFirstColumn(rows, r"\s*#tags\s*")
+        ## Compared a column at a time so only one column of comparisons exists at once.
+        emptyRows = numpy.ones(rows.shape[0], dtype=bool)
+        for column in rows.T:
+            emptyRows &= column == ""
+        
+        headerRowIndexes = numpy.flatnonzero(tagRows)
+        possibleEndOfTagGroupRows = numpy.append(numpy.flatnonzero(emptyRows | tagRows), worksheet.shape[0])
+        endOfTagGroupIndexes = possibleEndOfTagGroupRows[numpy.searchsorted(possibleEndOfTagGroupRows, headerRowIndexes, side="right")]
+        return headerRowIndexes.tolist(), endOfTagGroupIndexes.tolist()
+
+
+    @staticmethod
+    def _workbookCacheKey(fileName: str) -> tuple[str,int|None]:
+        """Returns the key fileName is stored under in TagParser.workbookCache.
+        
+        Args:
+            fileName: path to an Excel file or a Google Sheets URL.
+            
+        Returns:
+            (resolved path, modification time in ns) for a local file, (URL, None) for a Google Sheets file.
+        """
+        if TagParser.isGoogleSheetsFile(fileName):
+            return (fileName, None)
+        path = pathlib.Path(fileName).resolve()
+        return (str(path), path.stat().st_mtime_ns)
+    
+    @staticmethod
+    def _openWorkbook(fileName: str) -> pandas.ExcelFile|XlsxStreamReader:
+        """Returns the opened Excel workbook for fileName, opening it only if it is not already in TagParser.workbookCache.
+        
+        A cached workbook whose file has been modified since it was opened, or that was opened with a different 
+        reader than the module level xlsxReader variable selects, is closed and replaced. Local xlsx/xlsm files 
+        are opened with XlsxStreamReader if xlsxReader is "stream", anything else is opened with pandas.
+        
+        Args:
+            fileName: path to an Excel file or a Google Sheets URL.
+            
+        Returns:
+            The opened workbook.
+        """
+        key = TagParser._workbookCacheKey(fileName)
+        useStreamReader = xlsxReader == "stream" and not TagParser.isGoogleSheetsFile(fileName) and zipfile.is_zipfile(fileName)
+        if key in TagParser.workbookCache and isinstance(TagParser.workbookCache[key], XlsxStreamReader) == useStreamReader:
+            return TagParser.workbookCache[key]
+        
+        for staleKey in [cachedKey for cachedKey in TagParser.workbookCache if cachedKey[0] == key[0]]:
+            TagParser.workbookCache.pop(staleKey).close()
+        
+        workbook = None
+        if useStreamReader:
+            try:
+                workbook = XlsxStreamReader(fileName)
+            except (KeyError, ValueError, ElementTree.ParseError, zipfile.BadZipFile):
+                pass
+        if workbook is None:
+            workbook = pandas.ExcelFile(fileName)
+        TagParser.workbookCache[key] = workbook
+        return workbook
+    
+    @staticmethod
+    def evictWorkbooks(fileNames: list[str]|None = None):
+        """Close and remove workbooks from TagParser.workbookCache.
+        
+        Args:
+            fileNames: the paths or URLs of the workbooks to evict. If None, every cached workbook is evicted.
+        """
+        if fileNames is None:
+            evictedKeys = list(TagParser.workbookCache)
+        else:
+            locations = set()
+            for fileName in fileNames:
+                if TagParser.isGoogleSheetsFile(fileName):
+                    locations.add(fileName)
+                elif isinstance(fileName, str):
+                    locations.add(str(pathlib.Path(fileName).resolve()))
+            evictedKeys = [key for key in TagParser.workbookCache if key[0] in locations]
+        
+        for key in evictedKeys:
+            TagParser.workbookCache.pop(key).close()
+    
+    @staticmethod
+    def _cleanCells(dataFrame: pandas.core.frame.DataFrame, removeRegex: str|None) -> pandas.core.frame.DataFrame:
+        """Replace the nan of empty cells with empty strings and remove removeRegex matches without copying the sheet.
+        
+        The cells are put in a single object ndarray, which the returned DataFrame wraps without copying, 
+        so tagSheet and parseSheet can use the same array. removeRegex is removed from the array in place 
+        by _removeMatches, which gives the same cells as DataFrame.replace.
+        
+        Args:
+            dataFrame: the sheet as read in, with nan for empty cells.
+            removeRegex: a string to pass to DataFrame.replace() to replace characters with an empty string. Set to None to not replace anything.
+            
+        Returns:
+            A DataFrame over a single object ndarray with empty strings for empty cells.
+        """
+        cells = dataFrame.to_numpy(dtype=object)
+        cells[pandas.isna(cells)] = ""
+        if removeRegex:
+            TagParser._removeMatches(cells, removeRegex)
+        return pandas.DataFrame(cells, index=dataFrame.index, columns=dataFrame.columns, copy=False)
+    
+    @staticmethod
+    def _requiredLiterals(parsedPattern: sre_parse.SubPattern|list) -> set[str]|None:
+        """Returns literal strings at least one of which is in every match of a parsed regular expression.
+        
+        The longest run of literal characters that every match must contain is used, looking into groups, 
+        alternations, and repeats that must occur at least once.
+        
+        Args:
+            parsedPattern: the pattern or a part of it as parsed by sre_parse.parse.
+            
+        Returns:
+            The set of literals, or None if no such set could be found.
+        """
+        requirements = []
+        run = []
+        for opcode, argument in list(parsedPattern) + [(None, None)]:
+            if opcode is sre_parse.LITERAL:
+                run.append(chr(argument))
+                continue
+            
+            if run:
+                requirements.append({"".join(run)})
+                run = []
+            
+            if opcode is sre_parse.SUBPATTERN:
+                group, addFlags, deleteFlags, subpattern = argument
+                if not addFlags & re.IGNORECASE:
+                    requirements.append(TagParser._requiredLiterals(subpattern))
+            elif opcode is sre_parse.BRANCH:
+                branchLiterals = [TagParser._requiredLiterals(branch) for branch in argument[1]]
+                if all(literals is not None for literals in branchLiterals):
+                    requirements.append(set().union(*branchLiterals))
+            elif opcode in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None)) and argument[0] > 0:
+                requirements.append(TagParser._requiredLiterals(argument[2]))
+            elif opcode is getattr(sre_parse, "ATOMIC_GROUP", None):
+                requirements.append(TagParser._requiredLiterals(argument))
+        
+        requirements = [literals for literals in requirements if literals]
+        if not requirements:
+            return None
+        return max(requirements, key=lambda literals: min(len(literal) for literal in literals))
+    
+    @staticmethod
+    def _compileRemoveRegex(removeRegex: str) -> tuple[re.Pattern,re.Pattern|None]:
+        """Compiles removeRegex and a pattern for the literals every match of it contains, once per removeRegex.
+        
+        Args:
+            removeRegex: the regular expression to compile.
+            
+        Returns:
+            (compiled removeRegex, compiled alternation of its required literals), the second is None if no required literals were found.
+            
+        Raises:
+            re.error: If removeRegex isn't a valid regular expression, like DataFrame.replace.
+        """
+        if removeRegex in TagParser.removeRegexCache:
+            return TagParser.removeRegexCache[removeRegex]
+        
+        pattern = re.compile(removeRegex)
+        literalPattern = None
+        if not pattern.flags & re.IGNORECASE:
+            try:
+                literals = TagParser._requiredLiterals(sre_parse.parse(removeRegex))
+            except Exception:
+                literals = None
+            ## Cells are searched for the literals joined by NUL characters, so a literal can't contain one.
+            if literals and not any("\0" in literal for literal in literals):
+                literalPattern = re.compile("|".join(re.escape(literal) for literal in sorted(literals)))
+        
+        TagParser.removeRegexCache[removeRegex] = (pattern, literalPattern)
+        return pattern, literalPattern
+    
+    @staticmethod
+    def _removeMatches(cells: numpy.ndarray, removeRegex: str):
+        """Remove the matches of removeRegex from the string cells of an object ndarray in place, exactly as DataFrame.replace(removeRegex, "", regex=True) would.
+        
+        Each column is joined into one string and searched for the literals every match must contain, so the regular 
+        expression is only run on the few cells that could match. Empty cells can't change and are skipped.
+        
+        Args:
+            cells: the cells to clean.
+            removeRegex: the regular expression to remove.
+        """
+        pattern, literalPattern = TagParser._compileRemoveRegex(removeRegex)
+        for columnIndex in range(cells.shape[1]):
+            values = cells[:, columnIndex].tolist()
             
+            if literalPattern is None:
+                candidates = [rowIndex for rowIndex, value in enumerate(values) if value and isinstance(value, str)]
+            else:
+                strings = values
+                try:
+                    joinedValues = "\0".join(strings)
+                except TypeError:
+                    strings = [value if isinstance(value, str) else "" for value in values]
+                    joinedValues = "\0".join(strings)
+                positions = numpy.fromiter((match.start() for match in literalPattern.finditer(joinedValues)), dtype=numpy.int64)
+                if not len(positions):
+                    continue
+                starts = numpy.cumsum(numpy.fromiter(map(len, strings), dtype=numpy.int64, count=len(strings)) + 1)
+                candidates = numpy.unique(numpy.searchsorted(starts, positions, side="right"))
             
-            if not record["id"] in self.extraction[table] :
-                self.extraction[table][record["id"]] = record
-            else :
-                for key in record :
-                    if key == "id" :
-                        pass
-                    ## For when the same record is on multiple tables in the tabular file.
-                    elif not key in self.extraction[table][record["id"]] :
-                        self.extraction[table][record["id"]][key] = record[key]
-                    elif isinstance(self.extraction[table][record["id"]][key], list) :
-                        if isinstance(record[key], list):
-                            self.extraction[table][record["id"]][key] = self.extraction[table][record["id"]][key] + record[key]
-                        else:
-                            self.extraction[table][record["id"]][key].append(record[key])
-                    elif self.extraction[table][record["id"]][key] != record[key] :
-                        self.extraction[table][record["id"]][key] = [ self.extraction[table][record["id"]][key], record[key] ]
-
+            for rowIndex in candidates:
+                value = values[rowIndex]
+                if isinstance(value, str):
+                    cleanedValue = pattern.sub("", value)
+                    if cleanedValue != value:
+                        cells[rowIndex, columnIndex] = cleanedValue
 
-    def parseSheet(self, fileName: str, sheetName: str, worksheet: pandas.core.frame.DataFrame):
-        """Extracts useful metadata from the worksheet and puts it in the extraction dictionary.
+    @staticmethod
+    def _readExcelSheet(workbook: pandas.ExcelFile|XlsxStreamReader, sheetName: str) -> pandas.core.frame.DataFrame:
+        """Read a sheet from an Excel workbook with every cell converted to a string.
+        
+        The sheet is only parsed once. The raw cell values are handed to the same text parser read_excel uses, 
+        with a str converter for every column, so the result is identical to calling read_excel with 
+        converters={column:str for column in dataFrame.columns}, which would require reading the sheet twice 
+        to learn its columns. Neither read_excel with dtype=str nor with dtype=object gives the same cells, so 
+        if the installed pandas doesn't have the reader methods and TextParser used here, the sheet is read 
+        twice with read_excel instead.
         
         Args:
-            fileName: name of the file, used for error messages.
-            sheetName: name of the Excel sheet, used for error messages.
-            worksheet: the data from the file name and sheet name.
+            workbook: the opened Excel file to read from.
+            sheetName: name of the sheet to read.
+            
+        Returns:
+            The sheet as a DataFrame with integer row and column labels.
         """
-        self.lastTable = ""
-        self.lastField = ""
-        self.columnIndex = -1
-        self.rowIndex = -1
-        self.fileName = fileName
-        self.sheetName = sheetName
-
+        textParser = getattr(pandas.io.parsers, "TextParser", None)
+        data = None
+        if textParser is not None:
+            if isinstance(workbook, XlsxStreamReader):
+                data = workbook.readSheetData(sheetName)
+            else:
+                data = TagParser._readRawExcelSheet(workbook, sheetName)
         
-        tagRows = worksheet.iloc[:,0].str.match(r"\s*#tags\s*")
-        ignoreRows = worksheet.iloc[:,0].str.match(r"\s*#ignore\s*")
-        emptyRows = (worksheet=="").all(axis=1)
+        if data is None:
+            if isinstance(workbook, XlsxStreamReader):
+                workbook = workbook.openPandasWorkbook()
+            dataFrame = pandas.read_excel(workbook, sheetName, header=None, index_col=None)
+            converters = {column:str for column in dataFrame.columns}
+            return pandas.read_excel(workbook, sheetName, header=None, index_col=None, converters=converters)
         
-        possibleEndOfTagGroupRows = emptyRows | tagRows
-        worksheetHeaderRows = worksheet[tagRows]
-        endOfTagGroupIndexes = []
-        for header_index in worksheetHeaderRows.index:
-            endingIndexFound = False
-            for index in possibleEndOfTagGroupRows[possibleEndOfTagGroupRows].index:
-                if index > header_index:
-                    endOfTagGroupIndexes.append(index)
-                    endingIndexFound = True
-                    break
-            if not endingIndexFound:
-                endOfTagGroupIndexes.append(possibleEndOfTagGroupRows.index[-1]+1)
-            
-        for headerRow in range(worksheetHeaderRows.shape[0]):
-            headerRowIndex = worksheetHeaderRows.iloc[headerRow,:].name
-            self.rowIndex = headerRowIndex
-            recordMakers = self._parseHeaderRow(worksheet.loc[headerRowIndex, :])
-            # for recordmaker in recordMakers:
-            #     for fieldmaker in recordmaker.fieldMakers:
-            #         print(fieldmaker.field)
-            #         print(fieldmaker.operands)
-            # print()
-            ## If there is not validID print a message unless there are no fieldMakers, then assume it is a control flow header row. 
-            ## For example a row that just turns tracking on or off.
-            if not recordMakers[-1].hasValidID() and recordMakers[-1].fieldMakers and not silent:
-                print("Warning: The header row at index " + str(headerRowIndex) + " in the compiled export sheet does not have an \"id\" tag, so it will not be in the JSON output.", file=sys.stderr)
-            rowsToParse = [index for index in range(headerRowIndex+1, endOfTagGroupIndexes[headerRow])]
-            rowsToParse = ignoreRows.iloc[rowsToParse][~ignoreRows]
-            ## If there was a header, but no rows underneath we want to add an empty table.
-            if len(rowsToParse) == 0:
-                if not recordMakers[0].table in self.extraction :
-                    self.extraction[recordMakers[0].table] = {}
-            
-            workingDF = worksheet.loc[rowsToParse.index, :]
-            # TODO test transpoe tags again after changes to cythonized_tagSheet.
-            if '#transpose' in worksheet.loc[headerRowIndex,:].iloc[0]:
-                print(workingDF.transpose())
-                print()
-                workingDF = workingDF.transpose().iloc[2:, :]
-                print(workingDF)
-                print()
-                workingDF.insert(0, '#tags', '')
-                emptyWorkingRows = (workingDF=="").all(axis=1)
-                workingDF = workingDF.drop(workingDF.loc[emptyWorkingRows, :].index)
-                print(workingDF)
-                print()
+        if not data:
+            return pandas.DataFrame()
+        
+        converters = {column:str for column in range(len(data[0]))}
+        parser = textParser(data, header=None, index_col=None, converters=converters, skip_blank_lines=False)
+        return parser.read()
+    
+    @staticmethod
+    def _readRawExcelSheet(workbook: pandas.ExcelFile, sheetName: str) -> list[list]|None:
+        """Read the cell values of a sheet with the reader of a pandas.ExcelFile, as read_excel gets them.
+        
+        Args:
+            workbook: the opened Excel file to read from.
+            sheetName: name of the sheet to read.
             
-            for index in workingDF.index:
-                self._parseRow(recordMakers, workingDF.loc[index, :])
-            # for index in rowsToParse.index:
-            #     self._parseRow(recordMakers, worksheet.loc[index, :])
+        Returns:
+            The rows of the sheet, all the same length, or None if the reader of the installed pandas doesn't have 
+            the get_sheet_by_name and get_sheet_data methods this was written against.
+        """
+        reader = getattr(workbook, "_reader", None)
+        if not hasattr(reader, "get_sheet_by_name") or not hasattr(reader, "get_sheet_data"):
+            return None
         
-        self.rowIndex = -1
-
-
+        sheet = reader.get_sheet_by_name(sheetName)
+        try:
+            data = reader.get_sheet_data(sheet)
+        except TypeError:
+            data = None
+        if hasattr(sheet, "close"):
+            sheet.close()
+        return data
+    
+    
     @staticmethod
     def loadSheet(fileName: str|TextIO, sheetName: str, removeRegex: str|None = None, isDefaultSearch: bool = False) -> tuple[str,str,pandas.core.frame.DataFrame]|None:
         """Load and return worksheet as a pandas data frame.
@@ -1325,7 +2702,7 @@ class TagParser(object):
         if (isinstance(fileName, str) and (reMatch := re.search(r"^(.*\.xls[xm]?)$", fileName))) or isGoogleSheetsFile:
             if os.path.isfile(fileName) or isGoogleSheetsFile:
                 try:
-                    workbook = pandas.ExcelFile(fileName)
+                    workbook = TagParser._openWorkbook(fileName)
                 except urllib.error.HTTPError:
                     print("The Google Sheets file \"" + fileName + "\" does not exist or the URL is malformed.", file=sys.stderr)
                     return None
@@ -1338,9 +2715,7 @@ class TagParser(object):
                 
                 for sheetName in workbook.sheet_names:
                     if re.search(sheetDetector, sheetName) != None:
-                        dataFrame = pandas.read_excel(workbook, sheetName, header=None, index_col=None)
-                        converters = {column:str for column in dataFrame.columns}
-                        dataFrame = pandas.read_excel(workbook, sheetName, header=None, index_col=None, converters=converters)
+                        dataFrame = TagParser._readExcelSheet(workbook, sheetName)
                         if len(dataFrame) == 0:
                             if isGoogleSheetsFile:
                                 print("There is no data in the sheet, " + sheetName + \
@@ -1350,9 +2725,7 @@ class TagParser(object):
                             return None
                         else:
                             ## Empty cells are read in as nan by default, replace with empty string.
-                            dataFrame = dataFrame.fillna("")
-                            if removeRegex:
-                                dataFrame.replace(removeRegex, "", regex=True, inplace=True)
+                            dataFrame = TagParser._cleanCells(dataFrame, removeRegex)
                             return (fileName, sheetName, dataFrame)
                 if not isDefaultSearch:
                     print("r'" + sheetDetector.pattern + "' did not match any sheets in \"" + fileName + "\".", file=sys.stderr)
@@ -1370,9 +2743,7 @@ class TagParser(object):
                     if len(dataFrame) == 0:
                         print("There is no data in csv file \"" + fileName + "\".", file=sys.stderr)
                     else:
-                        dataFrame = dataFrame.fillna("") # Empty cells are read in as nan by default. Therefore replace with empty string.
-                        if removeRegex:
-                            dataFrame.replace(removeRegex, "", regex=True, inplace=True)
+                        dataFrame = TagParser._cleanCells(dataFrame, removeRegex) # Empty cells are read in as nan by default. Therefore replace with empty string.
                         sheetName = "" if not sheetName else sheetName
                         return (fileName, sheetName, dataFrame)
             else:
@@ -1381,6 +2752,32 @@ class TagParser(object):
             raise Exception("Invalid worksheet identifier \"" + fileName + "\" passed into function.")
 
         return None
+    
+    @staticmethod
+    def matchingSheetNames(fileName: str, sheetName: str) -> list[str]:
+        """Return the names of every sheet in an Excel workbook or Google Sheets file that matches sheetName, in workbook order.
+        
+        Args:
+            fileName: filename of the Excel workbook or Google Sheets URL.
+            sheetName: sheet name to match. Can be a regular expression to search for sheets.
+            
+        Returns:
+            The matching sheet names, which is empty if fileName is not a workbook that can be opened.
+        """
+        isGoogleSheetsFile = TagParser.isGoogleSheetsFile(fileName)
+        if not (isGoogleSheetsFile or (re.search(r"\.xls[xm]?$", fileName) and os.path.isfile(fileName))):
+            return []
+        
+        try:
+            workbook = TagParser._openWorkbook(fileName)
+        except urllib.error.HTTPError:
+            return []
+        
+        if re.match(TagParser.reDetector, sheetName):
+            sheetDetector = re.compile(re.match(TagParser.reDetector, sheetName)[1])
+        else:
+            sheetDetector = re.compile("^" + re.escape(sheetName) + "$")
+        return [workbookSheetName for workbookSheetName in workbook.sheet_names if re.search(sheetDetector, workbookSheetName) != None]
 
 
     @staticmethod
@@ -1407,7 +2804,7 @@ class TagParser(object):
         """
         return True if isinstance(string, str) and "docs.google.com/spreadsheets/d/" in string else False
 
-    def readMetadata(self, metadataSource: str, automationSource: str, automateDefaulted: bool, modificationSource: str, modifyDefaulted: bool, removeRegex: str|None, saveExtension: str =None):
+    def readMetadata(self, metadataSource: str, automationSource: str, automateDefaulted: bool, modificationSource: str, modifyDefaulted: bool, removeRegex: str|None, saveExtension: str =None, allSheets: bool = False):
         """Reads metadata from source.
         
         Args:
@@ -1419,6 +2816,8 @@ class TagParser(object):
             removeRegex: a string to pass to DataFrame.replace() to replace characters with an empty string in the dataframe that is read in. 
                          Can be a regex. Set to None to not replace anything. Passed to loadSheet and readDirectives.
             saveExtension: if "csv" saves the export as a csv file, else saves it as an Excel file.
+            allSheets: if True and the metadata sheet name is a regular expression, read every matching sheet instead of only the first, 
+                       merging them in workbook order.
         """
         ## If automation source is just a sheet name then see if metadata source is an Excel or Google Sheets file.
         if not TagParser.hasFileExtension(automationSource) and \
@@ -1508,29 +2907,188 @@ class TagParser(object):
                 newMetadata = json.load(jsonFile)
             currentMetadata = self.extraction
             self.extraction = newMetadata
+            self._modifyAndMerge(currentMetadata, modificationDirectives)
+        elif allSheets and metadataSheetName is not None and re.match(TagParser.reDetector, metadataSheetName) and \
+             (sheetNames := TagParser.matchingSheetNames(metadataFilePath, metadataSheetName)):
+            self._readSheets(metadataFilePath, sheetNames, automationDirectives, modificationDirectives, removeRegex, saveExtension)
         else:
-            currentMetadata = self.extraction
-            newMetadata = {}
-            self.extraction = newMetadata
-            dataFrameTuple = TagParser.loadSheet(metadataFilePath, metadataSheetName, removeRegex=removeRegex)
-
-            if dataFrameTuple:
-                dataFrame = self.tagSheet(automationDirectives, dataFrameTuple[2], silent)
-                dataFrameTuple = (dataFrameTuple[0], dataFrameTuple[1], dataFrame)
+            self._readSheet(metadataFilePath, metadataSheetName, automationDirectives, modificationDirectives, removeRegex, saveExtension)
 
-                if saveExtension != None:
-                    self.saveSheet(*dataFrameTuple, saveExtension)
+        ## The automation, modification, and export sheets for this source have all been read, so its workbooks are no longer needed.
+        TagParser.evictWorkbooks([automationFilePath, modificationFilePath, metadataFilePath])
 
-                ## Ultimately modifies self.extraction.
-                self.parseSheet(*dataFrameTuple)
+    def _readSheet(self, metadataFilePath: str, metadataSheetName: str|None, automationDirectives: list|None, modificationDirectives: dict|None, 
+                   removeRegex: str|None, saveExtension: str|None):
+        """Loads, tags, parses, and modifies one metadata sheet and merges it into self.extraction.
+        
+        The time spent loading, tagging, and parsing the sheet is added to self.sheetTimings.
+        
+        Args:
+            metadataFilePath: file path to the metadata file.
+            metadataSheetName: sheet name for an Excel file. Can be a regular expression to search for a sheet.
+            automationDirectives: the automation directives to tag the sheet with, or None.
+            modificationDirectives: the modification directives to modify the parsed sheet with, or None.
+            removeRegex: a string to pass to DataFrame.replace() to replace characters with an empty string in the dataframe that is read in. 
+                         Can be a regex. Set to None to not replace anything. Passed to loadSheet.
+            saveExtension: if "csv" saves the export as a csv file, else saves it as an Excel file. Set to None to not save it.
+        """
+        currentMetadata = self.extraction
+        newMetadata = {}
+        self.extraction = newMetadata
+        startTime = time.perf_counter()
+        dataFrameTuple = TagParser.loadSheet(metadataFilePath, metadataSheetName, removeRegex=removeRegex)
+        loadTime = time.perf_counter()
+        tagTime = loadTime
+
+        if dataFrameTuple:
+            sheetName = dataFrameTuple[1]
+            ## The cache can't recreate the tagged sheet, so it is only used when the export is not being saved.
+            cacheKey = None
+            if extractionCache is not None and saveExtension is None:
+                trackingState = (self.tablesAndFieldsToTrack, self.tableRecordsToAddTo, self.trackedFieldsDict)
+                cacheKey = ExtractionCache.key(*dataFrameTuple, automationDirectives, modificationDirectives, trackingState, silent)
+                cachedEntry = extractionCache.load(cacheKey)
+                if cachedEntry is not None:
+                    sys.stdout.write(cachedEntry["stdout"])
+                    sys.stderr.write(cachedEntry["stderr"])
+                    self.extraction.update(cachedEntry["extraction"])
+                    self.tablesAndFieldsToTrack, self.tableRecordsToAddTo, self.trackedFieldsDict = cachedEntry["trackingState"]
+                    dataFrameTuple = None
+            
+            if dataFrameTuple:
+                stdout = _TeeWriter(sys.stdout)
+                stderr = _TeeWriter(sys.stderr)
+                with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                    dataFrame = self.tagSheet(automationDirectives, dataFrameTuple[2], silent)
+                    dataFrameTuple = (dataFrameTuple[0], dataFrameTuple[1], dataFrame)
+                    tagTime = time.perf_counter()
+
+                    if saveExtension != None:
+                        self.saveSheet(*dataFrameTuple, saveExtension)
+
+                    ## Ultimately modifies self.extraction.
+                    self.parseSheet(*dataFrameTuple)
+                
+                if cacheKey is not None:
+                    extractionCache.store(cacheKey, {"stdout" : stdout.copy.getvalue(), "stderr" : stderr.copy.getvalue(), "extraction" : self.extraction, 
+                                                     "trackingState" : (self.tablesAndFieldsToTrack, self.tableRecordsToAddTo, self.trackedFieldsDict)})
+        else:
+            sheetName = metadataSheetName
+        parseTime = time.perf_counter()
+        
+        self._modifyAndMerge(currentMetadata, modificationDirectives)
+        self.sheetTimings.append({"file" : metadataFilePath, "sheet" : sheetName, "load" : loadTime - startTime, "tag" : tagTime - loadTime, 
+                                  "parse" : parseTime - tagTime, "total" : time.perf_counter() - startTime})
 
+    def _readSheets(self, metadataFilePath: str, sheetNames: list[str], automationDirectives: list|None, modificationDirectives: dict|None, 
+                    removeRegex: str|None, saveExtension: str|None):
+        """Reads several sheets of one workbook with _readSheet and merges them in the order given.
+        
+        If the module level jobs is more than 1 the sheets are read in worker processes, each of which opens the workbook itself 
+        instead of using the one opened in this process, otherwise they are all read from the workbook opened in this process. 
+        Like readMetadataInParallel, a sheet is read again in this process if an earlier sheet left #track tracking on, and a 
+        worker's error is raised in this process. A timing report for each sheet is printed to stderr unless silent.
+        
+        Args:
+            metadataFilePath: file path to the metadata workbook.
+            sheetNames: the names of the sheets to read, in workbook order.
+            automationDirectives: the automation directives to tag the sheets with, or None.
+            modificationDirectives: the modification directives to modify each parsed sheet with, or None.
+            removeRegex: a string to pass to DataFrame.replace() to replace characters with an empty string in the dataframe that is read in. 
+                         Can be a regex. Set to None to not replace anything. Passed to loadSheet.
+            saveExtension: if "csv" saves the exports as csv files, else saves them as Excel files. Set to None to not save them.
+        """
+        firstTiming = len(self.sheetTimings)
+        ## Each sheet is named exactly, as a regular expression so that no sheet name can be mistaken for one.
+        readSheetArgs = [(metadataFilePath, "r'^" + re.escape(sheetName) + "$'", automationDirectives, modificationDirectives, removeRegex, saveExtension) 
+                         for sheetName in sheetNames]
+        if jobs > 1 and len(readSheetArgs) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_initializeWorker) as executor:
+                futures = [executor.submit(_readMetadataInWorker, arguments, silent, extractionCache, xlsxReader, "_readSheet") for arguments in readSheetArgs]
+                for arguments, future in zip(readSheetArgs, futures):
+                    if self.tablesAndFieldsToTrack or self.tableRecordsToAddTo or self.trackedFieldsDict:
+                        self._readSheet(*arguments)
+                    else:
+                        self._mergeWorkerResult(future.result())
+        else:
+            for arguments in readSheetArgs:
+                self._readSheet(*arguments)
+        
+        if not silent:
+            print("Sheet timings for \"" + metadataFilePath + "\":", file=sys.stderr)
+            for timing in self.sheetTimings[firstTiming:]:
+                print("    " + timing["sheet"] + ": " + ", ".join(step + " " + format(timing[step], ".3f") + "s" for step in ["load", "tag", "parse", "total"]), 
+                      file=sys.stderr)
+
+    def _modifyAndMerge(self, currentMetadata: dict, modificationDirectives: dict|None):
+        """Modifies self.extraction with modificationDirectives and then merges it into currentMetadata, which becomes self.extraction.
+        
+        Args:
+            currentMetadata: the metadata extracted before the source in self.extraction was read.
+            modificationDirectives: the modification directives for the source, or None.
+        """
         if self.extraction:
-            self.modify(modificationDirectives)
+            ## Sources usually share their modification directives, so the compiled plan is reused until the directives change.
+            if modificationDirectives != None and (getattr(self, "modificationPlan", None) is None or self.modificationPlan.modificationDirectives != modificationDirectives):
+                self.modificationPlan = ModificationPlan(modificationDirectives)
+            self.modify(self.modificationPlan if modificationDirectives != None else None)
 
         newMetadata = self.extraction
         self.extraction = currentMetadata
         self.merge(newMetadata)
 
+    def readMetadataInParallel(self, readMetadataArgs: list[tuple], jobs: int):
+        """Reads metadata from several sources in worker processes and merges them in the order given.
+        
+        Each source is read by readMetadata on a fresh TagParser in a worker process. The results are merged 
+        in order, exactly as if readMetadata had been called on this TagParser for each source in turn. 
+        A source is read again in this process if an earlier source left #track tracking on, since a fresh 
+        TagParser would not have that tracking state. Otherwise an error in a worker is raised in this process, 
+        or if the worker exited after printing an error, its output is written and this process exits too.
+        
+        Args:
+            readMetadataArgs: the arguments to pass to readMetadata for each source.
+            jobs: the number of worker processes to use.
+        """
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_initializeWorker) as executor:
+            futures = [executor.submit(_readMetadataInWorker, arguments, silent, extractionCache, xlsxReader) for arguments in readMetadataArgs]
+            for arguments, future in zip(readMetadataArgs, futures):
+                if self.tablesAndFieldsToTrack or self.tableRecordsToAddTo or self.trackedFieldsDict:
+                    self.readMetadata(*arguments)
+                    continue
+                
+                self._mergeWorkerResult(future.result())
+
+    def _mergeWorkerResult(self, result: dict):
+        """Writes the output of a worker process and merges the TagParser state it returned into this TagParser.
+        
+        Args:
+            result: the dict returned by _readMetadataInWorker.
+            
+        Raises:
+            SystemExit: with the worker's exit code if the worker exited after printing an error.
+        """
+        sys.stdout.write(result["stdout"])
+        sys.stderr.write(result["stderr"])
+        if "exit" in result:
+            sys.exit(result["exit"])
+        
+        state = result["state"]
+        newMetadata = state.pop("extraction")
+        if "usedModifications" in state:
+            ## modify was called with directives in the worker, so update the used and unused directives here as modify would have.
+            if getattr(self,"unusedModifications", None) is None:
+                self.unusedModifications = set()
+            if getattr(self,"usedModifications", None) is None:
+                self.usedModifications = set()
+            self.usedModifications.update(state.pop("usedModifications"))
+            self._updateUnusedModifications(state["modificationDirectives"])
+        self.sheetTimings.extend(state.pop("sheetTimings", []))
+        
+        for attribute, value in state.items():
+            setattr(self, attribute, value)
+        self.merge(newMetadata)
+
 
     def saveSheet(self, fileName: str, sheetName: str, worksheet: pandas.core.frame.DataFrame, saveExtension: str):
         """Save given worksheet in the given format.
@@ -1562,19 +3120,19 @@ class TagParser(object):
         
         Args:
             automationDirectives: a dictionary used to place the tags in the appropriate places.
-            worksheet: the DataFrame in which to place the tags.
+            worksheet: the DataFrame in which to place the tags. Its cells are tagged in place where possible, so it should not be used afterwards.
             silent: if True don't print warnings.
             
         Returns:
             The modified worksheet.
         """
-        worksheet, wasAutomationDirectiveUsed = cythonized_tagSheet.tagSheet(automationDirectives, worksheet.to_numpy(dtype=object, copy=True), silent)
+        worksheet, wasAutomationDirectiveUsed = cythonized_tagSheet.tagSheet(automationDirectives, worksheet.to_numpy(dtype=object), silent)
         
         for i, directive in enumerate(wasAutomationDirectiveUsed):
             if not directive and not silent:
                 print("Warning: Automation directive number " + str(i) + " was never used.", file=sys.stderr)
         
-        worksheet = pandas.DataFrame(worksheet)
+        worksheet = pandas.DataFrame(worksheet, copy=False)
         # TODO delete.
         # print(worksheet)
         # print()
@@ -1582,6 +3140,9 @@ class TagParser(object):
 
         return worksheet
 
+    ## Number of directive and distinct value pairs a levenshtein comparison needs before it is worth splitting over worker processes.
+    levenshteinParallelThreshold = 1000000
+    
     modificationComparisonTypes = [ "exact", "regex", "levenshtein" ]
     matchTypes = ["first", "first-nowarn", "unique", "all"]
     def _parseModificationSheet(self, fileName: str, sheetName: str, worksheet: pandas.core.frame.DataFrame):
@@ -2007,14 +3568,44 @@ class TagParser(object):
         elif TagParser.hasFileExtension(source) or TagParser.isGoogleSheetsFile(source):
             dataFrameTuple = TagParser.loadSheet(source, sheetName, removeRegex=removeRegex, isDefaultSearch=isDefaultSearch)
             if dataFrameTuple != None:
-                if directiveType == "modification":
-                    self.modificationDirectives = {}
-                    self._parseModificationSheet(*dataFrameTuple)
-                    directives = self.modificationDirectives
+                ## Directive sheets rarely change, so the parsed directives, and the compiled plan for modification directives, are cached.
+                cacheKey = None
+                cachedEntry = None
+                if extractionCache is not None:
+                    cacheKey = ExtractionCache.directivesKey(*dataFrameTuple, directiveType, silent)
+                    cachedEntry = extractionCache.load(cacheKey)
+                
+                if cachedEntry is not None:
+                    sys.stdout.write(cachedEntry["stdout"])
+                    sys.stderr.write(cachedEntry["stderr"])
+                    if directiveType == "modification":
+                        self.modificationDirectives = cachedEntry["directives"]
+                        self.modificationPlan = cachedEntry["modificationPlan"]
+                        directives = self.modificationDirectives
+                    else:
+                        self.automationDirectives = cachedEntry["directives"]
+                        directives = copy.deepcopy(self.automationDirectives)
                 else:
-                    self.automationDirectives = []
-                    self._parseAutomationSheet(*dataFrameTuple)
-                    directives = copy.deepcopy(self.automationDirectives)
+                    stdout = _TeeWriter(sys.stdout)
+                    stderr = _TeeWriter(sys.stderr)
+                    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                        if directiveType == "modification":
+                            self.modificationDirectives = {}
+                            self._parseModificationSheet(*dataFrameTuple)
+                            directives = self.modificationDirectives
+                        else:
+                            self.automationDirectives = []
+                            self._parseAutomationSheet(*dataFrameTuple)
+                            directives = copy.deepcopy(self.automationDirectives)
+                    
+                    if cacheKey is not None:
+                        entry = {"stdout" : stdout.copy.getvalue(), "stderr" : stderr.copy.getvalue()}
+                        if directiveType == "modification":
+                            self.modificationPlan = ModificationPlan(self.modificationDirectives)
+                            entry.update({"directives" : self.modificationDirectives, "modificationPlan" : self.modificationPlan})
+                        else:
+                            entry["directives"] = self.automationDirectives
+                        extractionCache.store(cacheKey, entry)
 
         return directives
 
@@ -2208,6 +3799,63 @@ class TagParser(object):
                     # self.changedRecords[recordPath + oldField]["previous_modification_value"] = record[newField]
 
 
+    def _applyRecordModificationDirectives(self, tableKey: str, idKey: str, modifications: dict):
+        """Apply modification directives to a record in self.extraction and note that the record was modified.
+        
+        Args:
+            tableKey: the table the record is in.
+            idKey: the key of the record in the table.
+            modifications: the modifications to apply to the record.
+        """
+        self.modifiedRecordIDs[tableKey].add(idKey)
+        self._applyModificationDirectives(self.extraction[tableKey][idKey], tableKey + "[" + idKey + "]", modifications)
+    
+    def _findExactMatchCandidates(self, tableKey: str, fieldKey: str, modificationDirectives: dict, comparisonType: str) -> list[str]:
+        """Returns the ids of the records in a table that could match the exact modification directives of a comparison type.
+        
+        The first time a table and field are looked up in a modify call, the records are indexed by the values of the field 
+        that any of the exact modification directives for the field could match. Records that have been modified during 
+        the modify call might not match the index anymore, so they are always included.
+        
+        Args:
+            tableKey: table key in modificationDirectives to get to the modifications.
+            fieldKey: field key in modificationDirectives to get to the modifications.
+            modificationDirectives: contains the modifications to apply.
+            comparisonType: the exact comparison type to find the records for.
+            
+        Returns:
+            The ids of the records that have to be checked against the directives, in the order the records are in the table.
+        """
+        table = self.extraction[tableKey]
+        if (tableKey, fieldKey) not in self.exactMatchIndexes:
+            directiveValues = set()
+            for exactComparisonType in ["exact-first", "exact-first-nowarn", "exact-unique", "exact-all"]:
+                directiveValues.update(modificationDirectives[tableKey][fieldKey].get(exactComparisonType, {}))
+            
+            valueIndex = collections.defaultdict(list)
+            for idKey, record in table.items():
+                if fieldKey in record:
+                    fieldValue = record[fieldKey]
+                    if type(fieldValue) == list:
+                        for specificValue in fieldValue:
+                            if specificValue in directiveValues:
+                                valueIndex[specificValue].append(idKey)
+                    elif fieldValue in directiveValues:
+                        valueIndex[fieldValue].append(idKey)
+            self.exactMatchIndexes[(tableKey, fieldKey)] = valueIndex
+        
+        valueIndex = self.exactMatchIndexes[(tableKey, fieldKey)]
+        candidates = set(self.modifiedRecordIDs[tableKey])
+        for fieldValue in modificationDirectives[tableKey][fieldKey][comparisonType]:
+            if fieldValue in valueIndex:
+                candidates.update(valueIndex[fieldValue])
+        
+        if len(candidates) * 8 > len(table):
+            return [idKey for idKey in table if idKey in candidates]
+        if tableKey not in self.recordOrders:
+            self.recordOrders[tableKey] = {idKey : order for order, idKey in enumerate(table)}
+        return sorted(candidates, key=self.recordOrders[tableKey].__getitem__)
+    
     def _applyExactModificationDirectives(self, tableKey: str, fieldKey: str, modificationDirectives: dict):
         """Tests and applies exact modification directives
         
@@ -2218,6 +3866,8 @@ class TagParser(object):
         """
         comparisonTypes = ["exact-first", "exact-first-nowarn", "exact-unique", "exact-all"]
         firstTypes = ["exact-first", "exact-first-nowarn"]
+        numberOfDirectives = sum(len(modificationDirectives[tableKey][fieldKey].get(comparisonType, {})) for comparisonType in comparisonTypes)
+        useIndex = numberOfDirectives * len(self.extraction.get(tableKey, {})) > TagParser.exactMatchIndexThreshold
         
         for comparisonType in comparisonTypes:
             if comparisonType == "exact-unique":
@@ -2233,7 +3883,11 @@ class TagParser(object):
     
             if comparisonType in modificationDirectives[tableKey][fieldKey]:
                 table = self.extraction[tableKey]
-                for idKey, record in table.items():
+                if useIndex:
+                    records = ((idKey, table[idKey]) for idKey in self._findExactMatchCandidates(tableKey, fieldKey, modificationDirectives, comparisonType))
+                else:
+                    records = table.items()
+                for idKey, record in records:
                     if fieldKey in record:
                         fieldValue = record[fieldKey]
                         if type(fieldValue) == list:
@@ -2241,7 +3895,7 @@ class TagParser(object):
                                 if specificValue in modificationDirectives[tableKey][fieldKey][comparisonType]:
                                     if isFirst:
                                         if specificValue not in matchedFieldValues:
-                                            self._applyModificationDirectives(record, tableKey + "[" + idKey + "]", modificationDirectives[tableKey][fieldKey][comparisonType][specificValue])
+                                            self._applyRecordModificationDirectives(tableKey, idKey, modificationDirectives[tableKey][fieldKey][comparisonType][specificValue])
                                             matchedFieldValues[specificValue] = {"idKey":idKey, "numberOfMatches":1}
                                             self.usedModifications.add((tableKey, fieldKey, comparisonType, specificValue))
                                         elif comparisonType == "exact-first" and not silent:
@@ -2254,13 +3908,13 @@ class TagParser(object):
                                             matchedFieldValues[specificValue]["numberOfMatches"] += 1
                                             
                                     else:
-                                        self._applyModificationDirectives(record, tableKey + "[" + idKey + "]", modificationDirectives[tableKey][fieldKey][comparisonType][specificValue])
+                                        self._applyRecordModificationDirectives(tableKey, idKey, modificationDirectives[tableKey][fieldKey][comparisonType][specificValue])
                                         self.usedModifications.add((tableKey, fieldKey, comparisonType, specificValue))
                         
                         elif fieldValue in modificationDirectives[tableKey][fieldKey][comparisonType]:
                             if isFirst:
                                 if fieldValue not in matchedFieldValues:
-                                    self._applyModificationDirectives(record, tableKey + "[" + idKey + "]", modificationDirectives[tableKey][fieldKey][comparisonType][fieldValue])
+                                    self._applyRecordModificationDirectives(tableKey, idKey, modificationDirectives[tableKey][fieldKey][comparisonType][fieldValue])
                                     matchedFieldValues[fieldValue] = {"idKey":idKey, "numberOfMatches":1}
                                     self.usedModifications.add((tableKey, fieldKey, comparisonType, fieldValue))
                                 elif comparisonType == "exact-first" and not silent:
@@ -2273,13 +3927,13 @@ class TagParser(object):
                                     matchedFieldValues[fieldValue]["numberOfMatches"] += 1
                                     
                             else:
-                                self._applyModificationDirectives(record, tableKey + "[" + idKey + "]", modificationDirectives[tableKey][fieldKey][comparisonType][fieldValue])
+                                self._applyRecordModificationDirectives(tableKey, idKey, modificationDirectives[tableKey][fieldKey][comparisonType][fieldValue])
                                 self.usedModifications.add((tableKey, fieldKey, comparisonType, fieldValue))
 
                 if isUnique:
                     for fieldValue, attributes in matchedFieldValues.items():
                         if attributes["numberOfMatches"] == 1:
-                            self._applyModificationDirectives(table[attributes["idKey"]], tableKey + "[" + attributes["idKey"] + "]", modificationDirectives[tableKey][fieldKey][comparisonType][fieldValue])
+                            self._applyRecordModificationDirectives(tableKey, attributes["idKey"], modificationDirectives[tableKey][fieldKey][comparisonType][fieldValue])
                             self.usedModifications.add((tableKey, fieldKey, comparisonType, fieldValue))
 
 
@@ -2296,6 +3950,8 @@ class TagParser(object):
         """
         comparisonTypes = ["regex-first", "regex-first-nowarn", "regex-unique", "regex-all"]
         firstTypes = ["regex-first", "regex-first-nowarn"]
+        matcher = RegexMatcher({ regexID : regexObjects[regexID] for comparisonType in comparisonTypes 
+                                 for regexID in modificationDirectives[tableKey][fieldKey].get(comparisonType, {}) })
         
         for comparisonType in comparisonTypes:
             if comparisonType == "regex-unique":
@@ -2311,16 +3967,33 @@ class TagParser(object):
                     
             if comparisonType in modificationDirectives[tableKey][fieldKey]:
                 table = self.extraction[tableKey]
+                regexEntries = modificationDirectives[tableKey][fieldKey][comparisonType]
+                regexOrder = { regexID : order for order, regexID in enumerate(regexEntries) }
+                ## Appending, prepending, or substituting into this field changes the values of a list field in place, 
+                ## so after such a directive is applied to a record a regex that did not match before might match.
+                checkAllRegexes = any(fieldKey in regexEntry.get(modificationType, {}) for regexEntry in regexEntries.values() for modificationType in ["append", "prepend", "regex"])
                 for idKey, record in table.items():
                     if fieldKey in record:
                         fieldValue = record[fieldKey]
-                        for regexID, regexEntry in modificationDirectives[tableKey][fieldKey][comparisonType].items():
+                        if type(fieldValue) == list:
+                            matchedByRecord = frozenset().union(*[matcher(specificValue) for specificValue in fieldValue])
+                        else:
+                            matchedByRecord = matcher(fieldValue)
+                        if not matchedByRecord:
+                            continue
+                        
+                        if checkAllRegexes:
+                            regexIDs = list(regexEntries)
+                        else:
+                            regexIDs = sorted(matchedByRecord.intersection(regexOrder), key=regexOrder.__getitem__)
+                        for regexID in regexIDs:
+                            regexEntry = regexEntries[regexID]
                             if type(fieldValue) == list:
                                 for specificValue in fieldValue:
-                                    if re.search(regexObjects[regexID], specificValue):
+                                    if regexID in matcher(specificValue):
                                         if isFirst:
                                             if regexID not in matchedRegexIDs:
-                                                self._applyModificationDirectives(record, tableKey + "[" + idKey + "]", regexEntry)
+                                                self._applyRecordModificationDirectives(tableKey, idKey, regexEntry)
                                                 matchedRegexIDs[regexID] = {"idKey":idKey, "numberOfMatches":1}
                                                 self.usedModifications.add((tableKey, fieldKey, comparisonType, regexID))
                                             elif comparisonType == "regex-first" and not silent:
@@ -2333,13 +4006,13 @@ class TagParser(object):
                                                 matchedRegexIDs[regexID]["numberOfMatches"] += 1
                                                 
                                         else:
-                                            self._applyModificationDirectives(record, tableKey + "[" + idKey + "]", regexEntry)
+                                            self._applyRecordModificationDirectives(tableKey, idKey, regexEntry)
                                             self.usedModifications.add((tableKey, fieldKey, comparisonType, regexID))
                                                                     
-                            elif re.search(regexObjects[regexID], fieldValue):
+                            elif regexID in matcher(fieldValue):
                                 if isFirst:
                                     if regexID not in matchedRegexIDs:
-                                        self._applyModificationDirectives(record, tableKey + "[" + idKey + "]", regexEntry)
+                                        self._applyRecordModificationDirectives(tableKey, idKey, regexEntry)
                                         matchedRegexIDs[regexID] = {"idKey":idKey, "numberOfMatches":1}
                                         self.usedModifications.add((tableKey, fieldKey, comparisonType, regexID))
                                     elif comparisonType == "regex-first" and not silent:
@@ -2352,13 +4025,13 @@ class TagParser(object):
                                         matchedRegexIDs[regexID]["numberOfMatches"] += 1
                                         
                                 else:
-                                    self._applyModificationDirectives(record, tableKey + "[" + idKey + "]", regexEntry)
+                                    self._applyRecordModificationDirectives(tableKey, idKey, regexEntry)
                                     self.usedModifications.add((tableKey, fieldKey, comparisonType, regexID))
                     
                 if isUnique:
                     for regexID, attributes in matchedRegexIDs.items():
                         if attributes["numberOfMatches"] == 1:
-                            self._applyModificationDirectives(table[attributes["idKey"]], tableKey + "[" + attributes["idKey"] + "]", modificationDirectives[tableKey][fieldKey][comparisonType][regexID])
+                            self._applyRecordModificationDirectives(tableKey, attributes["idKey"], modificationDirectives[tableKey][fieldKey][comparisonType][regexID])
                             self.usedModifications.add((tableKey, fieldKey, comparisonType, regexID))
 
 
@@ -2385,112 +4058,97 @@ class TagParser(object):
                 isFirst=False
         
             if comparisonType in modificationDirectives[tableKey][fieldKey]:
-                levenshteinComparisons = collections.defaultdict(dict)
-                levenshteinComparisonValues = collections.defaultdict(dict)
-                for levID, levEntry in modificationDirectives[tableKey][fieldKey][comparisonType].items():
-                    for idKey, record in self.extraction[tableKey].items():
-                        if fieldKey in record:
-                            ## If the comparison field is a list field then calculate the distance between all values in the list and use the smallest for comparison.
-                            if type(record[fieldKey]) == list:
-                                fieldValues = record[fieldKey]
-                                levenshteinDistances = [jellyfish.levenshtein_distance(levID, specificValue) for specificValue in fieldValues]
-                                levenshteinComparisons[levID][idKey] = min(levenshteinDistances)
-                                levenshteinComparisonValues[levID][idKey] = fieldValues[min(range(len(levenshteinDistances)), key=levenshteinDistances.__getitem__)]
-                            else:
-                                levenshteinComparisons[levID][idKey] = jellyfish.levenshtein_distance(levID, record[fieldKey])
-                                levenshteinComparisonValues[levID][idKey] = record[fieldKey]
+                ## The distance from a directive to a record is the smallest distance to any of the record's values, 
+                ## so the nearest records to a directive are the records that have one of the nearest distinct values.
+                recordsForValue = {}
+                valuesForRecord = {}
+                for idKey, record in self.extraction[tableKey].items():
+                    if fieldKey in record and (fieldValues := record[fieldKey] if type(record[fieldKey]) == list else [record[fieldKey]]):
+                        valuesForRecord[idKey] = tuple(dict.fromkeys(fieldValues))
+                        for fieldValue in valuesForRecord[idKey]:
+                            recordsForValue.setdefault(fieldValue, []).append(idKey)
+                if not valuesForRecord:
+                    continue
                 
-                idKeySet = set()
-                for levID in levenshteinComparisons.keys():
-                    idKeySet |= set(levenshteinComparisons[levID].keys())
-    
-                uniqueForIdKey = collections.defaultdict(None)
-                for idKey in idKeySet:
-                    usableLevIDs = [levID for levID in levenshteinComparisons.keys() if idKey in levenshteinComparisons[levID]]
-                    minLevID = min(levenshteinComparisons.keys(), key=(lambda k: levenshteinComparisons[k][idKey]))
-                    minLevValue = levenshteinComparisons[minLevID][idKey]
-                    ## Assign only if there is 1 match to the minimum levenshtein distance.
-                    if sum(levenshteinComparisons[levKey][idKey] == minLevValue for levKey in usableLevIDs) == 1:
-                        uniqueForIdKey[idKey] = minLevID
-                        
+                levIDs = list(modificationDirectives[tableKey][fieldKey][comparisonType])
+                values = list(recordsForValue)
+                if jobs > 1 and len(levIDs) >= 2 * jobs and len(levIDs) * len(values) >= TagParser.levenshteinParallelThreshold:
+                    chunkSize = -(-len(levIDs) // jobs)
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                        nearestValues = list(itertools.chain.from_iterable(executor.map(_findNearestValues, itertools.repeat(values), 
+                                                                                        [levIDs[index:index+chunkSize] for index in range(0, len(levIDs), chunkSize)])))
+                else:
+                    nearestValues = _findNearestValues(values, levIDs)
                 
-                uniqueForLevenshteinID = collections.defaultdict(None)
-                for levID in levenshteinComparisons.keys():
-                    minIDKey = min(levenshteinComparisons[levID].keys(), key=(lambda k: levenshteinComparisons[levID][k]))
-                    minIDValue = levenshteinComparisons[levID][minIDKey]
+                recordOrder = { idKey : order for order, idKey in enumerate(valuesForRecord) }
+                uniqueForLevenshteinID = {}
+                for levID, (minIDValue, minValues) in zip(levIDs, nearestValues):
+                    idKeysThatHaveMinValue = sorted({ idKey for fieldValue in minValues for idKey in recordsForValue[fieldValue] }, key=recordOrder.__getitem__)
                     if isFirst:
-                        idKeysThatHaveMinValue = [idKey for idKey in levenshteinComparisons[levID] if levenshteinComparisons[levID][idKey] == minIDValue]
                         uniqueForLevenshteinID[levID] = idKeysThatHaveMinValue[0]
                         if comparisonType == "levenshtein-first" and len(idKeysThatHaveMinValue) > 1 and not silent:
                             print("Warning: modification directive #" + tableKey + "." + fieldKey + "." + comparisonType + "." + levID + " matches more than one record. Only the first record will be changed. Try #match=all if all matching records should be changed, or #match=first-nowarn to silence this message.", file=sys.stderr)
                             
                     elif isUnique:
-                        if sum(levenshteinComparisons[levID][idKey] == minIDValue for idKey in levenshteinComparisons[levID]) == 1:
-                            uniqueForLevenshteinID[levID] = minIDKey
+                        if len(idKeysThatHaveMinValue) == 1:
+                            uniqueForLevenshteinID[levID] = idKeysThatHaveMinValue[0]
                             
                     else:
-                        idKeysThatHaveMinValue = [idKey for idKey in levenshteinComparisons[levID] if levenshteinComparisons[levID][idKey] == minIDValue]
                         uniqueForLevenshteinID[levID] = idKeysThatHaveMinValue
+                
+                ## A record is only changed by first and unique directives if it is nearer to that directive than to any other.
+                if isFirst or isUnique:
+                    levIDIndex = LevenshteinIndex(levIDs)
+                    uniqueForIdKey = {}
+                    for idKey in set(uniqueForLevenshteinID.values()):
+                        nearestLevIDs = [levIDIndex.nearest(fieldValue) for fieldValue in valuesForRecord[idKey]]
+                        minLevValue = min(distance for distance, nearestIDs in nearestLevIDs)
+                        usableLevIDs = { levID for distance, nearestIDs in nearestLevIDs if distance == minLevValue for levID in nearestIDs }
+                        if len(usableLevIDs) == 1:
+                            uniqueForIdKey[idKey] = usableLevIDs.pop()
 
                 
                 if isFirst or isUnique:
                     for levID, levEntry in modificationDirectives[tableKey][fieldKey][comparisonType].items():
                         if levID in uniqueForLevenshteinID and uniqueForIdKey[uniqueForLevenshteinID[levID]] == levID:
-                            self._applyModificationDirectives(self.extraction[tableKey][uniqueForLevenshteinID[levID]], tableKey + "[" + uniqueForLevenshteinID[levID] + "]", levEntry)
+                            self._applyRecordModificationDirectives(tableKey, uniqueForLevenshteinID[levID], levEntry)
                             self.usedModifications.add((tableKey, fieldKey, comparisonType, levID))
                 else:
                     for levID, levEntry in modificationDirectives[tableKey][fieldKey][comparisonType].items():
                         if levID in uniqueForLevenshteinID:
                             for idKey in uniqueForLevenshteinID[levID]:
-                                self._applyModificationDirectives(self.extraction[tableKey][idKey], tableKey + "[" + idKey + "]", levEntry)
+                                self._applyRecordModificationDirectives(tableKey, idKey, levEntry)
                                 self.usedModifications.add((tableKey, fieldKey, comparisonType, levID))
                 
                 
 
-    def modify(self, modificationDirectives: dict):
+    def modify(self, modificationDirectives: dict|ModificationPlan|None):
         """Applies modificationDirectives to the extracted metadata.
 
         Args:
-            modificationDirectives: contains the modifications to apply.
+            modificationDirectives: contains the modifications to apply, either as read by readDirectives or already compiled into a ModificationPlan.
         """
-        self.modificationDirectives = modificationDirectives
+        self.idIndex = None
+        if type(modificationDirectives) == ModificationPlan:
+            self.modificationDirectives = modificationDirectives.modificationDirectives
+        else:
+            self.modificationDirectives = modificationDirectives
         if modificationDirectives != None:
-            modificationDirectives = copy.deepcopy(modificationDirectives) # Must make deepcopy since regex objects being embedded.
+            if type(modificationDirectives) != ModificationPlan:
+                modificationDirectives = ModificationPlan(modificationDirectives)
+            regexObjects = modificationDirectives.regexObjects
+            modificationDirectives = modificationDirectives.compiledDirectives
 
             if getattr(self,"unusedModifications", None) is None:
                 self.unusedModifications = set()
 
             if getattr(self,"usedModifications", None) is None:
                 self.usedModifications = set()
-                
-            # Compile regex objects for comparison.
-            regexObjects = {}
-            for tableDict in modificationDirectives.values():
-                for fieldDict in tableDict.values():
-                    for regex_type in ["regex-first", "regex-first-nowarn", "regex-unique", "regex-all"]:
-                        if regex_type in fieldDict:
-                            regexObjects.update({ regexString : re.compile(re.match(TagParser.reDetector, regexString)[1]) for regexString in  fieldDict[regex_type].keys()})
-            
-            # Compile regex objects for regex substitution directives.
-            for tableDict in modificationDirectives.values():
-                for fieldDict in tableDict.values():
-                    for comparisonTypeDict in fieldDict.values():
-                        for fieldValueDict in comparisonTypeDict.values():
-                            if "regex" in fieldValueDict:
-                                fieldValueDict["regex"] = { newField : [ re.match(TagParser.reDetector, regexPair[0])[1], re.match(TagParser.reDetector, regexPair[1])[1] ]
-                                                            for newField,regexPair in fieldValueDict["regex"].items() }
-
-            # Create Evaluator objects for assign directives with "eval(...)" values.
-            for tableDict in modificationDirectives.values():
-                for fieldDict in tableDict.values():
-                    for comparisonTypeDict in fieldDict.values():
-                        for fieldValueDict in comparisonTypeDict.values():
-                            if "assign" in fieldValueDict:
-                                for newField in fieldValueDict["assign"].keys():
-                                    if isinstance(fieldValueDict["assign"][newField], str) and (reMatch := Evaluator.isEvalString(fieldValueDict["assign"][newField])):
-                                        fieldValueDict["assign"][newField] = Evaluator(reMatch.group(1))
 
             self.changedRecords = {}
+            self.modifiedRecordIDs = collections.defaultdict(set)
+            self.exactMatchIndexes = {}
+            self.recordOrders = {}
             for tableKey in modificationDirectives.keys():
                 if tableKey in self.extraction:
                     for fieldKey in modificationDirectives[tableKey].keys():
@@ -2526,15 +4184,22 @@ class TagParser(object):
             
             self.extraction = translated
 
-            # Identify used and unused modification directives.
-            for tableKey in modificationDirectives.keys():
-                for fieldKey in modificationDirectives[tableKey].keys():
-                    for comparisonType in modificationDirectives[tableKey][fieldKey]:
-                        for modificationID in modificationDirectives[tableKey][fieldKey][comparisonType]:
-                            if (tableKey, fieldKey, comparisonType, modificationID) not in self.usedModifications:
-                                self.unusedModifications.add((tableKey, fieldKey, comparisonType, modificationID))
-                            elif (tableKey, fieldKey, comparisonType, modificationID) in self.unusedModifications:
-                                self.unusedModifications.remove((tableKey, fieldKey, comparisonType, modificationID))
+            self._updateUnusedModifications(modificationDirectives)
+    
+    def _updateUnusedModifications(self, modificationDirectives: dict):
+        """Identify used and unused modification directives.
+        
+        Args:
+            modificationDirectives: the modifications that were just applied.
+        """
+        for tableKey in modificationDirectives.keys():
+            for fieldKey in modificationDirectives[tableKey].keys():
+                for comparisonType in modificationDirectives[tableKey][fieldKey]:
+                    for modificationID in modificationDirectives[tableKey][fieldKey][comparisonType]:
+                        if (tableKey, fieldKey, comparisonType, modificationID) not in self.usedModifications:
+                            self.unusedModifications.add((tableKey, fieldKey, comparisonType, modificationID))
+                        elif (tableKey, fieldKey, comparisonType, modificationID) in self.unusedModifications:
+                            self.unusedModifications.remove((tableKey, fieldKey, comparisonType, modificationID))
 
     def merge(self, newMetadata: dict):
         """Merges new metadata with current metadata.
@@ -2542,6 +4207,7 @@ class TagParser(object):
         Args:
             newMetadata: dict to merge with self.extraction dict.
         """
+        self.idIndex = None
         for tableKey, table in newMetadata.items():
             if tableKey not in self.extraction:
                 self.extraction[tableKey] = table
@@ -2552,6 +4218,27 @@ class TagParser(object):
                     else:
                         self.extraction[tableKey][idKey].update(record)
 
+    ## Matches every string float() accepts, and a few it doesn't, so strings that can't be numbers are rejected without raising an exception.
+    floatDetector = re.compile(r"\s*[+-]?(?:(?:(?:\d(?:_?\d)*)?\.\d(?:_?\d)*|\d(?:_?\d)*\.?)(?:[eE][+-]?\d(?:_?\d)*)?|[iI][nN][fF](?:[iI][nN][iI][tT][yY])?|[nN][aA][nN])\s*")
+
+    @staticmethod
+    def _toFloat(value: str|int|float) -> float|None:
+        """Returns float(value), or None if value can't be converted.
+
+        Args:
+            value: value to convert.
+        """
+        if isinstance(value, str):
+            if not TagParser.floatDetector.fullmatch(value):
+                return None
+        elif not isinstance(value, (int, float)):
+            return None
+
+        try:
+            return float(value)
+        except (ValueError, OverflowError):
+            return None
+
     @staticmethod
     def isComparable(value1: str, value2: str) -> bool:
         """Compares the two values first as strings and then as floats if convertable.
@@ -2563,78 +4250,143 @@ class TagParser(object):
         if value1 == value2:
             return True
 
-        try:
-            value1 = float(value1)
-            value2 = float(value2)
-        except ValueError:
+        value1 = TagParser._toFloat(value1)
+        if value1 is None:
+            return False
+        value2 = TagParser._toFloat(value2)
+        if value2 is None:
             return False
 
         return value1 == value2 or abs(value1 - value2) / max(abs(value1),abs(value2)) < 0.00000001
 
-    def compare(self, otherMetadata: dict, groupSize: int =5, file: TextIO|None =sys.stdout) -> bool:
-        """Compare current metadata to other metadata.
-
+    @staticmethod
+    def recordDigest(record: dict) -> bytes|None:
+        """Returns a digest of a record that is the same for records compare would find no different fields in.
+        
+        Numbers are normalized to their float value, so "1" and "1.0" give the same digest. Values that are equal 
+        only within the float tolerance of isComparable give different digests, so records with different digests 
+        still have to be compared field by field.
+        
         Args:
-            otherMetadata: dict to compare with self.extraction.
-            groupSize: number of record ids to print on a single line before printing more on a new line.
-            file: the IO to print messages to, if None then just return True or False instead of printing messages.
+            record: the record to digest.
             
         Returns:
-            True if otherMetadata and self.extraction are different, False otherwise.
+            The digest, or None if the record has a value that isn't a string, a number, or a list of strings, or that isn't comparable to itself, like a float nan.
         """
-        different = False
+        normalizedFields = []
+        for field, value in record.items():
+            if isinstance(value, str):
+                number = TagParser._toFloat(value)
+                normalizedValue = ("s", value) if number is None or number != number else ("n", repr(number))
+            elif isinstance(value, (int, float)):
+                number = float(value)
+                if number != number:
+                    return None
+                normalizedValue = ("n", repr(number))
+            elif isinstance(value, list) and all(isinstance(element, str) for element in value):
+                normalizedValue = ("l", tuple(value))
+            else:
+                return None
+            normalizedFields.append((field, normalizedValue))
+        normalizedFields.sort()
+        return hashlib.blake2b(repr(normalizedFields).encode("utf-8", "surrogatepass"), digest_size=16).digest()
 
+    def differences(self, otherMetadata: dict) -> Iterator[dict]:
+        """Yields the differences between other metadata and the current metadata.
+        
+        Tables and records that are equal are skipped without looking at their fields, as are records whose 
+        digests from recordDigest are equal, so only records that really differ are compared field by field.
+        
+        Args:
+            otherMetadata: dict to compare with self.extraction.
+            
+        Yields:
+            A dict for each difference, in the order compare prints them:
+            {"type" : "missing_tables", "tables" : [...]} for tables in otherMetadata and not in self.extraction,
+            {"type" : "extra_tables", "tables" : [...]} for tables in self.extraction and not in otherMetadata,
+            {"type" : "missing_records", "table" : tableKey, "ids" : [...]} for records in otherMetadata and not in self.extraction,
+            {"type" : "extra_records", "table" : tableKey, "ids" : [...]} for records in self.extraction and not in otherMetadata,
+            {"type" : "different_fields", "table" : tableKey, "id" : idKey, "fields" : [...]} for records with fields that are different or in only one of them.
+        """
         missingTables = [ tableKey for tableKey in otherMetadata.keys() if tableKey not in self.extraction ]
         if missingTables:
-            different = True
-            if file is not None:
-                print("Missing Tables:"," ".join(missingTables), file=file)
-            else:
-                return True
+            yield {"type" : "missing_tables", "tables" : missingTables}
 
         extraTables = [ tableKey for tableKey in self.extraction.keys() if tableKey not in otherMetadata ]
         if extraTables:
-            different = True
-            if file is not None:
-                print("Extra Tables:"," ".join(extraTables), file=file)
-            else:
-                return True
+            yield {"type" : "extra_tables", "tables" : extraTables}
 
         for tableKey, table in otherMetadata.items():
-            if tableKey in self.extraction:
-                missingIDs = [ idKey for idKey in table.keys() if idKey not in self.extraction[tableKey] ]
-                if missingIDs:
-                    different = True
-                    if file is not None:
-                        print("Table", tableKey, "with missing records:", file=file)
-                        while missingIDs:
-                            group = missingIDs[0:groupSize]
-                            missingIDs = missingIDs[groupSize:]
-                            print("  ", " ".join(group), file=file)
-                    else:
-                        return True
-                extraIDs = [ idKey for idKey in self.extraction[tableKey].keys() if idKey not in otherMetadata[tableKey] ]
-                if extraIDs:
-                    different = True
-                    if file is not None:
-                        print("Table", tableKey, "with extra records:", file=file)
-                        while extraIDs:
-                            group = extraIDs[0:groupSize]
-                            extraIDs = extraIDs[groupSize:]
-                            print("  ", " ".join(group), file=file)
-                    else:
-                        return True
+            if tableKey not in self.extraction:
+                continue
+            currentTable = self.extraction[tableKey]
+            if table == currentTable:
+                continue
+            
+            missingIDs = [ idKey for idKey in table.keys() if idKey not in currentTable ]
+            if missingIDs:
+                yield {"type" : "missing_records", "table" : tableKey, "ids" : missingIDs}
+            extraIDs = [ idKey for idKey in currentTable.keys() if idKey not in table ]
+            if extraIDs:
+                yield {"type" : "extra_records", "table" : tableKey, "ids" : extraIDs}
+
+            for idKey, record in table.items():
+                if idKey not in currentTable:
+                    continue
+                currentRecord = currentTable[idKey]
+                if record == currentRecord:
+                    continue
+                digest = TagParser.recordDigest(record)
+                if digest is not None and digest == TagParser.recordDigest(currentRecord):
+                    continue
+                
+                differentFields = [ field for field, value in record.items() if field not in currentRecord or not TagParser.isComparable(value, currentRecord[field]) ]
+                differentFields.extend([ field for field in currentRecord if field not in record ])
+                if differentFields:
+                    yield {"type" : "different_fields", "table" : tableKey, "id" : idKey, "fields" : differentFields}
 
-                for idKey, record in table.items():
-                    if idKey in self.extraction[tableKey]:
-                        differentFields = [ field for field, value in record.items() if field not in self.extraction[tableKey][idKey] or not TagParser.isComparable(value, self.extraction[tableKey][idKey][field]) ]
-                        differentFields.extend([ field for field in self.extraction[tableKey][idKey] if field not in record ])
-                        if differentFields:
-                            different = True
-                            if file is not None:
-                                print("Table", tableKey, "id", idKey, "with different fields:", ", ".join(differentFields), file=file)
-                            else:
-                                return True
+    def compare(self, otherMetadata: dict, groupSize: int =5, file: TextIO|None =sys.stdout, diffFile: TextIO|None =None, diffFormat: str ="json") -> bool:
+        """Compare current metadata to other metadata.
+
+        Args:
+            otherMetadata: dict to compare with self.extraction.
+            groupSize: number of record ids to print on a single line before printing more on a new line.
+            file: the IO to print messages to, if None then just return True or False instead of printing messages.
+            diffFile: the IO to write the differences to in machine readable form, if None they are not written.
+            diffFormat: "json" to write the differences to diffFile as a JSON list, "ndjson" to write them one JSON object per line.
+            
+        Returns:
+            True if otherMetadata and self.extraction are different, False otherwise.
+        """
+        if file is None and diffFile is None:
+            return next(self.differences(otherMetadata), None) is not None
+        
+        different = False
+        if diffFile is not None and diffFormat == "json":
+            diffFile.write("[")
+        for difference in self.differences(otherMetadata):
+            if diffFile is not None:
+                if diffFormat == "json":
+                    diffFile.write(("," if different else "") + "\n  " + json.dumps(difference))
+                else:
+                    diffFile.write(json.dumps(difference) + "\n")
+            different = True
+            
+            if file is None:
+                continue
+            if difference["type"] == "missing_tables":
+                print("Missing Tables:"," ".join(difference["tables"]), file=file)
+            elif difference["type"] == "extra_tables":
+                print("Extra Tables:"," ".join(difference["tables"]), file=file)
+            elif difference["type"] in ("missing_records", "extra_records"):
+                print("Table", difference["table"], "with", difference["type"].replace("_", " ") + ":", file=file)
+                ids = difference["ids"]
+                for groupStart in range(0, len(ids), groupSize):
+                    print("  ", " ".join(ids[groupStart:groupStart+groupSize]), file=file)
+            else:
+                print("Table", difference["table"], "id", difference["id"], "with different fields:", ", ".join(difference["fields"]), file=file)
+        if diffFile is not None and diffFormat == "json":
+            diffFile.write("\n]\n" if different else "]\n")
 
         return different
 
@@ -2644,6 +4396,7 @@ class TagParser(object):
         Args:
             sections: list of sections that are lists of strings. The strings should be regular expressions.
         """
+        self.idIndex = None
         compiled_sections = [ [ re.compile(re.match(TagParser.reDetector, keyElement)[1]) if re.match(TagParser.reDetector, keyElement) else re.compile("^" + re.escape(keyElement) + "$") for keyElement in section ] for section in sections ]
 
         for section in compiled_sections:
@@ -2658,6 +4411,25 @@ class TagParser(object):
                 if section_level_tuple[0] != None:
                     del section_level_tuple[1][section_level_tuple[0]]
 
+    def _idIndex(self) -> dict:
+        """Returns a dictionary of every record id in self.extraction to (tableKey, record).
+        
+        The index is built once and reused until merge, modify, deleteMetadata, or parseSheet change the records, 
+        or self.extraction is replaced. An id in more than one table is indexed to the first of those tables.
+        
+        Returns:
+            The index of record ids.
+        """
+        if self.idIndex is None or self.idIndexExtraction is not self.extraction:
+            idIndex = {}
+            for tableKey, table in self.extraction.items():
+                for idKey, record in table.items():
+                    if idKey not in idIndex:
+                        idIndex[idKey] = (tableKey, record)
+            self.idIndex = idIndex
+            self.idIndexExtraction = self.extraction
+        return self.idIndex
+
     def findParent(self, parentID: str) -> tuple[str,dict]|None:
         """Returns parent record for given parentID.
 
@@ -2667,16 +4439,15 @@ class TagParser(object):
         Returns:
             None if the parentID was not found, (tableKey,parentRecord) if it was.
         """
-        for tableKey, table in self.extraction.items():
-            if parentID in table:
-                return (tableKey,table[parentID])
-
-        return None
+        return self._idIndex().get(parentID)
 
     @staticmethod
     def _generateLineage(parentID: str, parent2children: dict) -> dict|None:
         """Generates and returns a lineage structure based on the given parentID.
         
+        The lineage is built with a stack instead of recursion so long parent-child chains don't hit the recursion limit. 
+        A child that is also one of its own ancestors is not expanded again.
+        
         Args:
             parentID: key to look for in parent2children.
             parent2children: dictionary of parentID to list of children.
@@ -2684,10 +4455,25 @@ class TagParser(object):
         Returns:
             None if parentID is not in parent2children, a dictionary of children for the parentID if it is.
         """
-        if parentID in parent2children:
-            return { child : TagParser._generateLineage(child,parent2children) for child in parent2children[parentID] }
-        else:
+        if parentID not in parent2children:
             return None
+        
+        lineage = {}
+        ancestors = {parentID}
+        stack = [(parentID, lineage, iter(parent2children[parentID]))]
+        while stack:
+            currentID, children, childIDs = stack[-1]
+            for childID in childIDs:
+                if childID in parent2children and childID not in ancestors:
+                    children[childID] = {}
+                    ancestors.add(childID)
+                    stack.append((childID, children[childID], iter(parent2children[childID])))
+                    break
+                children[childID] = None
+            else:
+                stack.pop()
+                ancestors.discard(currentID)
+        return lineage
 
     def generateLineages(self) -> dict:
         """Generates and returns parent-child record lineages.
@@ -2695,9 +4481,10 @@ class TagParser(object):
         Returns:
             lineages by tableKey.
         """
+        idIndex = self._idIndex()
         entities_with_parentIDs = []
         for tableKey, table in self.extraction.items():
-            entities_with_parentIDs.extend((entity, tableKey, self.findParent(entity["parent_id"])) for entity in table.values() if "parent_id" in entity)
+            entities_with_parentIDs.extend((entity, tableKey, idIndex.get(entity["parent_id"])) for entity in table.values() if "parent_id" in entity)
 
         parent2children = collections.defaultdict(list)
         terminalParentsByTable = collections.defaultdict(list)
@@ -2708,34 +4495,67 @@ class TagParser(object):
             elif "parent_id" not in entity_tuple[2][1]:
                 terminalParentsByTable[entity_tuple[2][0]].append(entity_tuple[0]["parent_id"])
 
+        ## A terminal parent is listed once for each of its children, but its lineage only needs to be generated once.
         lineages = collections.defaultdict(list)
         for tableKey in  terminalParentsByTable:
-            lineages[tableKey] = { parentID : TagParser._generateLineage(parentID,parent2children) for parentID in terminalParentsByTable[tableKey] }
+            lineages[tableKey] = { parentID : TagParser._generateLineage(parentID,parent2children) for parentID in dict.fromkeys(terminalParentsByTable[tableKey]) }
 
         return lineages
 
     @staticmethod
-    def printLineages(lineages: collections.defaultdict, indentation: int, groupSize: int =5, file : TextIO =sys.stdout):
-        """Prints the given lineages.
+    def _lineageLines(lineages: dict, indentation: int, groupSize: int) -> Iterator[str]:
+        """Yields the lines printLineages prints, walking the lineages with a stack instead of recursion.
         
         Args:
             lineages: dictionary where the keys are table names and values are a dictionary of parentID and children.
             indentation: number of spaces of indentation to print.
             groupSize: number of childIDs to print per line.
+            
+        Yields:
+            Each line, ending in a newline.
         """
-        for id in sorted(lineages.keys()):
-            if lineages[id]:
-                print(" "*indentation,id,":", file=file)
-                terminal_children = sorted(childID for childID, children in lineages[id].items() if children == None)
-                while terminal_children:
-                    children_group = terminal_children[0:groupSize]
-                    terminal_children = terminal_children[groupSize:]
-                    print(" "*(indentation+2), ", ".join(children_group),file=file)
-                non_terminal_children = {childID : children for childID, children in lineages[id].items() if children }
-                TagParser.printLineages(non_terminal_children,indentation+2)
-            ## I don't think this can be executed from the CLI, I can get it to print if the table in lineages is an empty dict and that's it.
+        stack = [(indentation, lineages, iter(sorted(lineages.keys())))]
+        while stack:
+            indentation, lineages, ids = stack[-1]
+            for id in ids:
+                if lineages[id]:
+                    yield " "*indentation + " " + str(id) + " :\n"
+                    terminal_children = sorted(childID for childID, children in lineages[id].items() if children == None)
+                    for groupStart in range(0, len(terminal_children), groupSize):
+                        yield " "*(indentation+2) + " " + ", ".join(terminal_children[groupStart:groupStart+groupSize]) + "\n"
+                    non_terminal_children = {childID : children for childID, children in lineages[id].items() if children }
+                    stack.append((indentation+2, non_terminal_children, iter(sorted(non_terminal_children.keys()))))
+                    break
+                ## I don't think this can be executed from the CLI, I can get it to print if the table in lineages is an empty dict and that's it.
+                else:
+                    yield " "*indentation + " " + str(id) + "\n"
             else:
-                print(" "*indentation,id,file=file)
+                stack.pop()
+
+    @staticmethod
+    def printLineages(lineages: collections.defaultdict, indentation: int, groupSize: int =5, file : TextIO =sys.stdout, bufferSize: int =1 << 16):
+        """Prints the given lineages.
+        
+        The lines are collected and written to file in chunks of about bufferSize characters rather than printed one at a time.
+        
+        Args:
+            lineages: dictionary where the keys are table names and values are a dictionary of parentID and children.
+            indentation: number of spaces of indentation to print.
+            groupSize: number of childIDs to print per line.
+            file: the file to print to.
+            bufferSize: the number of characters to collect before writing them to file.
+        """
+        buffer = []
+        bufferedSize = 0
+        for line in TagParser._lineageLines(lineages, indentation, groupSize):
+            buffer.append(line)
+            bufferedSize += len(line)
+            if bufferedSize >= bufferSize:
+                file.write("".join(buffer))
+                buffer = []
+                bufferedSize = 0
+        if buffer:
+            file.write("".join(buffer))
 
 
 
@@ -1,37 +1,611 @@
 # -*- coding: utf-8 -*-
+"""
+Pure Python implementation of the automation (tagging) engine.
+
+This module is used by TagParser.tagSheet when the cythonized_tagSheet extension has not been built.
+It follows the same algorithm as cythonized_tagSheet.pyx, but the per-cell regular expression tests
+are memoized by cell value so each distinct cell string is only tested once per automation group,
+and the bulk array work (column insertion, copying, sorting, and filtering) is done with NumPy.
+"""
+
+import re
+import sys
+import copy
+from itertools import product
 
 import pandas
 import numpy
 
-def tagSheet(taggingDirectives: list, worksheet: pandas.DataFrame, silent: bool) -> tuple[numpy.ndarray,list[bool]]:
+from messes.extract import extract
+
+COLUMN_ORDER_CONSTANT = 16000
+COLUMN_ORDER_CONSTANT_PLUS = COLUMN_ORDER_CONSTANT + 1
+
+headerSplitter = re.compile(r'[+]|(r?\"[^\"]*\"|r?\'[^\']*\')')
+
+
+class _CellMatcher(object):
+    """Memoizes which header tests match a given cell value."""
+    def __init__(self, headerTests: dict):
+        """Initializer
+
+        Args:
+            headerTests: dictionary of header strings to compiled regular expressions (or pattern strings).
+        """
+        self.headerTests = headerTests
+        self.cache = {}
+
+    def __call__(self, cell: str) -> tuple[str]:
+        """Returns the header strings whose test matches the stripped cell value.
+
+        Args:
+            cell: raw value from the worksheet.
+
+        Returns:
+            Tuple of matching header strings in the order of self.headerTests.
+        """
+        if (matched := self.cache.get(cell)) is None:
+            cellString = extract.xstr(cell).strip()
+            matched = tuple(headerString for headerString, headerTest in self.headerTests.items() if re.search(headerTest, cellString))
+            self.cache[cell] = matched
+        return matched
+
+
+def findMatchingHeaders(headerMatcher: _CellMatcher, row: numpy.ndarray, rowIndex: int, automationGroupNum: int,
+                        duplicatesHeaders: set, silent: bool, transpose: bool) -> tuple[dict,dict]:
+    """Find the columns in row that match the header tests of headerMatcher.
+
+    Args:
+        headerMatcher: memoized header tests for the current automation group.
+        row: row (or column if transpose is True) of the worksheet to search.
+        rowIndex: index of the row in the worksheet, used for warning messages.
+        automationGroupNum: index of the automation group, used for warning messages.
+        duplicatesHeaders: headers that are allowed to match more than one column.
+        silent: if True don't print warnings.
+        transpose: if True search from the first element and word warnings in terms of rows.
+
+    Returns:
+        A tuple of 2 dictionaries, the first maps header strings to a list of column indexes and the second maps column indexes to a list of header strings.
+    """
+    headerColumns = {headerString : [] for headerString in headerMatcher.headerTests}
+    startIndex = 0 if transpose else 1
+    for columnIndex, cell in enumerate(row[startIndex:].tolist(), startIndex):
+        for headerString in headerMatcher(cell):
+            headerColumns[headerString].append(columnIndex)
+
+    header2ColumnIndex = {}
+    columnIndex2Header = {}
+    for headerString, columnIndeces in headerColumns.items():
+        if len(columnIndeces) == 1 or (len(columnIndeces) > 0 and headerString in duplicatesHeaders): # must be unique match
+            header2ColumnIndex[headerString] = columnIndeces
+            for index in columnIndeces:
+                if index in columnIndex2Header:
+                    columnIndex2Header[index].append(headerString)
+                else:
+                    columnIndex2Header[index] = [headerString]
+        elif len(columnIndeces) > 1 and not silent and headerString not in duplicatesHeaders:
+            if not transpose:
+                print("Warning: The header, " + headerString + ", in automation group, " + str(automationGroupNum) + ", was matched to more than 1 column near or on row, " + str(rowIndex) + ", in the tagged export.", file=sys.stderr)
+            else:
+                print("Warning: The header, " + headerString + ", in automation group, " + str(automationGroupNum) + ", was matched to more than 1 row near or on row, " + str(rowIndex) + ", in the tagged export.", file=sys.stderr)
+
+    return header2ColumnIndex, columnIndex2Header
+
+
+def findEndingRowIndex(rowIndex: int, worksheet: numpy.ndarray, usedRows: numpy.ndarray, copiedRows: numpy.ndarray, isCopy: bool) -> int:
+    """Find the index of the row that ends the block of rows starting at rowIndex.
+
+    Args:
+        rowIndex: index of the header row of the block.
+        worksheet: the worksheet being tagged.
+        usedRows: boolean mask of rows already tagged by previous automation groups.
+        copiedRows: boolean mask of rows created by copying.
+        isCopy: if True rows in usedRows do not end the block.
+
+    Returns:
+        The index of the first empty row, #tags row, copied row, or used row (if not isCopy) after rowIndex, or the number of rows in worksheet if there is none.
+    """
+    numberOfRows = worksheet.shape[0]
+    stopRows = copiedRows if isCopy else copiedRows | usedRows
+    for endingRowIndex in range(rowIndex+1, numberOfRows):
+        if stopRows[endingRowIndex]:
+            return endingRowIndex
+        row = worksheet[endingRowIndex, :].tolist()
+        if extract.xstr(row[0]).strip() == "#tags" or extract.TagParser._isEmptyRow(row):
+            return endingRowIndex
+
+    return numberOfRows
+
+
+def _insertRows(worksheet: numpy.ndarray, newRows: list[list[str]], rowIndex: int) -> numpy.ndarray:
+    """Insert newRows into worksheet before rowIndex, padding whichever is narrower with empty strings.
+
+    Args:
+        worksheet: the worksheet to insert rows into.
+        newRows: the rows to insert.
+        rowIndex: the index to insert the rows before.
+
+    Returns:
+        The new worksheet.
+    """
+    newArray = numpy.array(newRows, dtype=object)
+    newArrayColumns = newArray.shape[1]
+    worksheetColumns = worksheet.shape[1]
+    if newArrayColumns < worksheetColumns:
+        newArray = numpy.concatenate((newArray, numpy.full((newArray.shape[0], worksheetColumns-newArrayColumns), "", dtype=object)), axis=1, dtype=object)
+    elif newArrayColumns > worksheetColumns:
+        worksheet = numpy.concatenate((worksheet, numpy.full((worksheet.shape[0], newArrayColumns-worksheetColumns), "", dtype=object)), axis=1, dtype=object)
+    return numpy.concatenate((worksheet[0:rowIndex, :], newArray, worksheet[rowIndex:, :]), axis=0, dtype=object)
+
+
+def _insertFlags(rowFlags: numpy.ndarray, rowIndex: int, count: int, value: bool) -> numpy.ndarray:
+    """Insert count copies of value into the boolean row mask rowFlags before rowIndex.
+
+    Args:
+        rowFlags: boolean mask with one element per worksheet row.
+        rowIndex: the index to insert before.
+        count: the number of elements to insert.
+        value: the value of the inserted elements.
+
+    Returns:
+        The new mask.
+    """
+    return numpy.concatenate((rowFlags[0:rowIndex], numpy.full(count, value, dtype=bool), rowFlags[rowIndex:]))
+
+
+def _compileHeaderTagDescriptions(taggingGroup: dict) -> tuple[list[dict],dict,set,set,set]:
+    """Build the header tests and field makers for an automation group.
+
+    The descriptions in taggingGroup are copied, so the directives passed in are not modified.
+
+    Args:
+        taggingGroup: one automation group from the automation directives.
+
+    Returns:
+        A tuple of the compiled header tag descriptions, header tests, required headers, headers allowed to be duplicates, and headers that create new columns.
+    """
+    headerTagDescriptions = []
+    headerTests = {}
+    requiredHeaders = set()
+    duplicatesHeaders = set()
+    newColumnHeaders = set()
+    for headerTagDescription in taggingGroup["header_tag_descriptions"]:
+        headerTagDescription = dict(headerTagDescription)
+        ## If the added tag is an eval() tag create the header test differently.
+        if (reMatch := extract.Evaluator.isEvalString(headerTagDescription["header"])):
+            evaluator = extract.Evaluator(reMatch.group(1), False, True)
+            headerTagDescription["field_maker"] = evaluator
+            headerTagDescription["header_list"] = []
+            headerTagDescription["header_tests"] = evaluator.fieldTests.copy()
+            headerTagDescription["header_tests"].update({ headerString : re.compile("^" + headerString + "$") for headerString in evaluator.requiredFields if headerString not in evaluator.fieldTests })
+            headerTests.update(headerTagDescription["header_tests"])
+            newColumnHeaders.update(headerTagDescription["header_tests"].keys())
+        else:
+            headerTagDescription["header_list"] = [strippedToken for token in re.split(headerSplitter, headerTagDescription["header"]) if token != None and (strippedToken := token.strip()) != ""]
+            headerTagDescription["header_tests"] = {}
+            fieldMaker = extract.FieldMaker(headerTagDescription["header"])
+            for headerString in headerTagDescription["header_list"]:
+                if (reMatch := re.match(extract.TagParser.reDetector, headerString)):
+                    fieldMaker.operands.append(extract.VariableOperand(headerString))
+                    headerTagDescription["header_tests"][headerString] = re.compile(reMatch.group(1))
+                    headerTests[headerString] = headerTagDescription["header_tests"][headerString]
+                elif (reMatch := re.match(extract.TagParser.stringExtractor, headerString)):
+                    fieldMaker.operands.append(extract.LiteralOperand(reMatch.group(1)))
+                else:
+                    fieldMaker.operands.append(extract.VariableOperand(headerString))
+                    headerTagDescription["header_tests"][headerString] = re.compile("^" + headerString + "$")
+                    headerTests[headerString] = headerTagDescription["header_tests"][headerString]
+
+            if len(headerTagDescription["header_list"]) > 1 or len(headerTagDescription["header_list"]) != len(headerTagDescription["header_tests"]):
+                headerTagDescription["field_maker"] = fieldMaker
+                newColumnHeaders.update(headerTagDescription["header_tests"].keys())
+
+        if headerTagDescription["required"]:
+            requiredHeaders.update(headerTagDescription["header_tests"].keys())
+        if headerTagDescription["duplicates"]:
+            duplicatesHeaders.update(headerTagDescription["header_tests"].keys())
+        headerTagDescriptions.append(headerTagDescription)
+
+    return headerTagDescriptions, headerTests, requiredHeaders, duplicatesHeaders, newColumnHeaders
+
+
+def _sortBlock(block: numpy.ndarray, sortString: str, automationGroupNum: int) -> numpy.ndarray:
+    """Sort block according to a #sort directive exactly as the compiled module does.
+
+    The first row of block is used as the column labels of a DataFrame of the remaining rows, which is sorted along 
+    its columns and written back into block. Since block is a view of the worksheet the sort is written through to it.
+
+    Args:
+        block: rows to sort, the first row is the header row.
+        sortString: the value of the #sort tag, "header:ascending|descending,...".
+        automationGroupNum: index of the automation group, used for error messages.
+
+    Returns:
+        block, as an ndarray.
+
+    Raises:
+        Exception: if a header:sortorder pair is malformed or a header is not in the header row.
+    """
+    block = numpy.asarray(block)
+    dataFrame = pandas.DataFrame(block[1:, :], columns = block[0, :])
+    headers = []
+    sortOrders = []
+    for pair in [pair.strip() for pair in sortString.split(',')]:
+        if reMatch := re.match(r'"(.+)"\s*:\s*(ascending|descending)', pair):
+            pass
+        elif reMatch := re.match(r'([^:]+)\s*:\s*(ascending|descending)', pair):
+            pass
+        else:
+            raise Exception("Error: A #sort tag in automation group " + str(automationGroupNum) +
+                            " has a badly constructed header:sortorder pair, " +
+                            pair + ". It should be of the form \"header:ascending\" or \"header:descending\". "
+                            "Put double quotes around the header if it contains a colon.")
+        headers.append(reMatch.group(1).strip())
+        sortOrders.append(reMatch.group(2).strip())
+    missingHeaders = [header for header in headers if header not in dataFrame.columns]
+    if missingHeaders:
+        raise Exception("Error: The following header(s) in the #sort tag of automation group " + str(automationGroupNum) +
+                        " were not found in the data: " + str(missingHeaders))
+    dataFrame = dataFrame.sort_values(headers, axis = 1, ascending = [True if order == 'ascending' else False for order in sortOrders])
+    block[1:, :] = dataFrame.to_numpy()
+    return block
+
+
+def _filterBlock(block: numpy.ndarray, filterString: str, filterHeader: str, row: numpy.ndarray, rowIndex: int, 
+                 automationGroupNum: int, silent: bool, isView: bool) -> numpy.ndarray:
+    """Filter block according to a #filter directive exactly as the compiled module does.
+
+    The compiled module only looks up filterHeader, the last header string of the group's matched columns, in the 
+    header row, so the other headers in the directive are reported as not found. The conditions are tested on 
+    every row of block, including its header row.
+
+    Args:
+        block: rows to filter, the first row is the header row.
+        filterString: the value of the #filter tag, "header:filter" pairs combined with &, |, and parentheses.
+        filterHeader: the header string to look up in row.
+        row: the header row of the automation group in the worksheet.
+        rowIndex: index of the header row, used for warning messages.
+        automationGroupNum: index of the automation group, used for error messages.
+        silent: if True don't print warnings.
+        isView: True if block was neither transposed nor sorted. The compiled module then holds block as a 
+            memoryview, and an equality filter compares the memoryview to a list, which is always False.
+
+    Returns:
+        The rows of block that pass the filter.
+
+    Raises:
+        Exception: if a header:filter pair is malformed or a header is not found.
+    """
+    # Find all header:filter combos.
+    filterPairs = re.findall(r'((?:[^()&|]+|".+")\s*:\s*(?:[^()&|]+|".+"))', filterString)
+    # Split headers and filters to process separately.
+    headers = []
+    filterStrings = []
+    for pair in filterPairs:
+        if reMatch := re.match(r'"(.+)"\s*:\s*"(.+)"', pair):
+            pass
+        elif reMatch := re.match(r'"(.+)"\s*:\s*([^:]+)', pair):
+            pass
+        elif reMatch := re.match(r'([^:]+)\s*:\s*"(.+)"', pair):
+            pass
+        elif reMatch := re.match(r'([^:]+)\s*:\s*([^:]+)', pair):
+            pass
+        else:
+            raise Exception("Error: A #filter tag in automation group " + str(automationGroupNum) +
+                            " has a badly constructed header:filter pair, " +
+                            pair + ". It should be of the form \"header:filter\". "
+                            "Put double quotes around the header or filter if it contains a colon.")
+        headers.append(reMatch.group(1).strip())
+        filterStrings.append(reMatch.group(2).strip())
+    # Match headers to column indexes.
+    filterHeader2ColumnIndex, _ = findMatchingHeaders(_CellMatcher({filterHeader : '^' + filterHeader + '$'}), row, rowIndex, automationGroupNum, [], silent, False)
+    missingHeaders = [header for header in headers if header not in filterHeader2ColumnIndex]
+    if missingHeaders:
+        raise Exception("Error: The following header(s) in the #filter tag of automation group " + str(automationGroupNum) +
+                        " were not found in the data: " + str(missingHeaders))
+    # Turn filter strings into conditions.
+    conditions = []
+    for j, filterValue in enumerate(filterStrings):
+        columnIndex = filterHeader2ColumnIndex[headers[j]][0]
+        if filterValue == 'unique':
+            _, uniqueIndeces = numpy.unique(block[:, columnIndex], return_index=True)
+            condition = numpy.zeros(block.shape[0], dtype=bool)
+            condition[uniqueIndeces] = True
+            conditions.append(condition)
+        elif reMatch := re.match(extract.Evaluator.reDetector, filterValue):
+            compiledRegex = re.compile(reMatch.group(1))
+            conditions.append(numpy.vectorize(lambda x:bool(compiledRegex.match(x)))(block[:, columnIndex]))
+        elif isView:
+            conditions.append(False)
+        else:
+            conditions.append(block[:, columnIndex] == filterStrings)
+
+    evalString = filterString
+    for j, pair in enumerate(filterPairs):
+        evalString = evalString.replace(pair, 'conditions[' + str(j) + ']')
+    block = numpy.asarray(block)
+    return block[eval(evalString, {'conditions':conditions})]
+
+
+def _padFlags(rowFlags: numpy.ndarray, numberOfRows: int) -> numpy.ndarray:
+    """Extend the boolean row mask rowFlags with False up to numberOfRows elements.
+
+    The masks stand in for the sets of row indexes the compiled module keeps, which are not always shifted by the same 
+    number of rows as the worksheet grows, so a mask can be shorter or longer than the worksheet.
+
+    Args:
+        rowFlags: boolean mask of row indexes.
+        numberOfRows: the number of rows in the worksheet.
+
+    Returns:
+        The mask, with at least numberOfRows elements.
+    """
+    if len(rowFlags) >= numberOfRows:
+        return rowFlags
+    return numpy.concatenate((rowFlags, numpy.zeros(numberOfRows - len(rowFlags), dtype=bool)))
+
+
+def tagSheet(taggingDirectives: list, worksheet: numpy.ndarray, silent: bool) -> tuple[numpy.ndarray,list[bool]]:
     """Add tags to the worksheet using the given tagging directives.
 
     Args:
         taggingDirectives (list): List of dictionaries. One dictionary for each tagging group.
-        worksheet (memoryview): cython memoryview to a 2d numpy array of strings (objects).
+        worksheet (numpy.ndarray): 2d numpy array of strings (objects).
         silent (bool): if True don't print warnings.
-        
+
     Returns:
-        (tuple): tuple where the first value is the worksheet memoryview turned into a numpy array and the second value is a list of bools indicating which tagging directives in taggingDirectives were used.
+        (tuple): tuple where the first value is the tagged worksheet as a numpy array and the second value is a list of bools indicating which tagging directives in taggingDirectives were used.
     """
-    pass
+    wasTaggingDirectiveUsed = []
+    if taggingDirectives != None:
+        wasTaggingDirectiveUsed = [False for directive in taggingDirectives]
+        worksheet = numpy.asarray(worksheet, dtype=object)
+
+        firstColumn = worksheet[:, 0]
+        if not numpy.any(firstColumn == "#tags") and not numpy.all(firstColumn == ""):
+            worksheet = numpy.insert(worksheet, 0, "", axis=1)
+
+        ## Boolean masks over the worksheet rows, shifted as rows are inserted the same way the compiled module shifts its sets of row indexes.
+        usedRows = numpy.zeros(worksheet.shape[0], dtype=bool)
+        copiedRows = numpy.zeros(worksheet.shape[0], dtype=bool)
+        # Process each tagging group.
+        for i, taggingGroup in enumerate(taggingDirectives):
+            isCopy = any(word in taggingGroup for word in ['copy', 'transpose', 'sort', 'filter'])
+            if "header_tag_descriptions" not in taggingGroup:
+                # Insert at the beginning of the sheet
+                if "insert" in taggingGroup and len(taggingGroup["insert"]):
+                    worksheet = _insertRows(worksheet, taggingGroup["insert"], 0)
+                    insertNum = len(taggingGroup["insert"])
+                    usedRows = _insertFlags(usedRows, 0, insertNum, True)
+                    ## Like the compiled module, copied rows are not shifted by rows inserted at the beginning.
+                    copiedRows = _padFlags(copiedRows, len(usedRows))
+                    wasTaggingDirectiveUsed[i] = True
+                continue
+
+            ## Set up the header tests, required headers, and field makers for this group.
+            headerTagDescriptions, headerTests, requiredHeaders, duplicatesHeaders, newColumnHeaders = _compileHeaderTagDescriptions(taggingGroup)
+            headerMatcher = _CellMatcher(headerTests)
+
+            if "exclusion_test" in taggingGroup:
+                testString = taggingGroup["exclusion_test"]
+                if (reMatch := re.match(extract.TagParser.reDetector, testString)):
+                    exclusionMatcher = _CellMatcher({"exclusion" : re.compile(reMatch.group(1))})
+                else:
+                    exclusionMatcher = _CellMatcher({"exclusion" : re.compile("^" + testString + "$")})
+            else:
+                exclusionMatcher = None
+
+            ## Actually modify worksheet.
+            insert = False
+            rowIndex = 0
+            while rowIndex < worksheet.shape[0]:
+                if (usedRows[rowIndex] and not isCopy) or copiedRows[rowIndex]:
+                    rowIndex += 1
+                    continue
 
+                row = worksheet[rowIndex, :]
 
+                if exclusionMatcher and any(exclusionMatcher(cell) for cell in row[1:].tolist()):
+                    rowIndex += 1
+                    continue
 
+                header2ColumnIndex, columnIndex2Header = findMatchingHeaders(headerMatcher, row, rowIndex, i, duplicatesHeaders, silent, False)
 
+                if len(header2ColumnIndex) == 1 and 'transpose' in taggingGroup:
+                    columnIndexMatch = list(columnIndex2Header.keys())[0]
+                    column = worksheet[rowIndex:, columnIndexMatch]
+                    endingRowIndex = findEndingRowIndex(rowIndex, worksheet, usedRows, copiedRows, True)
+                    column = column[0:endingRowIndex]
+                    header2ColumnIndex, columnIndex2Header = findMatchingHeaders(headerMatcher, column, rowIndex, i, duplicatesHeaders, silent, True)
+                    # Update indexes to match where they actually need to be.
+                    header2ColumnIndex = {header: [index + columnIndexMatch for index in indexes] for header, indexes in header2ColumnIndex.items()}
+                    columnIndex2Header = {index + columnIndexMatch: header for index, header in columnIndex2Header.items()}
 
+                ## If 2 tests match to the same header it is not always a collision to be skipped.
+                ## The same header is not tagged twice
+                collidingHeaders = any(len([header for header in headers if not header in newColumnHeaders]) > 1 for headers in columnIndex2Header.values())
 
+                ## At least 1 header is found, all required headers found, and the same one isn't tagged twice.
+                if header2ColumnIndex and all([headerString in header2ColumnIndex for headerString in requiredHeaders]) and not collidingHeaders:
+                    endingRowIndex = findEndingRowIndex(rowIndex, worksheet, usedRows, copiedRows, isCopy)
+                    if endingRowIndex != rowIndex+1: # Ignore header row with empty line after it.
+                        if "insert" in taggingGroup and len(taggingGroup["insert"]) and (not insert or taggingGroup["insert_multiple"]):
+                            insert = True
+                            insertNum = len(taggingGroup["insert"])
+                            worksheet = _insertRows(worksheet, taggingGroup["insert"], rowIndex)
+                            usedRows = _insertFlags(usedRows, rowIndex, insertNum, True)
+                            copiedRows = _insertFlags(copiedRows, rowIndex, insertNum, False)
+                            rowIndex += insertNum
+                            endingRowIndex += insertNum
 
+                        if isCopy:
+                            if 'transpose' in taggingGroup:
+                                maxRowIndex = max([index for index in columnIndex2Header.keys()])
+                                numOfColumns = worksheet.shape[1]
+                                if maxRowIndex+1 > numOfColumns:
+                                    worksheet = numpy.concatenate((worksheet, numpy.full((worksheet.shape[0], maxRowIndex+1 - numOfColumns), "", dtype=object)), axis=1, dtype=object)
 
+                            block = worksheet[rowIndex:endingRowIndex, :]
+                            if 'transpose' in taggingGroup:
+                                block = numpy.transpose(block)[1:, :]
+                            if 'sort' in taggingGroup:
+                                block = _sortBlock(block, taggingGroup['sort'], i)
+                            if 'filter' in taggingGroup:
+                                filterHeader = [header for headers in columnIndex2Header.values() for header in headers][-1]
+                                isView = 'transpose' not in taggingGroup and 'sort' not in taggingGroup
+                                block = _filterBlock(block, taggingGroup['filter'], filterHeader, row, rowIndex, i, silent, isView)
+
+                            ## The copy is placed after a blank row following the block, and tagging continues on the copy. 
+                            ## Like the compiled module, the row masks are shifted by the size of the original block.
+                            blankRow = numpy.full((1, block.shape[1]), "", dtype=object)
+                            insertNum = endingRowIndex - rowIndex + 1
+                            worksheet = numpy.concatenate((worksheet[0:endingRowIndex, :], blankRow, block, worksheet[endingRowIndex:, :]), axis=0, dtype=object)
+                            usedRows = _insertFlags(usedRows, endingRowIndex, insertNum, False)
+                            copiedRows = _insertFlags(copiedRows, endingRowIndex, insertNum, False)
+                            usedRows = _padFlags(usedRows, worksheet.shape[0])
+                            copiedRows = _padFlags(copiedRows, worksheet.shape[0])
+                            rowIndex += insertNum
+                            endingRowIndex += block.shape[0] + 1
+
+                        # Insert #tags row and the #tags and #ignore tags.
+                        worksheet = numpy.concatenate((worksheet[0:rowIndex+1,:], worksheet[rowIndex:,:]), axis=0, dtype=object)
+                        worksheet[rowIndex+1,:] = ""
+                        worksheet[rowIndex,0] = "#ignore"
+                        worksheet[rowIndex+1,0] = '#tags'
+                        endingRowIndex += 1
+
+                        usedRows = _insertFlags(usedRows, rowIndex+1, 1, False)
+                        usedRows[rowIndex:endingRowIndex] = True
+                        copiedRows = _insertFlags(copiedRows, rowIndex+1, 1, False)
+                        if isCopy:
+                            copiedRows[rowIndex:endingRowIndex] = True
+
+                        worksheet = _placeTags(worksheet, headerTagDescriptions, header2ColumnIndex, rowIndex, endingRowIndex)
+                        wasTaggingDirectiveUsed[i] = True
+                rowIndex += 1
+
+    return numpy.asarray(worksheet), wasTaggingDirectiveUsed
+
+
+def _placeTags(worksheet: numpy.ndarray, headerTagDescriptions: list[dict], header2ColumnIndex: dict, rowIndex: int, endingRowIndex: int) -> numpy.ndarray:
+    """Reorder and create columns for a matched block and write the tags into its #tags row.
+
+    Args:
+        worksheet: the worksheet being tagged.
+        headerTagDescriptions: compiled header tag descriptions of the automation group.
+        header2ColumnIndex: mapping of header strings to the column indexes they matched.
+        rowIndex: index of the header row of the block, the #tags row is rowIndex+1.
+        endingRowIndex: index of the row after the end of the block.
+
+    Returns:
+        The tagged worksheet.
+    """
+    # Create correct relative column order.
+    originalTDColumnIndeces = [ [COLUMN_ORDER_CONSTANT] for x in range(len(headerTagDescriptions)) ]
+    for tdIndex, headerTagDescription in enumerate(headerTagDescriptions):
+        # If the header tag has a field_maker and all of the header_tests are in the header row it needs a new column.
+        # Having a field_maker signifies that a new column is needed, and all tests being satisfied means that it definitely was matched.
+        # If not all tests are satisfied, then the column can't be created, so there is no need to insert an empty one.
+        if "field_maker" in headerTagDescription and \
+                all( headerString in header2ColumnIndex for headerString in headerTagDescription["header_tests"] ):
+            colIndeces = [indeces for indeces in header2ColumnIndex.values() if len(indeces) > 1]
+            numOfColumns = len([combo for combo in product(*colIndeces)]) if len(colIndeces) > 1 else 1
+            originalTDColumnIndeces[tdIndex] = [COLUMN_ORDER_CONSTANT_PLUS] * numOfColumns
+        # If the header tag does not have a field_maker and has an empty header_list it needs a new column.
+        # This is basically the case where only a tag is being added. Not being matched up to a header, just added as is.
+        elif "field_maker" not in headerTagDescription and not headerTagDescription["header_list"]:
+            originalTDColumnIndeces[tdIndex] = [COLUMN_ORDER_CONSTANT_PLUS]
+        # If the header tag does not have a field_maker and the first element of its header list is in the header row then it needs a new column.
+        elif "field_maker" not in headerTagDescription and headerTagDescription["header_list"][0] in header2ColumnIndex:
+            originalTDColumnIndeces[tdIndex] = header2ColumnIndex[headerTagDescription["header_list"][0]]
 
+    newTDColumnIndeces = copy.deepcopy(originalTDColumnIndeces)
+    for tdIndex in range(len(headerTagDescriptions)):
+        for j, columnIndex in enumerate(newTDColumnIndeces[tdIndex]):
+            flatNewTDColumnIndeces = newTDColumnIndeces[tdIndex][j:] + [index for indeces_list in newTDColumnIndeces[tdIndex+1:] for index in indeces_list] + [worksheet.shape[1]]
+            minColumnIndex = min(flatNewTDColumnIndeces)
+            # insert new column if needed
+            ## The COLUMN_ORDER_CONSTANT_PLUS values always need a new column for themselves, but the values less than COLUMN_ORDER_CONSTANT only need a new column if they need to be reordered.
+            ## The second condition looks to see if the header tag under study needs to be reordered by seeing if there are any header tags that have a column index less than it.
+            ## If a header tag has an index less than the one under study then it means it needs to move to the right because the other header tag needs to be before the one under study.
+            if (columnIndex == COLUMN_ORDER_CONSTANT_PLUS or columnIndex < COLUMN_ORDER_CONSTANT) and minColumnIndex < columnIndex:
+                worksheet = numpy.insert(worksheet, minColumnIndex, "", axis=1)
+                header2ColumnIndex = {headerString:[(index+1 if index >= minColumnIndex else index) for index in indeces_list] for headerString, indeces_list in header2ColumnIndex.items()} # must be done before the next if, else statement
+                if originalTDColumnIndeces[tdIndex][j] != COLUMN_ORDER_CONSTANT_PLUS: # copy normal columns
+                    worksheet[rowIndex:endingRowIndex, minColumnIndex] = worksheet[rowIndex:endingRowIndex, columnIndex+1]
+                    header2ColumnIndex[headerTagDescriptions[tdIndex]["header_list"][0]][j] = minColumnIndex
 
+                newTDColumnIndeces[tdIndex][j] = minColumnIndex
+                newTDColumnIndeces[tdIndex][j+1:] = [index+1 if index >= minColumnIndex and index < COLUMN_ORDER_CONSTANT else index for index in newTDColumnIndeces[tdIndex][j+1:]]
+                newTDColumnIndeces[tdIndex+1:] = [[index+1 if index >= minColumnIndex and index < COLUMN_ORDER_CONSTANT else index for index in indeces_list] for indeces_list in newTDColumnIndeces[tdIndex+1:]]
 
+    # Add tags. Some will be modified later.
+    row = worksheet[rowIndex, :]
+    record = {headerString:extract.xstr(row[cIndeces[0]]).strip() for headerString, cIndeces in header2ColumnIndex.items()}
+    for tdIndex, headerTagDescription in enumerate(headerTagDescriptions):
+        tag = headerTagDescription["tag"]
+        placedTags = 0
+        for j, columnIndex in enumerate(originalTDColumnIndeces[tdIndex]):
+            if columnIndex != COLUMN_ORDER_CONSTANT:
+                if "field_maker" in headerTagDescription:
+                    if type(headerTagDescription["field_maker"]) == extract.FieldMaker:
+                        header = headerTagDescription["field_maker"].create(record, row)
+                    else:
+                        header = '_'.join(headerTagDescription["header_tests"].keys())
+                elif columnIndex != COLUMN_ORDER_CONSTANT_PLUS:
+                    header = row[columnIndex]
+                else:
+                    header = tag
 
+                modifiedTag = tag.replace('#HEADER#', header)
+                modifiedTag = modifiedTag.replace('#INCREMENT#', str(placedTags))
+                worksheet[rowIndex+1, newTDColumnIndeces[tdIndex][j]] = modifiedTag
+                placedTags += 1
 
+    # Compose new columns.
+    tdIndeces2MakerIndeces = {tdIndex:[j for j, colIndex in enumerate(colIndeces) if originalTDColumnIndeces[tdIndex][j] == COLUMN_ORDER_CONSTANT_PLUS] for tdIndex, colIndeces in enumerate(newTDColumnIndeces)}
+    makers = []
+    for tdIndex, newColIndeces in tdIndeces2MakerIndeces.items():
+        headerTagDescription = headerTagDescriptions[tdIndex]
+        ## Tag only descriptions have no field_maker, their tag was already placed above.
+        if not newColIndeces or "field_maker" not in headerTagDescription:
+            continue
+        neededHeaders = [headerString for headerString in headerTagDescription["header_tests"] if headerString in header2ColumnIndex]
+        multiIndexHeaders = [headerString for headerString in neededHeaders if len(header2ColumnIndex[headerString]) > 1]
+        combos = [combo for combo in product(*[[(headerString, colIndex) for colIndex in header2ColumnIndex[headerString]] for headerString in multiIndexHeaders])]
+        singleIndexHeaders = [(headerString, cIndeces[0]) for headerString, cIndeces in header2ColumnIndex.items() if headerString not in multiIndexHeaders]
+        makers.append((tdIndex, newColIndeces, combos, singleIndexHeaders))
 
+    headerRow = worksheet[rowIndex, :]
+    for rIndex in range(rowIndex + 2, endingRowIndex):
+        row = worksheet[rIndex, :]
+        for tdIndex, newColIndeces, combos, singleIndexHeaders in makers:
+            headerTagDescription = headerTagDescriptions[tdIndex]
+            fieldMaker = headerTagDescription["field_maker"]
+            valueRecordBase = {headerString:extract.xstr(row[cIndex]).strip() for headerString, cIndex in singleIndexHeaders}
+            tagRecordBase = {headerString:extract.xstr(headerRow[cIndex]).strip() for headerString, cIndex in singleIndexHeaders}
+            tag = headerTagDescription["tag"]
+            placedTags = 0
+            for j, colIndex in enumerate(newColIndeces):
+                combo = combos[j] if j < len(combos) else []
 
+                valueRecord = dict(valueRecordBase)
+                valueRecord.update({headerTuple[0]:extract.xstr(row[headerTuple[1]]).strip() for headerTuple in combo})
 
+                tagRecord = dict(tagRecordBase)
+                tagRecord.update({headerTuple[0]:extract.xstr(headerRow[headerTuple[1]]).strip() for headerTuple in combo})
 
+                if type(fieldMaker) == extract.FieldMaker:
+                    worksheet[rIndex, newTDColumnIndeces[tdIndex][colIndex]] = fieldMaker.create(valueRecord, row)
+                    header = fieldMaker.create(tagRecord, headerRow)
+                else:
+                    worksheet[rIndex, newTDColumnIndeces[tdIndex][colIndex]] = fieldMaker.evaluate(valueRecord)
+                    header = '_'.join(headerTagDescription["header_tests"].keys())
 
+                modifiedTag = tag.replace('#HEADER#', header)
+                modifiedTag = modifiedTag.replace('#INCREMENT#', str(placedTags))
+                worksheet[rowIndex+1, newTDColumnIndeces[tdIndex][j]] = modifiedTag
+                placedTags += 1
 
+    return worksheet
 
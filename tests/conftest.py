@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import os
+
+
+def pytest_addoption(parser):
+    parser.addoption("--benchmarks", action="store_true", default=False, help="run the timing and memory benchmarks")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: timing or memory comparison, only run with --benchmarks")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmarks"):
+        return
+    skip_benchmark = pytest.mark.skip(reason="benchmarks only run with --benchmarks")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def cache_home(tmp_path_factory):
+    """Keep the extraction cache of every test, including the ones that run the CLI, out of the real cache directory."""
+    previous = os.environ.get("XDG_CACHE_HOME")
+    os.environ["XDG_CACHE_HOME"] = tmp_path_factory.mktemp("cache").as_posix()
+    yield
+    if previous is None:
+        del os.environ["XDG_CACHE_HOME"]
+    else:
+        os.environ["XDG_CACHE_HOME"] = previous
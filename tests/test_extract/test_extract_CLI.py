@@ -11,6 +11,8 @@ import re
 
 import pandas
 
+from messes.extract import extract
+
 
 @pytest.fixture(scope="module", autouse=True)
 def change_cwd():
@@ -423,6 +425,262 @@ def test_end_modify():
 
 
 
+def test_jobs():
+    """Test that the jobs option gives the same output as extracting the metadata sources one at a time."""
+    
+    test_files = ["base_source.xlsx", "end_modify_1.xlsx", "end_modify_2.xlsx", "modification_comparison_type_exact_first_test.xlsx", "compare_differences_test.xlsx"]
+    
+    outputs = []
+    for jobs in ["1", "3"]:
+        command = "messes extract ../" + " ../".join(test_files) + " --output " + output_path.as_posix() + " --jobs " + jobs
+        command = command.split(" ")
+        subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+        
+        assert output_path.exists()
+        
+        with open(output_path, "r") as f:
+            outputs.append((f.read(), subp.stdout, subp.stderr))
+        os.remove(output_path)
+    
+    assert outputs[0] == outputs[1]
+    assert "Warning" in outputs[0][2]
+
+
+
+def test_jobs_not_positive_integer():
+    """Test that an error is printed when the jobs option is not a positive integer."""
+    
+    test_file = "base_source.xlsx"
+    
+    command = "messes extract ../" + test_file + " --output " + output_path.as_posix() + " --jobs 0"
+    command = command.split(" ")
+    subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+    output = subp.stderr
+    
+    assert not output_path.exists()
+    
+    assert output == "Error: The value for --jobs must be a positive integer.\n"
+
+
+
+
+def test_all_sheets(tmp_path):
+    """Test that the all-sheets option extracts every sheet matching a regular expression and prints a timing for each."""
+    
+    workbook_path = tmp_path / "sheets.xlsx"
+    with pandas.ExcelWriter(workbook_path) as writer:
+        pandas.DataFrame([["#tags", "#sample.id", "#.first"], ["", "s1", "1"], ["", "s2", "2"]]).to_excel(writer, sheet_name="#export1", header=False, index=False)
+        pandas.DataFrame([["notes"]]).to_excel(writer, sheet_name="notes", header=False, index=False)
+        pandas.DataFrame([["#tags", "#sample.id", "#.second"], ["", "s1", "a"], ["", "s3", "b"]]).to_excel(writer, sheet_name="#export2", header=False, index=False)
+    
+    outputs = []
+    for jobs in ["1", "2"]:
+        command = ["messes", "extract", workbook_path.as_posix() + ":r'#export'", "--all-sheets", "--no-cache", "--output", output_path.as_posix(), "--jobs", jobs]
+        subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+        
+        assert output_path.exists()
+        
+        with open(output_path, "r") as f:
+            outputs.append(json.loads(f.read()))
+        os.remove(output_path)
+        
+        assert re.match(r"Sheet timings for \".*sheets\.xlsx\":\n    #export1: load \d+\.\d{3}s, tag \d+\.\d{3}s, parse \d+\.\d{3}s, total \d+\.\d{3}s\n" + 
+                        r"    #export2: load .*\n$", subp.stderr)
+    
+    assert outputs[0] == outputs[1]
+    assert outputs[0] == {"sample" : {"s1" : {"id" : "s1", "first" : "1", "second" : "a"}, 
+                                      "s2" : {"id" : "s2", "first" : "2"}, 
+                                      "s3" : {"id" : "s3", "second" : "b"}}}
+
+
+
+
+def test_all_sheets_many_jobs(tmp_path):
+    """Test that reading many large sheets of one workbook in worker processes gives the same output as reading them one at a time."""
+    
+    workbook_path = tmp_path / "sheets.xlsx"
+    with pandas.ExcelWriter(workbook_path) as writer:
+        for sheet in range(16):
+            rows = [["#tags", "#sample.id", "#.sheet" + str(sheet), "#.last"]]
+            rows += [["", "sample" + str(row + sheet * 1500), str(row), str(sheet)] for row in range(3000)]
+            pandas.DataFrame(rows).to_excel(writer, sheet_name="#export" + str(sheet), header=False, index=False)
+    
+    outputs = []
+    for jobs in ["1", "8"]:
+        command = ["messes", "extract", workbook_path.as_posix() + ":r'#export'", "--all-sheets", "--no-cache", "--silent", "--output", output_path.as_posix(), "--jobs", jobs]
+        subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+        
+        assert subp.returncode == 0
+        assert subp.stderr == ""
+        assert output_path.exists()
+        
+        with open(output_path, "r") as f:
+            outputs.append(json.loads(f.read()))
+        os.remove(output_path)
+    
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0]["sample"]) == 25500
+    assert outputs[0]["sample"]["sample1500"] == {"id" : "sample1500", "sheet0" : "1500", "sheet1" : "0", "last" : "1"}
+
+
+
+def test_jobs_worker_errors():
+    """Test that an error in a worker process is reported and ends the extraction like it does without the jobs option."""
+    
+    for test_file, message in [("modification_missing_tags_error.xlsx", "Missing #table_name.field_name.value or #.field_name.assign|append|prepend|regex|delete|rename modification tags at cell"), 
+                               ("child_tag_no_parent_id.xlsx", "no id field in parent record at cell")]:
+        outputs = []
+        for jobs in ["1", "2"]:
+            command = "messes extract ../base_source.xlsx ../" + test_file + " --output " + output_path.as_posix() + " --jobs " + jobs
+            command = command.split(" ")
+            subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+            
+            assert not output_path.exists()
+            assert subp.returncode == 1
+            assert message in subp.stderr
+            outputs.append(subp.stderr)
+        
+        if test_file == "modification_missing_tags_error.xlsx":
+            assert outputs[0] == outputs[1]
+
+
+
+def test_xlsx_reader():
+    """Test that the stream xlsx reader gives the same output as the pandas reader."""
+    
+    test_files = ["base_source.xlsx", "end_modify_1.xlsx", "compare_differences_test.xlsx"]
+    
+    outputs = []
+    for reader in ["pandas", "stream"]:
+        command = "messes extract ../" + " ../".join(test_files) + " --output " + output_path.as_posix() + " --xlsx-reader " + reader
+        command = command.split(" ")
+        subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+        
+        assert output_path.exists()
+        
+        with open(output_path, "r") as f:
+            outputs.append((f.read(), subp.stdout, subp.stderr))
+        os.remove(output_path)
+    
+    assert outputs[0] == outputs[1]
+
+
+
+def test_xlsx_reader_invalid():
+    """Test that an error is printed when the xlsx-reader option is not pandas or stream."""
+    
+    test_file = "base_source.xlsx"
+    
+    command = "messes extract ../" + test_file + " --output " + output_path.as_posix() + " --xlsx-reader openpyxl"
+    command = command.split(" ")
+    subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+    output = subp.stderr
+    
+    assert not output_path.exists()
+    
+    assert output == "Error: The value for --xlsx-reader must be \"pandas\" or \"stream\".\n"
+
+
+
+def test_output_format(tmp_path):
+    """Test that the compact and ndjson output formats have the same records as the pretty output."""
+    
+    test_file = "base_source.xlsx"
+    
+    command = "messes extract ../" + test_file + " --output " + output_path.as_posix()
+    command = command.split(" ")
+    subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+    
+    assert output_path.exists()
+    with open(output_path, "r") as f:
+        pretty_output = f.read()
+    pretty_json = json.loads(pretty_output)
+    
+    compact_path = tmp_path / "compact.json"
+    command = "messes extract ../" + test_file + " --output " + compact_path.as_posix() + " --output-format compact"
+    command = command.split(" ")
+    subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+    
+    assert compact_path.read_text() == json.dumps(pretty_json, sort_keys=True, separators=(',', ':'))
+    
+    command = "messes extract ../" + test_file + " --output " + (tmp_path / "records").as_posix() + " --output-format ndjson"
+    command = command.split(" ")
+    subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+    
+    ndjson_path = tmp_path / "records.ndjson"
+    assert ndjson_path.exists()
+    ndjson_json = {}
+    with open(ndjson_path, "r") as f:
+        for line in f:
+            record_line = json.loads(line)
+            ndjson_json.setdefault(record_line["table"], {})[record_line["id"]] = record_line["record"]
+    
+    assert ndjson_json == pretty_json
+
+
+
+def test_output_format_invalid():
+    """Test that an error is printed when the output-format option is not pretty, compact, or ndjson."""
+    
+    test_file = "base_source.xlsx"
+    
+    command = "messes extract ../" + test_file + " --output " + output_path.as_posix() + " --output-format yaml"
+    command = command.split(" ")
+    subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+    output = subp.stderr
+    
+    assert not output_path.exists()
+    
+    assert output == "Error: The value for --output-format must be \"pretty\", \"compact\", or \"ndjson\".\n"
+
+
+
+def test_cache(tmp_path):
+    """Test that extracting the same sources again is served from the cache with the same output."""
+    
+    test_files = ["base_source.xlsx", "modification_comparison_type_exact_first_test.xlsx"]
+    environment = dict(os.environ, XDG_CACHE_HOME=tmp_path.as_posix())
+    cache_path = tmp_path / "messes" / "extract"
+    
+    outputs = []
+    for run in range(2):
+        command = "messes extract ../" + " ../".join(test_files) + " --output " + output_path.as_posix()
+        command = command.split(" ")
+        subp = subprocess.run(command, capture_output=True, encoding="UTF-8", env=environment)
+        
+        assert output_path.exists()
+        ## An extraction entry and an automation and a modification directives entry for each source.
+        assert len(list(cache_path.glob("*.pickle"))) == 6
+        
+        with open(output_path, "r") as f:
+            outputs.append((f.read(), subp.stdout, subp.stderr))
+        os.remove(output_path)
+    
+    assert outputs[0] == outputs[1]
+    assert "Warning" in outputs[0][2]
+
+
+
+def test_no_cache(tmp_path):
+    """Test that the no-cache option does not write to the cache."""
+    
+    test_file = "base_source.xlsx"
+    environment = dict(os.environ, XDG_CACHE_HOME=tmp_path.as_posix())
+    
+    command = "messes extract ../" + test_file + " --output " + output_path.as_posix() + " --no-cache"
+    command = command.split(" ")
+    subp = subprocess.run(command, capture_output=True, encoding="UTF-8", env=environment)
+    output = subp.stderr
+    
+    assert output_path.exists()
+    
+    assert not (tmp_path / "messes").exists()
+    
+    assert output == ""
+
+
+
+
 def test_automate_worksheet_name():
     """Test that the automate option works with a worksheet name."""
     
@@ -1201,6 +1459,34 @@ def test_compare_many_differences():
     
 
 
+def test_compare_diff(tmp_path):
+    """Test that the compare-diff option writes the differences as JSON or NDJSON."""
+    
+    test_file = "compare_differences_test.xlsx"
+    
+    differences = []
+    for diff_name in ["differences.json", "differences.ndjson"]:
+        diff_path = tmp_path / diff_name
+        command = "messes extract ../" + test_file +" --output " + output_path.as_posix() + " --compare " + output_compare_path.as_posix() + " --compare-diff " + diff_path.as_posix()
+        command = command.split(" ")
+        subp = subprocess.run(command, capture_output=True, encoding="UTF-8")
+        
+        assert output_path.exists()
+        assert "Table measurement id (S)-2-Acetolactate Glutaric acid Methylsuccinic acid-13C1-01_A0_Colon_T03-2017_naive_170427_UKy_GCB_rep1-quench with different fields: comments" in subp.stdout
+        
+        with open(diff_path, "r") as f:
+            if diff_path.suffix == ".json":
+                differences.append(json.load(f))
+            else:
+                differences.append([json.loads(line) for line in f])
+    
+    assert differences[0] == differences[1]
+    assert [difference["type"] for difference in differences[0]] == ["missing_tables", "extra_tables", "missing_records", "extra_records", "different_fields"]
+    assert differences[0][0]["tables"] == ["protocol"]
+    assert differences[0][4]["fields"] == ["comments"]
+    
+
+
 def test_file_processing_csv():
     """Test that --file_processing removes characters it's supposed to be default for csv files."""
     
@@ -1295,3 +1581,60 @@ def test_file_processing_not_default():
 
 
 
+def test_extraction_cache_evicts_least_recently_used(tmp_path):
+    """Test that the extraction cache deletes the least recently used entries once it is over its size limit."""
+
+    cache = extract.ExtractionCache(tmp_path, maxSize=2500)
+    entry = {"stdout" : "", "stderr" : "", "extraction" : {"table" : {"id" : "x" * 1000}}, "trackingState" : ({}, {}, {})}
+    for key in ["first", "second"]:
+        cache.store(key, entry)
+    ## Loading an entry makes it the most recently used.
+    os.utime(tmp_path / "first.pickle", (0, 0))
+    os.utime(tmp_path / "second.pickle", (1, 1))
+    assert cache.load("first") == entry
+
+    cache.store("third", entry)
+
+    assert sorted(path.stem for path in tmp_path.glob("*.pickle")) == ["first", "third"]
+    assert cache.load("second") is None
+
+
+def test_cache_key_includes_code(monkeypatch):
+    """Test that cache keys change when the extraction code changes, even if the version doesn't."""
+    
+    worksheet = pandas.DataFrame([["#tags", "#sample.id"], ["", "sample1"]])
+    keys = lambda: (extract.ExtractionCache.key("file.xlsx", "Sheet1", worksheet, None, None, ({}, {}, {}), False), 
+                    extract.ExtractionCache.directivesKey("file.xlsx", "Sheet1", worksheet, "automation", False))
+    
+    assert len(extract.ExtractionCache.codeDigest()) == 64
+    originalKeys = keys()
+    monkeypatch.setattr(extract.ExtractionCache, "extractionCodeDigest", "0" * 64)
+    changedKeys = keys()
+    
+    assert originalKeys[0] != changedKeys[0]
+    assert originalKeys[1] != changedKeys[1]
+
+
+def test_directives_key_includes_format_version(monkeypatch):
+    """Test that directive cache keys change when the format of the pickled directives changes."""
+    
+    worksheet = pandas.DataFrame([["#tags", "#sample.id"], ["", "sample1"]])
+    originalKey = extract.ExtractionCache.directivesKey("file.xlsx", "#modify", worksheet, "modification", False)
+    monkeypatch.setattr(extract.ExtractionCache, "directivesFormatVersion", extract.ExtractionCache.directivesFormatVersion + 1)
+    
+    assert extract.ExtractionCache.directivesKey("file.xlsx", "#modify", worksheet, "modification", False) != originalKey
+
+
+def test_extraction_cache_load_misses_unloadable_entries(tmp_path):
+    """Test that entries naming modules or attributes that no longer exist are loaded as misses instead of raising."""
+
+    cache = extract.ExtractionCache(tmp_path)
+    ## Protocol 0 pickles of a global from a missing module and of a missing global from an existing module.
+    (tmp_path / "missing_module.pickle").write_bytes(b"cmesses_missing_module\nThing\n.")
+    (tmp_path / "missing_attribute.pickle").write_bytes(b"cmesses.extract.extract\nMissingThing\n.")
+    (tmp_path / "truncated.pickle").write_bytes(b"\x80\x05")
+    
+    assert cache.load("missing_module") is None
+    assert cache.load("missing_attribute") is None
+    assert cache.load("truncated") is None
+    assert cache.load("absent") is None
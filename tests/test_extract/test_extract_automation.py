@@ -8,9 +8,20 @@ import copy
 import json
 import subprocess
 import re
+import io
+import contextlib
 
+import numpy
 import pandas
 
+from messes.extract import extract
+from messes.extract import tagSheet as python_tagSheet
+
+try:
+    from messes.extract import cythonized_tagSheet
+except ImportError:
+    cythonized_tagSheet = None
+
 
 @pytest.fixture(scope="module", autouse=True)
 def change_cwd():
@@ -35,6 +46,21 @@ def delete_metadata():
                 
 output_compare_path = pathlib.Path("output_compare.json")
 
+testing_files = pathlib.Path(__file__).parent / "testing_files"
+removeRegex = "_x([0-9a-fA-F]{4})_|\r"
+
+requires_compiled = pytest.mark.skipif(cythonized_tagSheet is None, reason="cythonized_tagSheet extension is not built.")
+
+
+def run_tagSheet(module, directives: list, worksheet: numpy.ndarray) -> tuple[numpy.ndarray,list[bool],str,float]:
+    """Run module.tagSheet and return its results, stderr output, and run time."""
+    stderr = io.StringIO()
+    start = time.perf_counter()
+    ## The compiled module prints debugging output to stdout.
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+        worksheet, used = module.tagSheet(copy.deepcopy(directives), worksheet.copy(), False)
+    return numpy.asarray(worksheet), used, stderr.getvalue(), time.perf_counter() - start
+
 
 
     
@@ -670,3 +696,46 @@ def test_automation_spaces_in_header():
     assert output_json == output_compare_json
             
     assert output == ""
+
+
+
+@requires_compiled
+@pytest.mark.parametrize("test_file", [
+        "base_source.xlsx",
+        "automation_ignore_test.xlsx",
+        "automation_insert_multiple_false_test.xlsx",
+        "automation_copy_test.xlsx",
+        "automation_transpose_test.xlsx",
+        "automation_sort_test.xlsx",
+        "automation_filter_test.xlsx",
+        "duplicate_columns.xlsx",
+        "eval_list.xlsx",
+        "exclusion_test.xlsx",
+        "multiple_inserts.xlsx",
+        "regex_in_eval.xlsx",
+        "unused_tag.xlsx",
+        ])
+def test_python_tagSheet_matches_compiled(test_file):
+    """Test that the pure Python automation engine tags worksheets, or fails to, exactly like the compiled one."""
+
+    test_file = (testing_files / test_file).as_posix()
+    tagParser = extract.TagParser()
+    directives = tagParser.readDirectives(test_file, "#automate", "automation", removeRegex)
+    worksheet = extract.TagParser.loadSheet(test_file, "#export", removeRegex=removeRegex)[2].to_numpy(dtype=object, copy=True)
+
+    results = []
+    for module in [cythonized_tagSheet, python_tagSheet]:
+        try:
+            results.append(run_tagSheet(module, directives, worksheet)[:3])
+        except Exception as error:
+            results.append((type(error), str(error)))
+    compiled, python = results
+
+    assert len(python) == len(compiled)
+    if len(compiled) == 2:
+        assert python == compiled
+    else:
+        assert python[0].shape == compiled[0].shape
+        assert (python[0] == compiled[0]).all()
+        assert python[1] == compiled[1]
+        assert python[2] == compiled[2]
@@ -0,0 +1,629 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import sys
+import time
+import copy
+import io
+import contextlib
+import tracemalloc
+import collections
+import json
+
+import numpy
+import pandas
+
+from messes.extract import extract
+from messes.extract import tagSheet as python_tagSheet
+
+try:
+    from messes.extract import cythonized_tagSheet
+except ImportError:
+    cythonized_tagSheet = None
+
+from test_extract_automation import run_tagSheet
+from test_extract_modifications import write_modification_csv, read_directives
+from test_extract_integration import read_excel_twice, write_large_workbook, make_tag_group_sheet, \
+    make_sample_sheet, parse_rows_with, make_lineage_extraction, \
+    make_tracking_sheet, make_study_sheet, \
+    write_multiple_sheet_workbook, read_metadata_sources
+
+
+removeRegex = "_x([0-9a-fA-F]{4})_|\r"
+
+
+def make_automation_sheet(numberOfBlocks: int, rowsPerBlock: int) -> numpy.ndarray:
+    """Build an untagged worksheet of numberOfBlocks header rows each followed by rowsPerBlock data rows."""
+    rows = []
+    for block in range(numberOfBlocks):
+        rows.append(["", "Sample ID", "Compound", "Intensity", "Units"])
+        for row in range(rowsPerBlock):
+            rows.append(["", "sample" + str(block) + "-" + str(row % 7), "compound" + str(row), str(row * 1.5), "uM"])
+        rows.append([""] * 5)
+    return numpy.array(rows, dtype=object)
+
+automation_directives = [{"header_tag_descriptions" : [
+    {"header" : "Sample ID", "tag" : "#sample.id", "required" : True, "duplicates" : False},
+    {"header" : "\"m-\"+Sample ID+\"-\"+Compound", "tag" : "#measurement.id", "required" : True, "duplicates" : False},
+    {"header" : "Compound", "tag" : "#measurement.compound", "required" : True, "duplicates" : False},
+    {"header" : "Intensity", "tag" : "#measurement.intensity", "required" : True, "duplicates" : False},
+    {"header" : "Units", "tag" : "#.units", "required" : False, "duplicates" : False}]}]
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("numberOfBlocks, rowsPerBlock", [(1, 100000), (50, 200)])
+def test_python_tagSheet_benchmark(numberOfBlocks, rowsPerBlock):
+    """Benchmark the pure Python automation engine against the compiled one when it is available."""
+
+    worksheet = make_automation_sheet(numberOfBlocks, rowsPerBlock)
+    python = run_tagSheet(python_tagSheet, automation_directives, worksheet)
+
+    assert python[1] == [True]
+    assert (python[0][:, 0] == "#tags").sum() == numberOfBlocks
+
+    if cythonized_tagSheet is not None:
+        compiled = run_tagSheet(cythonized_tagSheet, automation_directives, worksheet)
+        print("\ntagSheet " + str(numberOfBlocks) + "x" + str(rowsPerBlock) + " rows: compiled " +
+              format(compiled[3], ".3f") + "s, python " + format(python[3], ".3f") + "s")
+        assert (python[0] == compiled[0]).all()
+        assert python[3] < 2 * compiled[3]
+    else:
+        print("\ntagSheet " + str(numberOfBlocks) + "x" + str(rowsPerBlock) + " rows: python " + format(python[3], ".3f") + "s")
+
+
+@pytest.mark.benchmark
+def test_readExcelSheet_benchmark(tmp_path):
+    """Benchmark loading a sheet in a single read against reading it twice."""
+
+    workbookPath = tmp_path / "large.xlsx"
+    write_large_workbook(workbookPath)
+
+    workbook = pandas.ExcelFile(workbookPath)
+    start = time.perf_counter()
+    expected = read_excel_twice(workbook, "Sheet1")
+    doubleTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = extract.TagParser._readExcelSheet(workbook, "Sheet1")
+    singleTime = time.perf_counter() - start
+
+    print("\nloadSheet 20000 rows: double read " + format(doubleTime, ".3f") + "s, single read " + format(singleTime, ".3f") + "s")
+    pandas.testing.assert_frame_equal(result, expected)
+    assert singleTime < doubleTime
+
+
+@pytest.mark.benchmark
+def test_directive_cache_benchmark(tmp_path, monkeypatch):
+    """Test that reading modification directives from the cache, already compiled, takes less time than parsing and compiling them."""
+
+    csvPath = tmp_path / "modifications.csv"
+    write_modification_csv(csvPath, 2000)
+    
+    start = time.perf_counter()
+    tagParser = extract.TagParser()
+    directives, _ = read_directives(tagParser, csvPath.as_posix(), "", "modification")
+    extract.ModificationPlan(directives)
+    parseTime = time.perf_counter() - start
+    
+    monkeypatch.setattr(extract, "extractionCache", extract.ExtractionCache(tmp_path / "cache"))
+    read_directives(extract.TagParser(), csvPath.as_posix(), "", "modification")
+    start = time.perf_counter()
+    tagParser = extract.TagParser()
+    cachedDirectives, _ = read_directives(tagParser, csvPath.as_posix(), "", "modification")
+    cacheTime = time.perf_counter() - start
+    
+    print("\nread 2000 modification directives: parsed and compiled " + format(parseTime, ".3f") + "s, cached " + format(cacheTime, ".3f") + "s")
+    assert cachedDirectives == directives
+    assert len(tagParser.modificationPlan.compiledDirectives["sample"]["id"]["exact-all"]) == 2000
+    assert cacheTime < parseTime / 2
+
+
+def find_tag_groups_by_scanning(worksheet: pandas.core.frame.DataFrame) -> tuple[list[int],list[int]]:
+    """The previous parseSheet implementation, which scanned every possible end row for each header row."""
+    tagRows = worksheet.iloc[:,0].str.match(r"\s*#tags\s*")
+    emptyRows = (worksheet=="").all(axis=1)
+    possibleEndOfTagGroupRows = emptyRows | tagRows
+    worksheetHeaderRows = worksheet[tagRows]
+    endOfTagGroupIndexes = []
+    for header_index in worksheetHeaderRows.index:
+        endingIndexFound = False
+        for index in possibleEndOfTagGroupRows[possibleEndOfTagGroupRows].index:
+            if index > header_index:
+                endOfTagGroupIndexes.append(index)
+                endingIndexFound = True
+                break
+        if not endingIndexFound:
+            endOfTagGroupIndexes.append(possibleEndOfTagGroupRows.index[-1]+1)
+    return list(worksheetHeaderRows.index), endOfTagGroupIndexes
+
+
+@pytest.mark.benchmark
+def test_tag_groups_benchmark():
+    """Benchmark finding the tag group boundaries of a sheet with 5000 tag groups against the previous scan."""
+
+    worksheet = make_tag_group_sheet(5000)
+    start = time.perf_counter()
+    expected = find_tag_groups_by_scanning(worksheet)
+    scanTime = time.perf_counter() - start
+    start = time.perf_counter()
+    result = extract.TagParser._findTagGroups(worksheet)
+    searchTime = time.perf_counter() - start
+
+    print("\ntag groups 5000 groups: scan " + format(scanTime, ".3f") + "s, searchsorted " + format(searchTime, ".3f") + "s")
+    assert result == expected
+    assert searchTime < scanTime
+
+
+@pytest.mark.benchmark
+def test_parseRow_ndarray_rows_benchmark():
+    """Benchmark parsing rows as object ndarrays against parsing them as pandas Series."""
+
+    worksheet = make_sample_sheet(20000)
+    results = [parse_rows_with(worksheet, rowGetter) for rowGetter in ["series", "ndarray"]]
+
+    print("\n_parseRow 20000 rows: Series " + format(20000 / results[0][1], ".0f") + " rows/s, ndarray " + format(20000 / results[1][1], ".0f") + " rows/s")
+    assert results[0][0] == results[1][0]
+    assert results[1][1] < results[0][1]
+
+
+@pytest.mark.benchmark
+def test_parseRows_benchmark():
+    """Benchmark building the records of a 100000 row measurement tag group column by column against a row at a time."""
+
+    header = ["#tags", "#measurement.id", "#.sample.id", "#.compound", "#.intensity", "#.units", "#.assignment", "*#.tags", "#.type", "#.note"]
+    rows = [["", "m" + str(row), "s" + str(row % 500), "c" + str(row % 300), str(row * 1.5), "uM", "a" + str(row % 7), "x;y", "concentration", ""] for row in range(100000)]
+    rows[5][1] = "m4"
+    worksheet = numpy.array([header] + rows, dtype=object)
+
+    results = []
+    for parseRows in [lambda tagParser, recordMakers: [tagParser._parseRow(recordMakers, row) for row in worksheet[1:]], 
+                      lambda tagParser, recordMakers: tagParser._parseRows(recordMakers, worksheet[1:])]:
+        tagParser = extract.TagParser()
+        recordMakers = tagParser._parseHeaderRow(worksheet[0])
+        start = time.perf_counter()
+        parseRows(tagParser, recordMakers)
+        results.append((tagParser.extraction, time.perf_counter() - start))
+
+    print("\nmeasurement tag group 100000 rows: row at a time " + format(results[0][1], ".3f") + "s, column by column " + format(results[1][1], ".3f") + "s")
+    assert results[0][0] == results[1][0]
+    assert results[1][0]["measurement"]["m4"]["intensity"] == ["6.0", "7.5"]
+    assert results[1][0]["measurement"]["m4"]["tags"] == ["x", "y", "x", "y"]
+    assert results[1][1] < results[0][1]
+
+
+def add_record_by_concatenation(self, table: str, record: dict):
+    """Merge a record the way _addRecord did before accumulating lists, making a new list for every merged value."""
+    if not record["id"] in self.extraction[table] :
+        self.extraction[table][record["id"]] = record
+        return
+    existingRecord = self.extraction[table][record["id"]]
+    for key in record :
+        if key == "id" :
+            pass
+        elif not key in existingRecord :
+            existingRecord[key] = record[key]
+        elif isinstance(existingRecord[key], list) :
+            if isinstance(record[key], list):
+                existingRecord[key] = existingRecord[key] + record[key]
+            else:
+                existingRecord[key] = existingRecord[key] + [record[key]]
+        elif existingRecord[key] != record[key] :
+            existingRecord[key] = [ existingRecord[key], record[key] ]
+
+
+@pytest.mark.benchmark
+def test_addRecord_duplicate_record_benchmark(monkeypatch):
+    """Benchmark merging 10000 rows into the same record against making a new list for every merged row."""
+
+    header = ["#tags", "#measurement.id", "#.sample.id", "#.intensity", "*#.tags", "#.units"]
+    rows = [["", "m1", "s1", str(row * 1.5), "x;y", "uM"] for row in range(10000)]
+    worksheet = pandas.DataFrame([header] + rows)
+
+    results = []
+    for addRecord in [add_record_by_concatenation, extract.TagParser._addRecord]:
+        monkeypatch.setattr(extract.TagParser, "_addRecord", addRecord)
+        tagParser = extract.TagParser()
+        start = time.perf_counter()
+        tagParser.parseSheet("benchmark.xlsx", "Sheet1", worksheet)
+        results.append((tagParser.extraction, time.perf_counter() - start))
+
+    print("\nmerge 10000 rows into one record: new lists " + format(results[0][1], ".3f") + "s, accumulated " + format(results[1][1], ".3f") + "s")
+    assert results[0][0] == results[1][0]
+    record = results[1][0]["measurement"]["m1"]
+    assert record["intensity"] == [str(row * 1.5) for row in range(10000)]
+    assert record["tags"] == ["x", "y"] * 10000
+    assert record["units"] == "uM"
+    assert results[1][1] * 2 < results[0][1]
+
+
+def parse_row_with_tracking_keys(self, recordMakers, row):
+    """Parse a row the way _parseRow did before tracking slots, building "table.field" keys into trackedFieldsDict for every record."""
+    for recordMaker in recordMakers :
+        if not recordMaker.hasValidID():
+            return
+        table,record = recordMaker.create(row)
+        if not table in self.extraction :
+            self.extraction[table] = {}
+        if table in self.tablesAndFieldsToTrack:
+            for field in self.tablesAndFieldsToTrack[table]:
+                if field in record:
+                    self.trackedFieldsDict[table + "." + field] = record[field]
+        if table in self.tableRecordsToAddTo:
+            for fieldToAdd in self.tableRecordsToAddTo[table]:
+                if not fieldToAdd in record and self.trackedFieldsDict[fieldToAdd] != "":
+                    record[fieldToAdd] = self.trackedFieldsDict[fieldToAdd]
+                elif fieldToAdd in record:
+                    self.trackedFieldsDict[fieldToAdd] = record[fieldToAdd]
+        self._addRecord(table, record)
+
+
+@pytest.mark.benchmark
+def test_tracking_slots_benchmark(monkeypatch):
+    """Benchmark parsing a sheet with heavy #track use with tracking slots against building tracking keys for every record."""
+
+    worksheet = make_tracking_sheet(50000)
+    results = []
+    for parseRow, storeTrackedValues in [(parse_row_with_tracking_keys, lambda self: None), (extract.TagParser._parseRow, extract.TagParser._storeTrackedValues)]:
+        monkeypatch.setattr(extract.TagParser, "_parseRow", parseRow)
+        monkeypatch.setattr(extract.TagParser, "_storeTrackedValues", storeTrackedValues)
+        times = []
+        for repeat in range(3):
+            tagParser = extract.TagParser()
+            start = time.perf_counter()
+            tagParser.parseSheet("benchmark.xlsx", "Sheet1", worksheet)
+            times.append(time.perf_counter() - start)
+        results.append((tagParser.extraction, min(times)))
+
+    print("\ntracked sheet 100000 rows: tracking keys " + format(results[0][1], ".3f") + "s, tracking slots " + format(results[1][1], ".3f") + "s")
+    assert results[0][0] == results[1][0]
+    assert results[1][1] < results[0][1]
+
+
+def parse_sheet_group_at_a_time(self, fileName: str, sheetName: str, worksheet: pandas.core.frame.DataFrame):
+    """Parse a worksheet the way parseSheet did before segments, parsing the header row and rows of every tag group in turn."""
+    self.lastTable, self.lastField, self.columnIndex, self.rowIndex = "", "", -1, -1
+    self.fileName, self.sheetName = fileName, sheetName
+    rows = worksheet.to_numpy(dtype=object)
+    ignoreRows = extract.TagParser._matchFirstColumn(rows, r"\s*#ignore\s*")
+    self.idIndex = None
+    self.fieldAccumulators = {}
+    for headerRowIndex, endOfTagGroupIndex in zip(*extract.TagParser._findTagGroups(worksheet)):
+        self.rowIndex = headerRowIndex
+        recordMakers = self._parseHeaderRow(rows[headerRowIndex])
+        if not recordMakers[-1].hasValidID() and recordMakers[-1].fieldMakers and not extract.silent:
+            print("Warning: The header row at index " + str(headerRowIndex) + " in the compiled export sheet does not have an \"id\" tag, so it will not be in the JSON output.", file=sys.stderr)
+        groupRows = rows[headerRowIndex+1:endOfTagGroupIndex]
+        ignoredInGroup = ignoreRows[headerRowIndex+1:endOfTagGroupIndex]
+        if ignoredInGroup.any():
+            groupRows = groupRows[~ignoredInGroup]
+        if len(groupRows) == 0 and not recordMakers[0].table in self.extraction :
+            self.extraction[recordMakers[0].table] = {}
+        self._parseRows(recordMakers, groupRows)
+    self.fieldAccumulators = {}
+    self.rowIndex = -1
+
+
+@pytest.mark.benchmark
+def test_tag_group_segments_benchmark():
+    """Benchmark parsing a sheet of 4000 small tag groups as segments against parsing each tag group."""
+
+    worksheet = make_study_sheet(4000, 20, 4000, 200)
+    results = []
+    for parseSheet in [parse_sheet_group_at_a_time, extract.TagParser.parseSheet]:
+        times = []
+        for repeat in range(3):
+            tagParser = extract.TagParser()
+            start = time.perf_counter()
+            parseSheet(tagParser, "benchmark.xlsx", "Sheet1", worksheet)
+            times.append(time.perf_counter() - start)
+        results.append((tagParser.extraction, min(times)))
+
+    print("\n4000 tag groups of 20 rows: group at a time " + format(results[0][1], ".3f") + "s, segments " + format(results[1][1], ".3f") + "s")
+    assert results[0][0] == results[1][0]
+    assert results[1][1] < results[0][1]
+
+
+@pytest.mark.benchmark
+def test_load_tag_parse_peak_memory(tmp_path):
+    """Test that loading, tagging, and parsing a sheet does not make extra copies of its cells."""
+
+    csvPath = tmp_path / "large.csv"
+    with open(csvPath, "w") as csvFile:
+        csvFile.write("Sample ID,Compound,Intensity,Units,Note,A,B,C,D,E\n")
+        for row in range(50000):
+            csvFile.write("s" + str(row % 700) + ",compound" + str(row) + "_x0041_," + str(row * 1.5) + ",uM,,a,b,c" + str(row) + ",d,e\n")
+    directives = [{"header_tag_descriptions" : [{"header" : "Sample ID", "tag" : "#sample.id", "required" : True, "duplicates" : False},
+                                                {"header" : "Intensity", "tag" : "#.intensity", "required" : True, "duplicates" : False}]}]
+
+    tagParser = extract.TagParser()
+    tracemalloc.start()
+    try:
+        fileName, sheetName, worksheet = extract.TagParser.loadSheet(csvPath.as_posix(), "", removeRegex=removeRegex)
+        loadedSize, loadPeak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            worksheet = tagParser.tagSheet(directives, worksheet, False)
+            tagPeak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+            tagParser.parseSheet(fileName, sheetName, worksheet)
+        parsePeak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    print("\nload/tag/parse 50000 rows: loaded " + format(loadedSize / 1e6, ".1f") + "MB, peak while loading " + format(loadPeak / loadedSize, ".2f") + 
+          "x, tagging " + format(tagPeak / loadedSize, ".2f") + "x, parsing " + format(parsePeak / loadedSize, ".2f") + "x")
+    assert (worksheet == "compound0").to_numpy().any()
+    assert len(tagParser.extraction["sample"]) == 700
+    ## Before the sheet was kept in one array these were about 1.8x, 2.3x, and 1.9x.
+    assert loadPeak < 1.6 * loadedSize
+    assert tagPeak < 2.15 * loadedSize
+    assert parsePeak < 1.5 * loadedSize
+
+
+@pytest.mark.benchmark
+def test_xlsx_stream_reader_benchmark(tmp_path, monkeypatch):
+    """Benchmark loadSheet with the stream reader against pandas, which gives the same DataFrame."""
+
+    workbookPath = tmp_path / "large.xlsx"
+    rows = [["#tags", "#sample.id", "#.value", "#.flag", "#.note", "#.units"]]
+    rows += [["", "sample" + str(row), row if row % 3 else row * 1.5, row % 2 == 0, "NA" if row % 5 == 0 else "", "uM"] for row in range(20000)]
+    pandas.DataFrame(rows).to_excel(workbookPath, sheet_name="#export", header=False, index=False, engine="openpyxl")
+
+    results = {}
+    times = {}
+    for reader in ["pandas", "stream"]:
+        monkeypatch.setattr(extract, "xlsxReader", reader)
+        extract.TagParser.evictWorkbooks()
+        start = time.perf_counter()
+        results[reader] = extract.TagParser.loadSheet(workbookPath.as_posix(), "#export", removeRegex=removeRegex)
+        times[reader] = time.perf_counter() - start
+        assert isinstance(extract.TagParser.workbookCache[extract.TagParser._workbookCacheKey(workbookPath.as_posix())], extract.XlsxStreamReader) == (reader == "stream")
+    extract.TagParser.evictWorkbooks()
+
+    print("\nloadSheet 20000 rows: pandas " + format(times["pandas"], ".3f") + "s, stream " + format(times["stream"], ".3f") + "s")
+    assert results["stream"][:2] == results["pandas"][:2]
+    pandas.testing.assert_frame_equal(results["stream"][2], results["pandas"][2])
+    assert times["stream"] < times["pandas"]
+
+
+@pytest.mark.benchmark
+def test_all_sheets_benchmark(tmp_path, monkeypatch):
+    """Test that reading every sheet of a workbook opens it once and takes less time than opening it again for each sheet."""
+
+    workbookPath = tmp_path / "sheets.xlsx"
+    write_multiple_sheet_workbook(workbookPath, 16, 500)
+    monkeypatch.setattr(extract, "silent", True)
+    
+    openedWorkbooks = []
+    ExcelFile = pandas.ExcelFile
+    def counting_ExcelFile(*args, **kwargs):
+        openedWorkbooks.append(args[0])
+        return ExcelFile(*args, **kwargs)
+    monkeypatch.setattr(pandas, "ExcelFile", counting_ExcelFile)
+    
+    sheetAtATimeArgs = [(workbookPath.as_posix() + ":#export" + str(sheet), "#automate", True, "#modify", True, removeRegex) for sheet in range(16)]
+    allSheetsArgs = [(workbookPath.as_posix() + ":r'#export'", "#automate", True, "#modify", True, removeRegex, None, True)]
+    expected, _, _ = read_metadata_sources(sheetAtATimeArgs)
+    assert len(openedWorkbooks) == 16
+    openedWorkbooks.clear()
+    extraction, stderr, sheetTimings = read_metadata_sources(allSheetsArgs)
+    assert len(openedWorkbooks) == 1
+    assert extraction == expected
+    assert stderr == ""
+    assert len(sheetTimings) == 16
+    
+    times = {"sheet at a time" : [], "all sheets" : []}
+    for run in range(3):
+        for name, readMetadataArgs in [("sheet at a time", sheetAtATimeArgs), ("all sheets", allSheetsArgs)]:
+            start = time.perf_counter()
+            read_metadata_sources(readMetadataArgs)
+            times[name].append(time.perf_counter() - start)
+    
+    print("\nread 16 sheets of 500 rows: " + ", ".join(name + " " + format(min(runTimes), ".3f") + "s" for name, runTimes in times.items()))
+    assert min(times["all sheets"]) < min(times["sheet at a time"])
+
+
+@pytest.mark.benchmark
+def test_removeMatches_benchmark():
+    """Benchmark removing removeRegex with a literal prefilter against replacing a column at a time, which gives the same cells."""
+
+    rows = [["s" + str(row), "compound" + str(row) + ("_x0041_" if row % 100 == 0 else ""), str(row * 1.5), "uM", "", "a", "b", "c" + str(row), "d\r" if row % 50 == 0 else "d", "e"] for row in range(50000)]
+    cells = numpy.array(rows, dtype=object)
+
+    expected = cells.copy()
+    start = time.perf_counter()
+    for columnIndex in range(expected.shape[1]):
+        expected[:, columnIndex] = pandas.Series(expected[:, columnIndex], dtype=object).replace(removeRegex, "", regex=True).to_numpy(dtype=object)
+    replaceTime = time.perf_counter() - start
+
+    extract.TagParser.removeRegexCache.clear()
+    result = cells.copy()
+    start = time.perf_counter()
+    extract.TagParser._removeMatches(result, removeRegex)
+    removeTime = time.perf_counter() - start
+
+    print("\nremove regex 50000x10 cells: replace " + format(replaceTime, ".3f") + "s, prefiltered " + format(removeTime, ".3f") + "s")
+    assert (result == expected).all()
+    assert result[100, 1] == "compound100"
+    assert removeRegex in extract.TagParser.removeRegexCache
+    assert removeTime < replaceTime
+
+
+def generate_lineages_recursively(extraction: dict) -> dict:
+    """Generate lineages the way TagParser did before it had an id index, scanning every table for each parent and recursing."""
+    def findParent(parentID):
+        for tableKey, table in extraction.items():
+            if parentID in table:
+                return (tableKey, table[parentID])
+        return None
+
+    def generateLineage(parentID, parent2children):
+        if parentID in parent2children:
+            return {child : generateLineage(child, parent2children) for child in parent2children[parentID]}
+        return None
+
+    parent2children = collections.defaultdict(list)
+    terminalParentsByTable = collections.defaultdict(list)
+    for tableKey, table in extraction.items():
+        for entity in table.values():
+            if "parent_id" in entity:
+                parent = findParent(entity["parent_id"])
+                parent2children[entity["parent_id"]].append(entity["id"])
+                if parent is None:
+                    terminalParentsByTable[tableKey].append(entity["parent_id"])
+                elif "parent_id" not in parent[1]:
+                    terminalParentsByTable[parent[0]].append(entity["parent_id"])
+    return {tableKey : {parentID : generateLineage(parentID, parent2children) for parentID in parentIDs} for tableKey, parentIDs in terminalParentsByTable.items()}
+
+
+@pytest.mark.benchmark
+def test_lineages_deep_chain_benchmark():
+    """Test that a chain of records deeper than the recursion limit gets a lineage and that indexed lineage generation beats scanning every table."""
+
+    tagParser = extract.TagParser()
+    tagParser.extraction = make_lineage_extraction(50, 2000, 18)
+    chainLength = 5000
+    tagParser.extraction["chain"] = {"c0" : {"id" : "c0"}}
+    tagParser.extraction["chain"].update({"c" + str(index) : {"id" : "c" + str(index), "parent_id" : "c" + str(index - 1)} for index in range(1, chainLength)})
+
+    start = time.perf_counter()
+    lineages = tagParser.generateLineages()
+    output = io.StringIO()
+    extract.TagParser.printLineages(lineages, indentation=0, file=output)
+    indexedTime = time.perf_counter() - start
+
+    del tagParser.extraction["chain"]
+    start = time.perf_counter()
+    expected = generate_lineages_recursively(tagParser.extraction)
+    scanningTime = time.perf_counter() - start
+
+    print("\nlineages 100000 records: scanning " + format(scanningTime, ".3f") + "s, indexed with printing and a " + str(chainLength) + " deep chain " + format(indexedTime, ".3f") + "s")
+    depth = 0
+    lineage = lineages["chain"]["c0"]
+    while lineage:
+        depth += 1
+        lineage = lineage["c" + str(depth)]
+    assert depth == chainLength - 1
+    assert "\n" + " " * (2 * chainLength) + " c" + str(chainLength - 1) + "\n" in output.getvalue()
+    del lineages["chain"]
+    assert lineages == expected
+    assert indexedTime < scanningTime
+
+
+def compare_field_by_field(extraction: dict, otherMetadata: dict) -> str:
+    """Print the comparison the way TagParser did before it skipped equal tables and records, converting with float() and catching exceptions.
+    
+    Lists that differ are reported as different instead of raising a TypeError like TagParser used to.
+    """
+    def isComparable(value1, value2):
+        if value1 == value2:
+            return True
+        try:
+            value1 = float(value1)
+            value2 = float(value2)
+        except (ValueError, TypeError):
+            return False
+        return value1 == value2 or abs(value1 - value2) / max(abs(value1), abs(value2)) < 0.00000001
+
+    file = io.StringIO()
+    missingTables = [tableKey for tableKey in otherMetadata if tableKey not in extraction]
+    if missingTables:
+        print("Missing Tables:", " ".join(missingTables), file=file)
+    extraTables = [tableKey for tableKey in extraction if tableKey not in otherMetadata]
+    if extraTables:
+        print("Extra Tables:", " ".join(extraTables), file=file)
+    for tableKey, table in otherMetadata.items():
+        if tableKey in extraction:
+            for label, ids in [("missing", [idKey for idKey in table if idKey not in extraction[tableKey]]), ("extra", [idKey for idKey in extraction[tableKey] if idKey not in table])]:
+                if ids:
+                    print("Table", tableKey, "with " + label + " records:", file=file)
+                    while ids:
+                        print("  ", " ".join(ids[0:5]), file=file)
+                        ids = ids[5:]
+            for idKey, record in table.items():
+                if idKey in extraction[tableKey]:
+                    differentFields = [field for field, value in record.items() if field not in extraction[tableKey][idKey] or not isComparable(value, extraction[tableKey][idKey][field])]
+                    differentFields.extend([field for field in extraction[tableKey][idKey] if field not in record])
+                    if differentFields:
+                        print("Table", tableKey, "id", idKey, "with different fields:", ", ".join(differentFields), file=file)
+    return file.getvalue()
+
+
+def make_compare_extractions(numberOfRecords: int, seed: int) -> tuple[dict,dict]:
+    """Build an extraction and a copy of it with numbers rewritten, floats nudged within and beyond the compare tolerance, and some fields, records, and tables changed."""
+    random = numpy.random.default_rng(seed)
+    extraction = {"sample" : {}, "measurement" : {}, "protocol" : {"quench" : {"id" : "quench", "type" : "sample_prep"}}}
+    for index in range(numberOfRecords):
+        extraction["sample"]["s" + str(index)] = {"id" : "s" + str(index), "parent_id" : "p" + str(index % 10), "weight" : str(index * 1.5), "count" : str(index), "note" : "nan" if index % 11 == 0 else "sample note"}
+        extraction["measurement"]["m" + str(index)] = {"id" : "m" + str(index), "intensity" : str(index * 123.456), "compound" : "c" + str(index % 50), "tags" : ["a", "b" + str(index % 3)]}
+
+    other = copy.deepcopy(extraction)
+    for index in random.choice(numberOfRecords, size=numberOfRecords // 20, replace=False).tolist():
+        kind = index % 7
+        sample = other["sample"]["s" + str(index)]
+        measurement = other["measurement"]["m" + str(index)]
+        if kind == 0:
+            sample["count"] = str(index) + ".0"
+        elif kind == 1:
+            measurement["intensity"] = repr(float(measurement["intensity"]) * (1 + 1e-12))
+        elif kind == 2:
+            measurement["intensity"] = repr(float(measurement["intensity"]) * (1 + 1e-6) + 1)
+        elif kind == 3:
+            sample["note"] = "NaN"
+        elif kind == 4:
+            del sample["weight"]
+            measurement["extra"] = "x"
+        elif kind == 5:
+            del other["measurement"]["m" + str(index)]
+            other["measurement"]["n" + str(index)] = measurement
+        else:
+            measurement["tags"] = ["a", "c"]
+    other["extra_table"] = {"e" : {"id" : "e"}}
+    del other["protocol"]
+    return extraction, other
+
+
+@pytest.mark.benchmark
+def test_compare_benchmark():
+    """Test that comparing with table, record, and digest shortcuts takes less time than comparing every field."""
+
+    extraction, other = make_compare_extractions(100000, 19)
+    tagParser = extract.TagParser()
+    tagParser.extraction = extraction
+
+    start = time.perf_counter()
+    expected = compare_field_by_field(extraction, other)
+    fieldTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    report = io.StringIO()
+    tagParser.compare(other, file=report)
+    digestTime = time.perf_counter() - start
+
+    print("\ncompare 200000 records: field by field " + format(fieldTime, ".3f") + "s, with digests " + format(digestTime, ".3f") + "s")
+    assert report.getvalue() == expected
+    assert digestTime < fieldTime
+
+
+@pytest.mark.benchmark
+def test_writeExtraction_peak_memory(tmp_path):
+    """Test that streaming an extraction to a file peaks at a fraction of the memory of dumping the whole JSON string first."""
+
+    extraction = make_lineage_extraction(10, 2000, 7)
+    
+    tracemalloc.start()
+    try:
+        with open(tmp_path / "dumped.json", "w") as jsonFile:
+            jsonFile.write(json.dumps(extraction, sort_keys=True, indent=2, separators=(',', ': ')))
+        dumpPeak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        
+        with open(tmp_path / "streamed.json", "w") as jsonFile:
+            extract.writeExtraction(extraction, jsonFile)
+        streamPeak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    print("\nwrite 20000 records: json.dumps peak " + str(dumpPeak) + " bytes, streamed peak " + str(streamPeak) + " bytes")
+    assert (tmp_path / "dumped.json").read_bytes() == (tmp_path / "streamed.json").read_bytes()
+    assert streamPeak * 4 < dumpPeak
@@ -8,9 +8,16 @@ import copy
 import json
 import subprocess
 import re
+import io
+import contextlib
+import zipfile
+import collections
 
+import numpy
 import pandas
 
+from messes.extract import extract
+
 
 @pytest.fixture(scope="module", autouse=True)
 def change_cwd():
@@ -36,10 +43,6 @@ def delete_metadata():
 output_compare_path = pathlib.Path("output_compare.json")
 
 
-
-
-
-
 def test_child_without_parent_id():
     """Test that an error is printed when there is a child without a parent id."""
     
@@ -80,7 +83,6 @@ def test_list_field():
     assert output == ""
 
 
-
 def test_list_field_inline():
     """Test that list fields get pulled in correctly from inline."""
     
@@ -113,7 +115,6 @@ def test_list_field_inline():
     assert output == ""
 
 
-
 def test_attribute_field():
     """Test that attribute fields get pulled in correctly."""
     
@@ -136,8 +137,6 @@ def test_attribute_field():
     assert output == ""
 
 
-
-
 def test_child_tag():
     """Test that child tags work."""
     
@@ -207,7 +206,6 @@ def test_variable_operand_error():
     assert "variable_operand_test_error.xlsx:#export[C1]" in output
 
 
-
 def test_global_operand():
     """Test that global field functionality works."""
     
@@ -250,7 +248,6 @@ def test_global_operand_error():
     assert "global_field_test_error.xlsx:#export[A1]" in output 
 
 
-
 def test_csv_error():
     """Test that csv file type prints a different error than xlsx."""
     
@@ -286,7 +283,6 @@ def test_undefined_table_name_error():
     assert "undefined_table_name_error.xlsx:#export[A1]" in output 
 
 
-
 def test_child_in_first_column_error():
     """Test that error is printed when a child tag is in first column."""
     
@@ -630,7 +626,6 @@ def test_table_tag_without_assignment_no_word_error():
     assert "table_tag_without_assignment_no_word_error.xlsx:#export[C1]" in output
 
 
-
 def test_empty_child_error():
     """Test that error is printed when #%child is not followed by anything."""
     
@@ -702,7 +697,6 @@ def test_child_table_change_error():
     assert "child_table_change_error.xlsx:#export[C1]" in output
 
 
-
 def test_global_field_no_assignment_error():
     """Test that error is printed when the global field tag isn't an assignment."""
     
@@ -738,7 +732,6 @@ def test_global_field_not_literal_error():
     assert "global_field_not_literal_error.xlsx:#export[A1]" in output
 
 
-
 def test_duplicate_field_error():
     """Test that error is printed when there are duplicate fields."""
     
@@ -792,7 +785,6 @@ def test_bad_token_error():
     assert "bad_token_error.xlsx:#export[D1]" in output
 
 
-
 def test_child_id_no_assignment():
     """Test that when a child record is created with explicit id it works."""
     
@@ -814,7 +806,6 @@ def test_child_id_no_assignment():
     assert "2" in output_json["sample"]
 
 
-
 def test_child_without_id_error():
     """Test that error is printed when there is a child record with no id."""
     
@@ -860,8 +851,6 @@ def test_same_record_multiple_tables():
                                                                                                     ]
 
 
-
-
 def test_no_data_message_xlsx():
     """Test that a message is printed when there is no data in a worksheet."""
     
@@ -896,7 +885,6 @@ def test_no_data_message_Google_Sheets():
     assert "https://docs.google.com/spreadsheets/d/1_wGthpMlf_cnV15pGY2K_iqUEvy7rYwsqOSjQ5LTJG0/export?format=xlsx" in output
 
 
-
 def test_no_sheet_message_xlsx():
     """Test that a message is printed when the user input sheet name is not found."""
     
@@ -931,7 +919,6 @@ def test_no_sheet_message_Google_Sheets():
     assert 'https://docs.google.com/spreadsheets/d/1jDMQjFeyETsI_uBQ7v-K2F4w18U-l_HJ9v0EJ4Bm0bg/export?format=xlsx' in output
 
 
-
 def test_no_data_message_csv():
     """Test that a message is printed when there is no data in a csv file."""
     
@@ -1016,7 +1003,6 @@ def test_metadata_json_source():
     assert output == ""
 
 
-
 def test_field_concatenation():
     """Test that tags can be concated with a + sign."""
     
@@ -1038,7 +1024,6 @@ def test_field_concatenation():
     assert output == ""
 
 
-
 def test_second_table_specified():
     """Test that an exception is raised when a second table is on the same tag row specified."""
     
@@ -1056,3 +1041,701 @@ def test_second_table_specified():
     assert "second_table_error.xlsx:#export[C1]" in output
 
 
+testing_files = pathlib.Path(__file__).parent / "testing_files"
+removeRegex = "_x([0-9a-fA-F]{4})_|\r"
+
+
+def read_excel_twice(workbook: pandas.ExcelFile, sheetName: str) -> pandas.core.frame.DataFrame:
+    """The previous loadSheet implementation, which read each sheet once to find its columns and again to convert them."""
+    dataFrame = pandas.read_excel(workbook, sheetName, header=None, index_col=None)
+    converters = {column:str for column in dataFrame.columns}
+    return pandas.read_excel(workbook, sheetName, header=None, index_col=None, converters=converters)
+
+
+def write_large_workbook(workbookPath: pathlib.Path):
+    """Write a 20000 row sheet with string, number, bool, and NA cells to workbookPath."""
+    rows = [["#tags", "#sample.id", "#.value", "#.flag", "#.note"]]
+    rows += [["", "sample" + str(row), row if row % 3 else row * 1.5, row % 2 == 0, "NA" if row % 5 == 0 else ""] for row in range(20000)]
+    pandas.DataFrame(rows).to_excel(workbookPath, sheet_name="Sheet1", header=False, index=False, engine="openpyxl")
+
+
+def test_readExcelSheet_matches_double_read(tmp_path):
+    """Test that loading a sheet in a single read gives the same DataFrame as reading it twice."""
+    
+    workbookPath = tmp_path / "large.xlsx"
+    write_large_workbook(workbookPath)
+    
+    workbook = pandas.ExcelFile(workbookPath)
+    pandas.testing.assert_frame_equal(extract.TagParser._readExcelSheet(workbook, "Sheet1"), read_excel_twice(workbook, "Sheet1"))
+    
+    streamReader = extract.XlsxStreamReader(workbookPath.as_posix())
+    pandas.testing.assert_frame_equal(extract.TagParser._readExcelSheet(streamReader, "Sheet1"), read_excel_twice(workbook, "Sheet1"))
+    streamReader.close()
+
+
+def test_readExcelSheet_without_pandas_reader(tmp_path, monkeypatch):
+    """Test that sheets are read twice with read_excel when pandas doesn't have the reader methods or TextParser."""
+    
+    workbookPath = tmp_path / "large.xlsx"
+    write_large_workbook(workbookPath)
+    workbook = pandas.ExcelFile(workbookPath)
+    expected = read_excel_twice(workbook, "Sheet1")
+    
+    monkeypatch.setattr(extract.TagParser, "_readRawExcelSheet", staticmethod(lambda workbook, sheetName: None))
+    pandas.testing.assert_frame_equal(extract.TagParser._readExcelSheet(workbook, "Sheet1"), expected)
+    monkeypatch.undo()
+    
+    monkeypatch.delattr(pandas.io.parsers, "TextParser")
+    pandas.testing.assert_frame_equal(extract.TagParser._readExcelSheet(workbook, "Sheet1"), expected)
+    streamReader = extract.XlsxStreamReader(workbookPath.as_posix())
+    pandas.testing.assert_frame_equal(extract.TagParser._readExcelSheet(streamReader, "Sheet1"), expected)
+    streamReader.close()
+
+
+def test_readMetadata_opens_workbook_once(monkeypatch):
+    """Test that the automation, modification, and export sheets of one workbook share a single opened workbook that is evicted afterwards."""
+
+    extract.TagParser.evictWorkbooks()
+    openedWorkbooks = []
+    ExcelFile = pandas.ExcelFile
+    def countingExcelFile(*args, **kwargs):
+        openedWorkbooks.append(args[0])
+        return ExcelFile(*args, **kwargs)
+    monkeypatch.setattr(pandas, "ExcelFile", countingExcelFile)
+
+    test_file = (testing_files / "base_source.xlsx").as_posix()
+    tagParser = extract.TagParser()
+    with contextlib.redirect_stderr(io.StringIO()):
+        tagParser.readMetadata(test_file, "#automate", False, "#modify", False, removeRegex)
+
+    assert openedWorkbooks == [test_file]
+    assert tagParser.extraction
+    assert extract.TagParser.workbookCache == {}
+
+
+def make_tag_group_sheet(numberOfGroups: int) -> pandas.core.frame.DataFrame:
+    """Build a sheet of numberOfGroups tag groups of 0 to 2 rows, some ignored rows, and blank rows after every other group."""
+    rows = []
+    for group in range(numberOfGroups):
+        rows.append(["#tags", "#sample.id", "#.value"])
+        rows += [["#ignore" if group % 7 == 0 and row == 1 else "", "s" + str(group) + "-" + str(row), str(row)] for row in range(group % 3)]
+        if group % 2:
+            rows.append(["", "", ""])
+    return pandas.DataFrame(rows)
+
+
+def test_tag_groups():
+    """Test that tag groups end at the next blank or #tags row, or at the end of the sheet, and that a sheet of 5000 tag groups is parsed."""
+
+    ## Header rows are at 0, 1, 4, 7, 9, 11, 15, and 16, blank rows at 3, 8, 14, and 18.
+    assert extract.TagParser._findTagGroups(make_tag_group_sheet(8)) == ([0, 1, 4, 7, 9, 11, 15, 16], [1, 3, 7, 8, 11, 14, 16, 18])
+    ## The last tag group runs to the end of the sheet.
+    assert extract.TagParser._findTagGroups(make_tag_group_sheet(3)) == ([0, 1, 4], [1, 3, 7])
+    assert extract.TagParser._findTagGroups(pandas.DataFrame([["", "a"], ["", ""]])) == ([], [])
+
+    tagParser = extract.TagParser()
+    with contextlib.redirect_stderr(io.StringIO()):
+        tagParser.parseSheet("benchmark.xlsx", "Sheet1", make_tag_group_sheet(5000))
+    assert len(tagParser.extraction["sample"]) == sum(group % 3 - (group % 7 == 0 and group % 3 == 2) for group in range(5000))
+    assert "s13-0" in tagParser.extraction["sample"]
+    assert "s14-0" in tagParser.extraction["sample"] and "s14-1" not in tagParser.extraction["sample"]
+
+
+def make_sample_sheet(numberOfRows: int) -> pandas.core.frame.DataFrame:
+    """Build a single sample tag group of numberOfRows rows with a list field and child protocol ids."""
+    header = ["#tags", "#sample.id", "#sample.name", "#sample.value", "*#sample.list", "#.units", "#.protocol.id", "#.note"]
+    rows = [["", "s" + str(row), "name" + str(row), str(row * 1.5), "a;b;c" if row % 2 else "x,y", "uM", "p" + str(row % 50), "note"] for row in range(numberOfRows)]
+    return pandas.DataFrame([header] + rows)
+
+
+def parse_rows_with(worksheet: pandas.core.frame.DataFrame, rowType: str) -> tuple[dict,float]:
+    """Parse the rows of a single tag group worksheet one at a time as pandas Series or object ndarrays and return the extraction and time taken."""
+    worksheetArray = worksheet.to_numpy(dtype=object)
+    rowGetter = (lambda index: worksheet.iloc[index, :]) if rowType == "series" else (lambda index: worksheetArray[index])
+    tagParser = extract.TagParser()
+    tagParser.parseSheet("benchmark.xlsx", "Sheet1", worksheet.iloc[:1, :])
+    recordMakers = tagParser._parseHeaderRow(rowGetter(0))
+    start = time.perf_counter()
+    for index in range(1, worksheet.shape[0]):
+        tagParser._parseRow(recordMakers, rowGetter(index))
+    return tagParser.extraction, time.perf_counter() - start
+
+
+def test_parseRow_ndarray_rows_match_series():
+    """Test that parsing rows as object ndarrays gives the same records as parsing them as pandas Series."""
+
+    worksheet = make_sample_sheet(2000)
+    seriesExtraction = parse_rows_with(worksheet, "series")[0]
+    ndarrayExtraction = parse_rows_with(worksheet, "ndarray")[0]
+
+    assert seriesExtraction == ndarrayExtraction
+    assert ndarrayExtraction["sample"]["s1"]["list"] == ["a", "b", "c"]
+
+
+def read_metadata_output(test_file: str) -> tuple:
+    """Run readMetadata on test_file and return the extraction, or the error raised, with its output."""
+    tagParser = extract.TagParser()
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            tagParser.readMetadata(test_file, "#automate", False, "#modify", False, removeRegex)
+            result = tagParser.extraction
+        except (Exception, SystemExit) as error:
+            result = repr(error)
+    return result, stdout.getvalue(), stderr.getvalue()
+
+
+def test_testing_files_match_expected_outputs():
+    """Test that every testing workbook gives the extraction, or error, and the output in testing_files_outputs_compare.json.
+    
+    Tag groups are parsed column by column, and consecutive tag groups under the same header row as segments, so this 
+    checks both against the output the workbooks gave when tag groups were parsed one row, and one tag group, at a time.
+    """
+
+    with open(pathlib.Path("testing_files_outputs_compare.json"), "r") as f:
+        expected = json.loads(f.read())
+    test_files = sorted("../" + path.name for path in testing_files.glob("*.xlsx"))
+    assert sorted(expected) == test_files
+
+    for test_file in test_files:
+        result, stdout, stderr = read_metadata_output(test_file)
+        assert {"result" : json.loads(json.dumps(result)), "stdout" : stdout, "stderr" : stderr} == expected[test_file], test_file
+
+
+def test_header_row_cache():
+    """Test that repeated header rows are parsed once, give independent RecordMakers, and that tracking header rows are not cached."""
+
+    extract.TagParser.clearHeaderRowCache()
+    header = numpy.array(["#tags", "#sample.id", "#.name", "#.value=\"x\"+#.name", "*#.tags", "#%child.id"], dtype=object)
+    rows = numpy.array([["", "s" + str(row), "n" + str(row), "", "a,b", "c" + str(row)] for row in range(3)], dtype=object)
+
+    extractions = []
+    for sheet in range(200):
+        tagParser = extract.TagParser()
+        tagParser.fileName, tagParser.sheetName, tagParser.rowIndex = "benchmark.xlsx", "Sheet" + str(sheet), 0
+        recordMakers = tagParser._parseHeaderRow(header)
+        recordMakers[0].fieldMakers.pop()
+        recordMakers[0].fieldMakers[0].operands.append(extract.LiteralOperand("changed"))
+        recordMakers[0].fieldMakers[1].field = "changed"
+        recordMakers = tagParser._parseHeaderRow(header)
+        assert (tagParser.lastTable, tagParser.lastField) == ("sample", "id")
+        tagParser._parseRows(recordMakers, rows)
+        extractions.append(tagParser.extraction)
+
+    assert extract.TagParser.headerRowCacheHits == 399
+    assert extract.TagParser.headerRowCacheMisses == 1
+    assert all(extraction == extractions[0] for extraction in extractions)
+    assert extractions[0]["sample"]["s1"] == {"id" : "s1", "name" : "n1", "value" : "xn1", "tags" : ["a", "b"]}
+    assert extractions[0]["sample"]["c1"] == {"parent_id" : "s1", "id" : "c1"}
+
+    trackingHeader = numpy.array(["#tags", "#sample.id", "#%untrack=sample.name"], dtype=object)
+    for repeat in range(2):
+        tagParser.tablesAndFieldsToTrack, tagParser.trackedFieldsDict = {"sample" : {"name"}}, {"sample.name" : ""}
+        tagParser._parseHeaderRow(trackingHeader)
+        assert tagParser.tablesAndFieldsToTrack == {} and tagParser.trackedFieldsDict == {}
+    assert len(extract.TagParser.headerRowCache) == 1
+    assert extract.TagParser.headerRowCacheMisses == 1
+    extract.TagParser.clearHeaderRowCache()
+    assert extract.TagParser.headerRowCache == {}
+
+
+def test_header_row_cache_keeps_most_recently_used(monkeypatch):
+    """Test that the header row cache only keeps the most recently used header rows."""
+
+    extract.TagParser.clearHeaderRowCache()
+    monkeypatch.setattr(extract.TagParser, "headerRowCacheSize", 2)
+    headers = [numpy.array(["#tags", "#sample.id", "#.field" + str(number)], dtype=object) for number in range(3)]
+    tagParser = extract.TagParser()
+    tagParser.fileName, tagParser.sheetName, tagParser.rowIndex = "benchmark.xlsx", "Sheet1", 0
+    for header in [headers[0], headers[1], headers[0], headers[2]]:
+        tagParser._parseHeaderRow(header)
+
+    assert list(extract.TagParser.headerRowCache) == [("#tags", "#sample.id", "#.field0"), ("#tags", "#sample.id", "#.field2")]
+    assert (extract.TagParser.headerRowCacheHits, extract.TagParser.headerRowCacheMisses) == (1, 3)
+    extract.TagParser.clearHeaderRowCache()
+
+
+def write_handmade_xlsx(path: pathlib.Path):
+    """Write an xlsx file by hand with inline and rich text strings, errors, booleans, missing cells and rows, and a date cell."""
+    main = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    relationships = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    parts = {
+        "[Content_Types].xml" : '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet2.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/></Types>',
+        "_rels/.rels" : '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="' + relationships + '/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+        "xl/workbook.xml" : '<?xml version="1.0" encoding="UTF-8"?><workbook xmlns="' + main + '" xmlns:r="' + relationships + '"><sheets>'
+            '<sheet name="#export" sheetId="1" r:id="rId2"/><sheet name="dates" sheetId="2" r:id="rId1"/></sheets></workbook>',
+        "xl/_rels/workbook.xml.rels" : '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="' + relationships + '/worksheet" Target="worksheets/sheet2.xml"/>'
+            '<Relationship Id="rId2" Type="' + relationships + '/worksheet" Target="/xl/worksheets/sheet1.xml"/>'
+            '<Relationship Id="rId3" Type="' + relationships + '/sharedStrings" Target="sharedStrings.xml"/>'
+            '<Relationship Id="rId4" Type="' + relationships + '/styles" Target="styles.xml"/></Relationships>',
+        "xl/styles.xml" : '<?xml version="1.0" encoding="UTF-8"?><styleSheet xmlns="' + main + '"><numFmts count="1"><numFmt numFmtId="164" formatCode="0.000"/></numFmts>'
+            '<fonts count="1"><font/></fonts><fills count="1"><fill><patternFill patternType="none"/></fill></fills><borders count="1"><border/></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs></styleSheet>',
+        "xl/sharedStrings.xml" : '<?xml version="1.0" encoding="UTF-8"?><sst xmlns="' + main + '">'
+            '<si><t>#tags</t></si><si><t xml:space="preserve"> #sample.id </t></si><si><r><t>rich</t></r><r><t xml:space="preserve"> text</t></r><rPh sb="0" eb="1"><t>phonetic</t></rPh></si>'
+            '<si><t>a_x005F_x0041_b</t></si><si><t/></si></sst>',
+        "xl/worksheets/sheet1.xml" : '<?xml version="1.0" encoding="UTF-8"?><worksheet xmlns="' + main + '"><sheetData>'
+            '<row r="2"><c r="A2" t="s"><v>0</v></c><c r="B2" t="s"><v>1</v></c><c r="D2" t="inlineStr"><is><t>#.note</t></is></c><c r="F2" s="1"/></row>'
+            '<row r="3"><c r="B3" t="s"><v>2</v></c><c t="n" s="1"><v>1.0</v></c><c><v>2E3</v></c><c r="E3" t="b"><v>1</v></c><c r="F3" t="e"><v>#DIV/0!</v></c></row>'
+            '<row><c r="B4" t="s"><v>3</v></c><c r="C4"><v>0.25</v></c><c r="D4" t="str"><v>formula</v></c><c r="E4" t="inlineStr"><is><r><t>in</t></r><r><t>line</t></r></is></c></row>'
+            '<row r="6"><c r="B6" t="s"><v>4</v></c><c r="C6" t="inlineStr"/><c r="D6" t="str"><v>NA</v></c></row>'
+            '<row r="7"><c r="A7" s="1"/></row></sheetData></worksheet>',
+        "xl/worksheets/sheet2.xml" : '<?xml version="1.0" encoding="UTF-8"?><worksheet xmlns="' + main + '"><sheetData>'
+            '<row r="1"><c r="A1" t="inlineStr"><is><t>date</t></is></c><c r="B1" s="2"><v>43831</v></c></row></sheetData></worksheet>'}
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, content in parts.items():
+            archive.writestr(name, content)
+
+
+def test_xlsx_stream_reader_matches_pandas(tmp_path):
+    """Test that streaming a sheet gives the same DataFrame as reading it with pandas for every testing workbook and a handmade one."""
+
+    handmadePath = tmp_path / "handmade.xlsx"
+    write_handmade_xlsx(handmadePath)
+    workbookPaths = [handmadePath] + [path for path in sorted(testing_files.glob("*.xls[xm]")) if not path.name.startswith("~$")]
+
+    numberOfSheets = 0
+    for workbookPath in workbookPaths:
+        workbook = pandas.ExcelFile(workbookPath)
+        streamReader = extract.XlsxStreamReader(workbookPath.as_posix())
+        assert streamReader.sheet_names == workbook.sheet_names
+        for sheetName in workbook.sheet_names:
+            pandas.testing.assert_frame_equal(extract.TagParser._readExcelSheet(streamReader, sheetName), extract.TagParser._readExcelSheet(workbook, sheetName))
+            numberOfSheets += 1
+        streamReader.close()
+        workbook.close()
+    assert numberOfSheets > 300
+
+    streamReader = extract.XlsxStreamReader(handmadePath.as_posix())
+    assert streamReader.sheet_names == ["#export", "dates"]
+    assert streamReader._streamSheetData("#export")[2] == ["", "rich text", "1", "2000", "True", "nan"]
+    assert streamReader._streamSheetData("dates") is None
+    assert streamReader.pandasWorkbook is None
+    assert streamReader.readSheetData("dates") == [["date", pandas.Timestamp(2020, 1, 1).to_pydatetime()]]
+    assert streamReader.pandasWorkbook is not None
+    streamReader.close()
+
+
+@pytest.mark.parametrize("pattern", [removeRegex, r"^a", r"a$", r"\bab", r"(?i)AB", r"a(?i:b)c", r"(ab|cd)+e", r"x*", r"\s+", r"(?:ab)?c", r"b(?=c)", r"(ab|)c", "a\0b"])
+def test_removeMatches_matches_replace(pattern):
+    """Test that removing a regular expression from cells gives the same cells as DataFrame.replace."""
+
+    random = numpy.random.default_rng(17)
+    alphabet = list("abcdeABx_0F\r \0")
+    values = ["".join(random.choice(alphabet, size=random.integers(0, 9))) for _ in range(3000)]
+    cells = numpy.array(values, dtype=object).reshape(-1, 3)
+    expected = pandas.DataFrame(cells).replace(pattern, "", regex=True).to_numpy(dtype=object)
+
+    for layout in [numpy.ascontiguousarray, numpy.asfortranarray]:
+        result = layout(cells.copy())
+        extract.TagParser._removeMatches(result, pattern)
+        assert (result == expected).all()
+
+
+def test_cleanCells_matches_replace_on_testing_files():
+    """Test that cleaning every testing sheet gives the same cells as DataFrame.replace."""
+
+    numberOfSheets = 0
+    for workbookPath in sorted(testing_files.glob("*.xls[xm]")):
+        if workbookPath.name.startswith("~$"):
+            continue
+        workbook = pandas.ExcelFile(workbookPath)
+        for sheetName in workbook.sheet_names:
+            dataFrame = extract.TagParser._readExcelSheet(workbook, sheetName)
+            expected = dataFrame.fillna("").replace(removeRegex, "", regex=True)
+            pandas.testing.assert_frame_equal(extract.TagParser._cleanCells(dataFrame, removeRegex), expected, check_dtype=False)
+            numberOfSheets += 1
+        workbook.close()
+    assert numberOfSheets > 300
+
+
+def make_lineage_extraction(numberOfTables: int, recordsPerTable: int, seed: int) -> dict:
+    """Build an extraction whose records have parents in earlier tables or earlier in the same table, some of them missing."""
+    random = numpy.random.default_rng(seed)
+    extraction = {}
+    for tableIndex in range(numberOfTables):
+        table = extraction["table" + str(tableIndex)] = {}
+        for recordIndex in range(recordsPerTable):
+            record = {"id" : "t" + str(tableIndex) + "-" + str(recordIndex)}
+            choice = random.integers(0, 4)
+            if choice == 1 and recordIndex > 0:
+                record["parent_id"] = "t" + str(tableIndex) + "-" + str(random.integers(0, recordIndex))
+            elif choice == 2 and tableIndex > 0:
+                record["parent_id"] = "t" + str(random.integers(0, tableIndex)) + "-" + str(random.integers(0, recordsPerTable))
+            elif choice == 3:
+                record["parent_id"] = "missing" + str(tableIndex) + "-" + str(random.integers(0, 10))
+            table[record["id"]] = record
+    return extraction
+
+
+def test_lineages():
+    """Test that lineages start at records without a parent or with a missing parent and are printed with terminal children in groups."""
+
+    tagParser = extract.TagParser()
+    tagParser.extraction = {"project" : {"p1" : {"id" : "p1"}}, 
+                            "sample" : {"s1" : {"id" : "s1", "parent_id" : "p1"}, "s2" : {"id" : "s2", "parent_id" : "p1"}, 
+                                        "s3" : {"id" : "s3", "parent_id" : "s1"}, "s4" : {"id" : "s4", "parent_id" : "missing"}}, 
+                            "measurement" : {"m" + str(index) : {"id" : "m" + str(index), "parent_id" : "s3" if index < 8 else "s2"} for index in range(1, 9)}}
+    lineages = tagParser.generateLineages()
+    assert lineages == {"project" : {"p1" : {"s1" : {"s3" : {"m" + str(index) : None for index in range(1, 8)}}, "s2" : {"m8" : None}}}, 
+                        "sample" : {"missing" : {"s4" : None}}}
+
+    result = io.StringIO()
+    extract.TagParser.printLineages(lineages, indentation=0, file=result, bufferSize=10)
+    assert result.getvalue() == " project :\n" + \
+                                "   p1 :\n" + \
+                                "     s1 :\n" + \
+                                "       s3 :\n" + \
+                                "         m1, m2, m3, m4, m5\n" + \
+                                "         m6, m7\n" + \
+                                "     s2 :\n" + \
+                                "       m8\n" + \
+                                " sample :\n" + \
+                                "   missing :\n" + \
+                                "     s4\n"
+
+    assert tagParser.findParent("s1") == ("sample", tagParser.extraction["sample"]["s1"])
+    tagParser.deleteMetadata([["sample"]])
+    assert tagParser.findParent("s1") is None
+    tagParser.merge({"sample" : {"s1" : {"id" : "s1"}}})
+    assert tagParser.findParent("s1") == ("sample", {"id" : "s1"})
+
+
+def test_lineages_deeper_than_recursion_limit():
+    """Test that a chain of records deeper than the recursion limit gets a lineage and is printed."""
+
+    tagParser = extract.TagParser()
+    chainLength = 5000
+    tagParser.extraction = {"chain" : {"c0" : {"id" : "c0"}}}
+    tagParser.extraction["chain"].update({"c" + str(index) : {"id" : "c" + str(index), "parent_id" : "c" + str(index - 1)} for index in range(1, chainLength)})
+
+    lineages = tagParser.generateLineages()
+    output = io.StringIO()
+    extract.TagParser.printLineages(lineages, indentation=0, file=output)
+
+    depth = 0
+    lineage = lineages["chain"]["c0"]
+    while lineage:
+        depth += 1
+        lineage = lineage["c" + str(depth)]
+    assert depth == chainLength - 1
+    assert "\n" + " " * (2 * chainLength) + " c" + str(chainLength - 1) + "\n" in output.getvalue()
+
+
+def test_compare():
+    """Test that compare reports missing and extra tables and records and different fields, ignoring numbers that only differ in how they are written."""
+
+    extraction = {"sample" : {"s1" : {"id" : "s1", "count" : "1"}, "s2" : {"id" : "s2", "note" : "nan"}, "s3" : {"id" : "s3", "weight" : "4.5"}}, 
+                  "measurement" : {"m" + str(index) : {"id" : "m" + str(index), "intensity" : str(index * 123.456), "tags" : ["a", "b"]} for index in range(1, 8)}, 
+                  "protocol" : {"quench" : {"id" : "quench"}}}
+    other = copy.deepcopy(extraction)
+    other["sample"]["s1"]["count"] = "1.0"
+    other["sample"]["s2"]["note"] = "NaN"
+    del other["sample"]["s3"]["weight"]
+    other["sample"]["s3"]["extra"] = "x"
+    other["measurement"]["m1"]["intensity"] = "123.45600000012347"
+    other["measurement"]["m2"]["intensity"] = "246.91224691199997"
+    other["measurement"]["m3"]["tags"] = ["a", "c"]
+    for index in range(4, 8):
+        other["measurement"]["n" + str(index)] = other["measurement"].pop("m" + str(index))
+    other["extra_table"] = {"e" : {"id" : "e"}}
+    del other["protocol"]
+    tagParser = extract.TagParser()
+    tagParser.extraction = extraction
+
+    report = io.StringIO()
+    jsonDiff = io.StringIO()
+    assert tagParser.compare(other, groupSize=3, file=report, diffFile=jsonDiff)
+    assert report.getvalue() == "Missing Tables: extra_table\n" + \
+                                "Extra Tables: protocol\n" + \
+                                "Table sample id s2 with different fields: note\n" + \
+                                "Table sample id s3 with different fields: extra, weight\n" + \
+                                "Table measurement with missing records:\n" + \
+                                "   n4 n5 n6\n" + \
+                                "   n7\n" + \
+                                "Table measurement with extra records:\n" + \
+                                "   m4 m5 m6\n" + \
+                                "   m7\n" + \
+                                "Table measurement id m2 with different fields: intensity\n" + \
+                                "Table measurement id m3 with different fields: tags\n"
+
+    differences = json.loads(jsonDiff.getvalue())
+    assert differences == [{"type" : "missing_tables", "tables" : ["extra_table"]}, 
+                           {"type" : "extra_tables", "tables" : ["protocol"]}, 
+                           {"type" : "different_fields", "table" : "sample", "id" : "s2", "fields" : ["note"]}, 
+                           {"type" : "different_fields", "table" : "sample", "id" : "s3", "fields" : ["extra", "weight"]}, 
+                           {"type" : "missing_records", "table" : "measurement", "ids" : ["n4", "n5", "n6", "n7"]}, 
+                           {"type" : "extra_records", "table" : "measurement", "ids" : ["m4", "m5", "m6", "m7"]}, 
+                           {"type" : "different_fields", "table" : "measurement", "id" : "m2", "fields" : ["intensity"]}, 
+                           {"type" : "different_fields", "table" : "measurement", "id" : "m3", "fields" : ["tags"]}]
+    ndjsonDiff = io.StringIO()
+    assert tagParser.compare(other, file=None, diffFile=ndjsonDiff, diffFormat="ndjson")
+    assert differences == [json.loads(line) for line in ndjsonDiff.getvalue().splitlines()]
+    assert differences == list(tagParser.differences(other))
+
+    assert tagParser.compare(other, file=None)
+    assert not tagParser.compare(copy.deepcopy(extraction), file=None)
+    emptyDiff = io.StringIO()
+    assert not tagParser.compare(copy.deepcopy(extraction), file=None, diffFile=emptyDiff)
+    assert json.loads(emptyDiff.getvalue()) == []
+
+
+def test_recordDigest_is_numeric_tolerant():
+    """Test that record digests are the same for numbers written differently and different for values compare would find different."""
+
+    digest = extract.TagParser.recordDigest
+    assert digest({"id" : "a", "x" : "1", "y" : "2.50"}) == digest({"y" : "2.5e0", "id" : "a", "x" : "1.0"})
+    assert digest({"id" : "a", "x" : "1"}) == digest({"id" : "a", "x" : 1})
+    assert digest({"id" : "a", "x" : "1"}) != digest({"id" : "a", "x" : "1.0000001"})
+    assert digest({"id" : "a", "x" : "nan"}) != digest({"id" : "a", "x" : "NaN"})
+    assert digest({"id" : "a", "x" : ["1"]}) != digest({"id" : "a", "x" : ["1.0"]})
+    assert digest({"id" : "a"}) != digest({"id" : "a", "x" : ""})
+    assert digest({"id" : "a", "x" : float("nan")}) is None
+    for value in ["1_000", " 2 ", "inf", "-Infinity", "1e5", ".5", "5.", "abc", "1e", "", "٣"]:
+        try:
+            number = float(value)
+        except ValueError:
+            number = None
+        assert extract.TagParser._toFloat(value) == number or (number != number)
+
+
+@pytest.mark.parametrize("outputFormat, dumpOptions", [
+        ("pretty", {"sort_keys" : True, "indent" : 2, "separators" : (',', ': ')}),
+        ("compact", {"sort_keys" : True, "separators" : (',', ':')}),
+        ])
+def test_writeExtraction_matches_json_dumps(outputFormat, dumpOptions):
+    """Test that writing an extraction a record at a time gives the same text as json.dumps on the testing files and edge cases."""
+
+    extractions = [{}, {"empty" : {}}, {"b" : {"x" : {}}, "a" : {"y" : {"z" : ["1", "2"], "q" : "é\n\"", "n" : {"k" : "v"}}}}, {"t" : ["notadict"], "u" : {"r" : "scalar"}}]
+    for jsonPath in sorted(testing_files.rglob("*.json")):
+        try:
+            with open(jsonPath, "r") as jsonFile:
+                extraction = json.load(jsonFile)
+        except (ValueError, UnicodeDecodeError):
+            continue
+        if isinstance(extraction, dict):
+            extractions.append(extraction)
+    assert len(extractions) > 10
+
+    for extraction in extractions:
+        output = io.StringIO()
+        extract.writeExtraction(extraction, output, outputFormat)
+        assert output.getvalue() == json.dumps(extraction, **dumpOptions)
+
+
+def test_writeExtraction_ndjson():
+    """Test that NDJSON output has one sorted line per record that reads back into the extraction."""
+
+    extraction = make_lineage_extraction(3, 50, 5)
+    output = io.StringIO()
+    extract.writeExtraction(extraction, output, "ndjson")
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    assert len(lines) == 150
+    assert [(line["table"], line["id"]) for line in lines] == sorted((table, recordID) for table in extraction for recordID in extraction[table])
+    readBack = collections.defaultdict(dict)
+    for line in lines:
+        readBack[line["table"]][line["id"]] = line["record"]
+    assert readBack == extraction
+
+
+def test_writeExtraction_ndjson_non_dict_tables():
+    """Test that NDJSON output writes a table that isn't a dictionary as a single value line instead of raising."""
+
+    extraction = {"t" : ["notadict"], "u" : {"r" : {"id" : "r"}}, "v" : "scalar", "w" : {}}
+    output = io.StringIO()
+    extract.writeExtraction(extraction, output, "ndjson")
+
+    assert [json.loads(line) for line in output.getvalue().splitlines()] == [{"table" : "t", "value" : ["notadict"]},
+                                                                              {"table" : "u", "id" : "r", "record" : {"id" : "r"}},
+                                                                              {"table" : "v", "value" : "scalar"}]
+
+
+def test_addRecord_does_not_change_shared_lists():
+    """Test that merging into a list field that is shared with another record leaves the other record's list alone."""
+
+    tagParser = extract.TagParser()
+    tagParser.extraction = {"sample" : {}}
+    sharedList = ["x", "y"]
+    tagParser._addRecord("sample", {"id" : "s1", "tags" : sharedList, "name" : "a"})
+    tagParser._addRecord("sample", {"id" : "s2", "tags" : sharedList, "name" : "b"})
+    for name in ["a", "c", "d"]:
+        tagParser._addRecord("sample", {"id" : "s1", "tags" : ["z"], "name" : name})
+
+    assert sharedList == ["x", "y"]
+    assert tagParser.extraction["sample"]["s2"] == {"id" : "s2", "tags" : ["x", "y"], "name" : "b"}
+    assert tagParser.extraction["sample"]["s1"] == {"id" : "s1", "tags" : ["x", "y", "z", "z", "z"], "name" : ["a", "c", "d"]}
+
+
+def test_addRecord_merged_list_aliasing():
+    """Test that a tracked list shared by records stays shared and unchanged, while a merged record gets its own list that later sheets don't change in place."""
+
+    rows = [["#tags", "#sample%track=project.tags", ""], [""] * 3, 
+            ["#tags", "#project.id", "*#.tags"], ["", "P1", "x,y"], [""] * 3, 
+            ["#tags", "#sample.id", ""], ["", "s1", ""], ["", "s2", ""], [""] * 3, 
+            ["#tags", "#project.id", "*#.tags"], ["", "P2", "z"], [""] * 3, 
+            ["#tags", "#sample.id", ""], ["", "s1", ""], ["", "s1", ""]]
+    tagParser = extract.TagParser()
+    tagParser.parseSheet("aliasing.xlsx", "Sheet1", pandas.DataFrame(rows))
+    projects = tagParser.extraction["project"]
+    samples = tagParser.extraction["sample"]
+
+    assert samples["s2"]["project.tags"] is projects["P1"]["tags"]
+    assert projects["P1"]["tags"] == ["x", "y"]
+    assert samples["s1"]["project.tags"] == ["x", "y", "z", "z"]
+    assert samples["s1"]["project.tags"] is not projects["P1"]["tags"]
+    assert samples["s1"]["project.tags"] is not projects["P2"]["tags"]
+
+    mergedList = samples["s1"]["project.tags"]
+    tagParser.parseSheet("aliasing.xlsx", "Sheet2", pandas.DataFrame([["#tags", "#sample.id"], ["", "s1"]]))
+    assert mergedList == ["x", "y", "z", "z"]
+    assert samples["s1"]["project.tags"] == ["x", "y", "z", "z", "z"]
+
+
+def make_tracking_sheet(numberOfRows: int) -> pandas.core.frame.DataFrame:
+    """Build a worksheet that tracks 4 project fields into samples and sample ids into measurements, with numberOfRows samples and measurements."""
+    rows = [["#tags", "#sample%track=project.id", "#sample%track=project.id%number", "#sample%track=project.name", "#sample%track=project.lead", "#measurement%track=sample.id"], 
+            [""] * 6, 
+            ["#tags", "#project.id", "#.id%number", "#.name", "#.lead", ""], 
+            ["", "Project1", "1", "Project One", "Lead", ""], 
+            [""] * 6, 
+            ["#tags", "#sample.id", "#.name", "", "", ""]]
+    rows += [["", "s" + str(row), "name" + str(row), "", "", ""] for row in range(numberOfRows)]
+    rows += [[""] * 6, ["#tags", "#measurement.id", "#.intensity", "#.sample.id", "", ""]]
+    rows += [["", "m" + str(row), str(row * 1.5), "s" + str(row // 10) if row % 100 == 0 else "", "", ""] for row in range(numberOfRows)]
+    rows += [[""] * 6, ["#tags", "#sample%untrack=project.id%number", "", "", "", ""], [""] * 6, ["#tags", "#sample.id", "", "", "", ""], ["", "last", "", "", "", ""]]
+    return pandas.DataFrame(rows)
+
+
+def test_tracking_slots():
+    """Test that tracked fields are copied into later records and untracked fields stop being copied."""
+
+    tagParser = extract.TagParser()
+    tagParser.parseSheet("benchmark.xlsx", "Sheet1", make_tracking_sheet(300))
+    extraction = tagParser.extraction
+    samples, measurements = extraction["sample"], extraction["measurement"]
+
+    assert extraction["project"] == {"Project1" : {"id" : "Project1", "id%number" : "1", "name" : "Project One", "lead" : "Lead"}}
+    assert len(samples) == 301 and len(measurements) == 300
+    assert samples["s0"] == {"id" : "s0", "name" : "name0", "project.id" : "Project1", "project.id%number" : "1", "project.name" : "Project One", "project.lead" : "Lead"}
+    assert samples["s4"] == {"id" : "s4", "name" : "name4", "project.id" : "Project1", "project.id%number" : "1", "project.name" : "Project One", "project.lead" : "Lead"}
+    assert samples["s299"] == {"id" : "s299", "name" : "name299", "project.id" : "Project1", "project.id%number" : "1", "project.name" : "Project One", "project.lead" : "Lead"}
+    assert samples["last"] == {"id" : "last", "project.id" : "Project1", "project.name" : "Project One", "project.lead" : "Lead"}
+    assert measurements["m0"] == {"id" : "m0", "intensity" : "0.0", "sample.id" : "s0"}
+    assert measurements["m100"] == {"id" : "m100", "intensity" : "150.0", "sample.id" : "s10"}
+    assert measurements["m101"] == {"id" : "m101", "intensity" : "151.5", "sample.id" : ""}
+    assert measurements["m299"] == {"id" : "m299", "intensity" : "448.5", "sample.id" : ""}
+    assert tagParser.trackedFieldsDict == {"project.id" : "Project1", "project.name" : "Project One", "project.lead" : "Lead", "sample.id" : "last"}
+    assert tagParser.tableRecordsToAddTo == {"sample" : {"project.id", "project.name", "project.lead"}, "measurement" : {"sample.id"}}
+    assert tagParser.tablesAndFieldsToTrack == {"project" : {"id", "name", "lead"}, "sample" : {"id"}}
+
+
+def make_study_sheet(numberOfGroups: int, rowsPerGroup: int, groupsPerID: int, groupsPerSampleGroup: int = 10) -> pandas.core.frame.DataFrame:
+    """Build a one-sheet study of numberOfGroups measurement tag groups, with tracked sample groups and empty groups between them.
+    
+    Measurement ids repeat every groupsPerID tag groups, and sample and empty groups come before every groupsPerSampleGroup tag groups.
+    """
+    width = 6
+    rows = [["#tags", "#sample%track=project.id", "", "", "", ""], [""] * width, 
+            ["#tags", "#project.id", "#.name", "", "", ""], ["", "Project1", "name", "", "", ""], [""] * width]
+    for group in range(numberOfGroups):
+        if group % groupsPerSampleGroup == 0:
+            rows += [["#tags", "#sample.id", "#.group", "", "", ""]]
+            rows += [["", "s" + str(row), str(group), "", "", ""] for row in range(5)]
+            rows += [[""] * width, ["#tags", "#empty" + str(group % 3) + ".id", "", "", "", ""], [""] * width]
+        rows += [["#tags", "#measurement.id", "#.sample.id", "#.intensity", "*#.tags", "#.units"]]
+        rows += [["", "m" + str((group * rowsPerGroup + row) % (rowsPerGroup * groupsPerID)), "s" + str(row % 5), str(row * 1.5), "x;y" if row % 2 else "z", "uM" if group % 2 else "mM"] 
+                 for row in range(rowsPerGroup)]
+        rows += [[""] * width]
+    rows += [["#tags", "#sample%untrack=project.id", "", "", "", ""], [""] * width, ["#tags", "#sample.id", "#.group", "", "", ""], ["", "s0", "last", "", "", ""]]
+    return pandas.DataFrame(rows)
+
+
+def test_tag_group_segments():
+    """Test that consecutive tag groups under the same header row are parsed as segments into the expected records, in the expected order."""
+
+    extract.TagParser.clearHeaderRowCache()
+    tagParser = extract.TagParser()
+    tagParser.parseSheet("benchmark.xlsx", "Sheet1", make_study_sheet(4, 3, 2, 2))
+    assert extract.TagParser.headerRowCacheHits == 3
+    samples = {"s" + str(row) : {"id" : "s" + str(row), "group" : ["0", "2"], "project.id" : "Project1"} for row in range(5)}
+    samples["s0"]["group"].append("last")
+    measurements = {"m" + str(group * 3 + row) : {"id" : "m" + str(group * 3 + row), "sample.id" : "s" + str(row), "intensity" : str(row * 1.5), 
+                                                  "tags" : ["x", "y", "x", "y"] if row % 2 else ["z", "z"], "units" : "uM" if group else "mM"}
+                    for group in range(2) for row in range(3)}
+    expected = {"" : {}, "project" : {"Project1" : {"id" : "Project1", "name" : "name"}}, "sample" : samples, "empty0" : {}, "measurement" : measurements, "empty2" : {}}
+    assert tagParser.extraction == expected
+    assert list(tagParser.extraction) == list(expected)
+    assert all(list(tagParser.extraction[table]) == list(expected[table]) for table in expected)
+    assert all(list(tagParser.extraction["measurement"][id]) == ["id", "sample.id", "intensity", "tags", "units"] for id in measurements)
+    assert tagParser.trackedFieldsDict == {}
+
+    extract.TagParser.clearHeaderRowCache()
+    tagParser = extract.TagParser()
+    tagParser.parseSheet("benchmark.xlsx", "Sheet1", make_study_sheet(40, 30, 7))
+    assert extract.TagParser.headerRowCacheHits == 8
+    assert list(tagParser.extraction) == ["", "project", "sample", "empty0", "measurement", "empty1", "empty2"]
+    assert list(tagParser.extraction["measurement"]) == ["m" + str(index) for index in range(210)]
+    measurement = tagParser.extraction["measurement"]["m0"]
+    assert measurement["intensity"] == "0.0" and measurement["units"] == ["mM", "uM", "mM", "uM", "mM", "uM"]
+    assert tagParser.extraction["sample"]["s0"]["group"] == [str(group) for group in range(0, 40, 10)] + ["last"]
+    assert tagParser.extraction["sample"]["s0"]["project.id"] == "Project1"
+    assert tagParser.extraction["empty0"] == {}
+
+
+def write_multiple_sheet_workbook(path: pathlib.Path, numberOfSheets: int, rowsPerSheet: int):
+    """Write a workbook of numberOfSheets "#export" sheets that share some sample records, with an untagged sheet in the middle."""
+    with pandas.ExcelWriter(path, engine="openpyxl") as writer:
+        for sheet in range(numberOfSheets):
+            rows = [["#tags", "#sample.id", "#.sheet" + str(sheet), "#.last"]]
+            rows += [["", "sample" + str(row + sheet * rowsPerSheet // 2), str(row), str(sheet)] for row in range(rowsPerSheet)]
+            pandas.DataFrame(rows).to_excel(writer, sheet_name="#export" + str(sheet), header=False, index=False)
+            if sheet == 0:
+                pandas.DataFrame([["notes"]]).to_excel(writer, sheet_name="notes", header=False, index=False)
+
+
+def read_metadata_sources(readMetadataArgs: list[tuple]) -> tuple[dict,str,list[dict]]:
+    """Read each metadata source in turn on a new TagParser and return its extraction, stderr output, and sheet timings."""
+    tagParser = extract.TagParser()
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+        for arguments in readMetadataArgs:
+            tagParser.readMetadata(*arguments)
+    return tagParser.extraction, stderr.getvalue(), tagParser.sheetTimings
+
+
+def test_all_sheets_matches_sheet_at_a_time(tmp_path, monkeypatch):
+    """Test that reading every sheet matched by a regular expression gives the same extraction as reading each sheet as its own source."""
+    
+    workbookPath = tmp_path / "sheets.xlsx"
+    write_multiple_sheet_workbook(workbookPath, 4, 50)
+    sheetNames = ["#export" + str(sheet) for sheet in range(4)]
+    assert extract.TagParser.matchingSheetNames(workbookPath.as_posix(), "r'#export'") == sheetNames
+    assert extract.TagParser.matchingSheetNames((tmp_path / "missing.xlsx").as_posix(), "r'#export'") == []
+    
+    expected, _, _ = read_metadata_sources([(workbookPath.as_posix() + ":" + sheetName, "#automate", True, "#modify", True, removeRegex) 
+                                            for sheetName in sheetNames])
+    assert expected["sample"]["sample25"] == {"id" : "sample25", "sheet0" : "25", "sheet1" : "0", "last" : "1"}
+    
+    for jobs in [1, 2]:
+        monkeypatch.setattr(extract, "jobs", jobs)
+        extraction, stderr, sheetTimings = read_metadata_sources([(workbookPath.as_posix() + ":r'#export'", "#automate", True, "#modify", True, 
+                                                                    removeRegex, None, True)])
+        assert extraction == expected
+        assert [timing["sheet"] for timing in sheetTimings] == sheetNames
+        assert stderr.startswith("Sheet timings for \"" + workbookPath.as_posix() + "\":\n    #export0: load ")
+        assert len(stderr.splitlines()) == 5
+    
+    ## Without allSheets only the first matching sheet is read.
+    extraction, _, _ = read_metadata_sources([(workbookPath.as_posix() + ":r'#export'", "#automate", True, "#modify", True, removeRegex)])
+    assert len(extraction["sample"]) == 50
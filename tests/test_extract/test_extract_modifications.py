@@ -8,8 +8,19 @@ import copy
 import json
 import subprocess
 import re
+import io
+import contextlib
+import pickle
 
+import numpy
 import pandas
+import jellyfish
+
+from messes.extract import extract
+
+
+testing_files = pathlib.Path(__file__).parent / "testing_files"
+removeRegex = "_x([0-9a-fA-F]{4})_|\r"
 
 
 @pytest.fixture(scope="module", autouse=True)
@@ -1831,3 +1842,263 @@ def test_regex_in_eval():
 
 
 
+def test_exact_modification_index():
+    """Test that exact modification directives find records through the value index, including records changed by an earlier directive."""
+
+    tagParser = extract.TagParser()
+    tagParser.extraction = {"entity" : {"e" + str(number) : {"id" : "e" + str(number), "type" : "a" if number % 2 else "c", "tags" : ["x", "y" + str(number)]} 
+                                        for number in range(200000)}}
+    modificationDirectives = {"entity" : {"type" : {"exact-first" : {"a" : {"assign" : {"type" : "b"}}},
+                                                    "exact-all" : {"b" : {"assign" : {"flag" : "yes"}}}},
+                                          "tags" : {"exact-unique" : {"x" : {"assign" : {"unique" : "x"}}, "y7" : {"assign" : {"unique" : "y7"}}}}}}
+
+    stderr = io.StringIO()
+    with contextlib.redirect_stderr(stderr):
+        tagParser.modify(modificationDirectives)
+    entities = tagParser.extraction["entity"]
+
+    assert entities["e1"]["type"] == "b"
+    assert entities["e1"]["flag"] == "yes"
+    assert [record["id"] for record in entities.values() if "flag" in record] == ["e1"]
+    assert [record["id"] for record in entities.values() if "unique" in record] == ["e7"]
+    assert stderr.getvalue().count("Warning: modification directive #entity.type.exact-first.a matches more than one record.") == 99999
+
+
+@pytest.mark.parametrize("numberOfRecords, isIndexed", [(10, False), (2000, True)])
+def test_exact_modification_index_threshold(numberOfRecords, isIndexed, monkeypatch):
+    """Test that a single exact comparison type uses the value index once directives times records is over the threshold."""
+    
+    indexedFields = []
+    findExactMatchCandidates = extract.TagParser._findExactMatchCandidates
+    def recordingFindExactMatchCandidates(self, tableKey, fieldKey, *args):
+        indexedFields.append((tableKey, fieldKey))
+        return findExactMatchCandidates(self, tableKey, fieldKey, *args)
+    monkeypatch.setattr(extract.TagParser, "_findExactMatchCandidates", recordingFindExactMatchCandidates)
+    
+    tagParser = extract.TagParser()
+    tagParser.extraction = {"entity" : {"e" + str(number) : {"id" : "e" + str(number), "type" : "a" if number % 2 else "c"} 
+                                        for number in range(numberOfRecords)}}
+    modificationDirectives = {"entity" : {"type" : {"exact-all" : {"a" : {"assign" : {"flag" : "yes"}}}}}}
+    tagParser.modify(modificationDirectives)
+    
+    assert indexedFields == ([("entity", "type")] if isIndexed else [])
+    assert [record["id"] for record in tagParser.extraction["entity"].values() if "flag" in record] == ["e" + str(number) for number in range(1, numberOfRecords, 2)]
+
+
+
+def test_regex_modification_matcher():
+    """Test that regex modification directives match distinct values once and still see list values changed in place by an earlier directive."""
+
+    tagParser = extract.TagParser()
+    tagParser.extraction = {"protocol" : {"p" + str(number) : {"id" : "p" + str(number), "type" : "type" + str(number % 20), "names" : ["proto" + str(number % 3), "p1"]} 
+                                          for number in range(1000)}}
+    modificationDirectives = {"protocol" : {"type" : {"regex-all" : {"r'^type" + str(number) + "$'" : {"assign" : {"match" : str(number)}} for number in range(300)}},
+                                            "names" : {"regex-all" : {"r'^p1$'" : {"append" : {"names" : "0"}}, "r'^p10$'" : {"assign" : {"appended" : "yes"}}}}}}
+
+    tagParser.modify(modificationDirectives)
+    protocols = tagParser.extraction["protocol"]
+
+    assert all(record["match"] == str(int(record["id"][1:]) % 20) for record in protocols.values())
+    assert protocols["p4"]["names"] == ["proto10", "p10"]
+    assert protocols["p4"]["appended"] == "yes"
+
+
+
+def test_levenshtein_index_matches_brute_force():
+    """Test that the levenshtein index finds the same nearest strings as comparing against every string."""
+
+    rng = numpy.random.default_rng(8)
+    items = list(dict.fromkeys("".join(rng.choice(list("abcdé"), rng.integers(0, 9))) for _ in range(2000)))
+    index = extract.LevenshteinIndex(items)
+    for query in ["", "abc", "zzzz", "édcba", "aaaaaaaaaaaa"] + items[:50]:
+        distances = [jellyfish.levenshtein_distance(query, item) for item in items]
+        distance, nearest = index.nearest(query)
+        assert distance == min(distances)
+        assert sorted(nearest) == sorted(item for item, itemDistance in zip(items, distances) if itemDistance == distance)
+    assert extract.LevenshteinIndex([]).nearest("abc") == (None, [])
+
+
+def test_levenshtein_modification_index(monkeypatch):
+    """Test that levenshtein modification directives pick the nearest records through the index, serially and in worker processes."""
+
+    rng = numpy.random.default_rng(3)
+    names = ["sample_" + "".join(rng.choice(list("ABCDEFGH0123456789"), 8)) for _ in range(50000)]
+    extraction = {"entity" : {"e" + str(number) : {"id" : "e" + str(number), "name" : names[number]} for number in range(50000)}}
+    extraction["entity"]["e7"]["name"] = ["other", names[7]]
+    extraction["entity"]["e8"]["name"] = []
+    modificationDirectives = {"entity" : {"name" : {"levenshtein-all" : {names[number * 100][:-1] + "Z" : {"assign" : {"fixed" : str(number)}} for number in range(100)},
+                                                    "levenshtein-first" : {names[7] : {"assign" : {"first" : "yes"}}}}}}
+
+    results = []
+    for jobs in [1, 2]:
+        monkeypatch.setattr(extract, "jobs", jobs)
+        monkeypatch.setattr(extract.TagParser, "levenshteinParallelThreshold", 1)
+        tagParser = extract.TagParser()
+        tagParser.extraction = copy.deepcopy(extraction)
+        tagParser.modify(copy.deepcopy(modificationDirectives))
+        results.append(tagParser.extraction)
+
+    assert results[0] == results[1]
+    entities = results[0]["entity"]
+    assert all(entities["e" + str(number * 100)]["fixed"] == str(number) for number in range(100))
+    assert sum("fixed" in record for record in entities.values()) == 100
+    assert entities["e7"]["first"] == "yes"
+    assert "first" not in entities["e8"]
+
+
+
+def test_evaluator_caches_field_tests_and_evaluates_once(monkeypatch):
+    """Test that the evaluator resolves field tests once per record shape and runs its code once per record."""
+
+    evalCalls = []
+    def countingEval(*args):
+        evalCalls.append(args)
+        return eval(*args)
+    monkeypatch.setattr(extract, "eval", countingEval, raising=False)
+
+    records = [dict({"id" : "r" + str(number), "name" : "n" + str(number)}, **{"field" + str(field) : str(field) for field in range(30)}) for number in range(1000)]
+    records.append({"id" : "r", "names" : "a", "name" : "b"})
+    evaluator = extract.Evaluator("#r'^name'# + '-' + #id# + #r'field29'#")
+
+    values = [evaluator.evaluate(record) for record in records if evaluator.hasRequiredFields(record)]
+
+    assert values[:2] == ["n0-r029", "n1-r129"]
+    assert len(values) == len(evalCalls) == 1000
+    assert len(evaluator.matchedFieldsCache) == 2
+    assert evaluator.evaluate({"id" : "r", "names" : "a", "name" : "b", "field29" : "c"}) == "a-rc"
+
+
+def test_levenshtein_all_assigns_see_earlier_assigns():
+    """Test that assign eval directives applied to every record matching a levenshtein-all directive see fields assigned before them."""
+
+    tagParser = extract.TagParser()
+    tagParser.extraction = {"entity" : {"e" + str(number) : {"id" : "e" + str(number), "name" : "sample" + str(number % 2)} for number in range(6)}}
+    modificationDirectives = {"entity" : {"name" : {"levenshtein-all" : {"sample0" : {"assign" : {"label" : "eval(#id# + '-' + #name#)", 
+                                                                                                 "name" : "renamed", 
+                                                                                                 "copy" : "eval(#name#)",
+                                                                                                 "missing" : "eval(#missing#)"}}}}}}
+
+    stderr = io.StringIO()
+    with contextlib.redirect_stderr(stderr):
+        tagParser.modify(modificationDirectives)
+    entities = tagParser.extraction["entity"]
+
+    assert entities["e2"] == {"id" : "e2", "name" : "renamed", "label" : "e2-sample0", "copy" : "renamed"}
+    assert entities["e3"] == {"id" : "e3", "name" : "sample1"}
+    assert stderr.getvalue().count("Warning: Field assignment directive \"missing\" missing required field(s) \"missing\"") == 3
+
+
+
+def test_modification_plan_is_reusable_and_picklable():
+    """Test that a compiled modification plan gives the same results as the directives, is not changed by modify, and survives pickling."""
+
+    extraction = {"protocol" : {"p" + str(number) : {"id" : "p" + str(number), "type" : "type" + str(number % 3), "name" : "name" + str(number)} for number in range(30)}}
+    modificationDirectives = {"protocol" : {"type" : {"regex-all" : {"r'^type[12]$'" : {"assign" : {"label" : "eval(#r'^nam'# + '-' + #type#)"}, 
+                                                                                      "regex" : {"name" : ["r'name'", "r'protocol'"]}}},
+                                                      "exact-first" : {"type0" : {"assign" : {"first" : "yes"}}}}}}
+    plan = extract.ModificationPlan(modificationDirectives)
+    planBytes = pickle.dumps(plan)
+
+    expected = extract.TagParser()
+    expected.extraction = copy.deepcopy(extraction)
+    with contextlib.redirect_stderr(io.StringIO()):
+        expected.modify(copy.deepcopy(modificationDirectives))
+
+    for reusedPlan in [plan, plan, pickle.loads(planBytes)]:
+        tagParser = extract.TagParser()
+        tagParser.extraction = copy.deepcopy(extraction)
+        with contextlib.redirect_stderr(io.StringIO()):
+            tagParser.modify(reusedPlan)
+        assert tagParser.extraction == expected.extraction
+        assert tagParser.modificationDirectives == modificationDirectives
+        assert tagParser.unusedModifications == expected.unusedModifications
+
+    assert expected.extraction["protocol"]["p1"]["label"] == "name1-type1"
+    assert expected.extraction["protocol"]["p1"]["name"] == "protocol1"
+    assert pickle.dumps(plan) == planBytes
+    with pytest.raises(AttributeError):
+        plan.compiledDirectives = {}
+
+
+def test_readMetadata_reuses_modification_plan():
+    """Test that reading several sources with the same modification directives compiles them once."""
+
+    test_file = (testing_files / "base_source.xlsx").as_posix()
+    tagParser = extract.TagParser()
+    with contextlib.redirect_stderr(io.StringIO()):
+        tagParser.readMetadata(test_file, "#automate", False, "#modify", False, removeRegex)
+        plan = tagParser.modificationPlan
+        tagParser.readMetadata(test_file, "#automate", False, "#modify", False, removeRegex)
+
+    assert tagParser.modificationPlan is plan
+
+
+def test_modification_plan_recompiled_when_directives_change_in_place():
+    """Test that changing the directives a plan was compiled from in place gives a new plan with the changed directives."""
+    
+    modificationDirectives = {"protocol" : {"type" : {"exact-all" : {"type0" : {"assign" : {"label" : "first"}}}}}}
+    tagParser = extract.TagParser()
+    tagParser.extraction = {"protocol" : {"p0" : {"id" : "p0", "type" : "type0"}}}
+    tagParser._modifyAndMerge({}, modificationDirectives)
+    plan = tagParser.modificationPlan
+    
+    modificationDirectives["protocol"]["type"]["exact-all"]["type0"]["assign"]["label"] = "second"
+    assert plan.modificationDirectives["protocol"]["type"]["exact-all"]["type0"]["assign"]["label"] == "first"
+    
+    currentMetadata = tagParser.extraction
+    tagParser.extraction = {"protocol" : {"p1" : {"id" : "p1", "type" : "type0"}}}
+    tagParser._modifyAndMerge(currentMetadata, modificationDirectives)
+    
+    assert tagParser.modificationPlan is not plan
+    assert tagParser.extraction["protocol"]["p0"]["label"] == "first"
+    assert tagParser.extraction["protocol"]["p1"]["label"] == "second"
+
+
+def write_modification_csv(path: pathlib.Path, numberOfRows: int):
+    """Write a modification directives csv of numberOfRows exact-all directives with assign, eval assign, and regex modifications."""
+    with open(path, "w") as csvFile:
+        csvFile.write("#tags,#sample.id.value,#sample.type.assign,#sample.note.regex,#sample.score.assign,#match=all\n")
+        for row in range(numberOfRows):
+            csvFile.write(",s" + str(row) + ",type" + str(row) + ",\"r'a" + str(row) + "',r'b'\",eval(#score# * " + str(row) + "),\n")
+
+
+def read_directives(tagParser: extract.TagParser, source: str, sheetName: str, directiveType: str) -> tuple:
+    """Run readDirectives and return the directives and the stderr output."""
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+        directives = tagParser.readDirectives(source, sheetName, directiveType, removeRegex)
+    return directives, stderr.getvalue()
+
+
+def test_directive_cache_matches_parsed_directives(tmp_path, monkeypatch):
+    """Test that directives read from the cache are the same as parsed directives and that they are not parsed again."""
+
+    sources = [((testing_files / test_file).as_posix(), sheetName, directiveType) 
+               for test_file in ["base_source.xlsx", "automation_test.xlsx", "modification_duplicate_assign_warning.xlsx", "eval_in_modification.xlsx"] 
+               for sheetName, directiveType in [("#automate", "automation"), ("#modify", "modification")]]
+    csvPath = tmp_path / "modifications.csv"
+    write_modification_csv(csvPath, 10)
+    sources.append((csvPath.as_posix(), "", "modification"))
+    
+    expected = [read_directives(extract.TagParser(), *source) for source in sources]
+    assert any(stderr for directives, stderr in expected)
+    
+    monkeypatch.setattr(extract, "extractionCache", extract.ExtractionCache(tmp_path / "cache"))
+    ## The first read stores each entry and the second is read from the cache.
+    for run in range(2):
+        if run == 1:
+            monkeypatch.setattr(extract.TagParser, "_parseModificationSheet", None)
+            monkeypatch.setattr(extract.TagParser, "_parseAutomationSheet", None)
+        for source, (expectedDirectives, expectedStderr) in zip(sources, expected):
+            tagParser = extract.TagParser()
+            assert read_directives(tagParser, *source) == (expectedDirectives, expectedStderr)
+            if source[2] == "modification" and expectedDirectives is not None:
+                assert tagParser.modificationPlan.modificationDirectives == expectedDirectives
+                assert tagParser.modificationPlan.regexObjects.keys() == extract.ModificationPlan(expectedDirectives).regexObjects.keys()
+    
+    tagParser = extract.TagParser()
+    tagParser.extraction = {"sample" : {"s3" : {"id" : "s3", "note" : "a3", "score" : 2}}}
+    directives, _ = read_directives(tagParser, csvPath.as_posix(), "", "modification")
+    with contextlib.redirect_stderr(io.StringIO()):
+        tagParser.modify(tagParser.modificationPlan)
+    assert tagParser.extraction["sample"]["s3"] == {"id" : "s3", "type" : "type3", "note" : "b", "score" : "6"}